@@ -23,27 +23,24 @@ async def input_boolean(prompt: str, default: bool) -> bool:
 async def get_all_images(
         client: DoarRobotAPIClient,
         jpeg_quality: int = 80,
-        img_max_length: Optional[int] = 320
+        img_max_length: Optional[int] = 320,
+        after_ts: Optional[float] = None
 ) -> list[np.ndarray]:
-    available_cameras = await client.get_camera_list()
-
-    # 并行请求
-    tasks = []
-    for camera in available_cameras:
-        tasks.append(client.get_camera_image(
-            camera,
-            quality=jpeg_quality,
-            max_length=img_max_length
-        ))
-
-    # 等待所有请求完成
-    results = await asyncio.gather(*tasks)
+    # 一次请求获取时间对齐的所有摄像头图像, 给出 after_ts 时只返回其后采集的图像
+    snapshot = await client.get_all_camera_frames(
+        quality=jpeg_quality,
+        max_length=img_max_length,
+        aligned=True,
+        after_ts=after_ts
+    )
+    if not snapshot["aligned"]:
+        print(f"摄像头图像未对齐, 采集时间相差 {snapshot['skew_ms']:.1f} 毫秒")
 
     images = []
     # 处理结果
-    for camera, image in zip(available_cameras, results):
-        if image is not None:
-            images.append(image)
+    for camera, frame in snapshot["frames"].items():
+        if frame["image"] is not None:
+            images.append(frame["image"])
 
     return images
 
@@ -105,7 +102,8 @@ async def process(
         api_key: str,
         port: int = 11451,
         dont_verify: bool = False,
-        dont_verify_action: bool = False
+        dont_verify_action: bool = False,
+        action_settle_time: float = 3.0
 ) -> None:
     robot = DoarRobotAPIClient()
     await robot.connect(ip, port)
@@ -119,10 +117,13 @@ async def process(
 
     current_task = 1
     retry_count = 0
+    # 执行指令后, 下一步只使用指令发出 action_settle_time 秒之后采集的图像
+    frames_after_ts: Optional[float] = None
     try:
         while True:
             try:
-                img_prompt = await get_all_images(robot)
+                img_prompt = await get_all_images(robot, after_ts=frames_after_ts)
+                frames_after_ts = None
                 for i, img in enumerate(img_prompt):
                     await displayer.imshow(title=f"Image_{i}", img=img)
                 retry_count = 0
@@ -173,14 +174,16 @@ async def process(
                 if dont_verify_action or await input_boolean(prompt=f"是否执行([y]/n)> ", default=True):
                     status = await robot.arm_parse_prompt(arm_action)
                     print(f"执行结果: {status}")
-                    await asyncio.sleep(3)
+                    if robot.last_command_ts is not None:
+                        frames_after_ts = robot.last_command_ts + action_settle_time
 
             if chassis_action is not None and chassis_action != "" and chassis_action != "task_finish":
                 print(f"解析到底盘指令: <{chassis_action}>")
                 if dont_verify_action or await input_boolean(prompt=f"是否执行([y]/n)> ", default=True):
                     status = await robot.chassis_parse_prompt(chassis_action)
                     print(f"执行结果: {status}")
-                    await asyncio.sleep(3)
+                    if robot.last_command_ts is not None:
+                        frames_after_ts = robot.last_command_ts + action_settle_time
 
             if chassis_action == "task_finish" or arm_action == "task_finish":
                 print("任务被标记为完成")
@@ -28,27 +28,24 @@ async def input_boolean(prompt: str, default: bool) -> bool:
 async def get_all_images(
         client: DoarRobotAPIClient,
         jpeg_quality: int = 80,
-        img_max_length: Optional[int] = 640
+        img_max_length: Optional[int] = 640,
+        after_ts: Optional[float] = None
 ) -> list[np.ndarray]:
-    available_cameras = await client.get_camera_list()
-
-    # 并行请求
-    tasks = []
-    for camera in available_cameras:
-        tasks.append(client.get_camera_image(
-            camera,
-            quality=jpeg_quality,
-            max_length=img_max_length
-        ))
-
-    # 等待所有请求完成
-    results = await asyncio.gather(*tasks)
+    # 一次请求获取时间对齐的所有摄像头图像, 给出 after_ts 时只返回其后采集的图像
+    snapshot = await client.get_all_camera_frames(
+        quality=jpeg_quality,
+        max_length=img_max_length,
+        aligned=True,
+        after_ts=after_ts
+    )
+    if not snapshot["aligned"]:
+        print(f"摄像头图像未对齐, 采集时间相差 {snapshot['skew_ms']:.1f} 毫秒")
 
     images = []
     # 处理结果
-    for camera, image in zip(available_cameras, results):
-        if image is not None:
-            images.append(image)
+    for camera, frame in snapshot["frames"].items():
+        if frame["image"] is not None:
+            images.append(frame["image"])
 
     return images
 
@@ -74,7 +71,8 @@ async def process(
     try:
         while True:
             try:
-                img_prompt = await get_all_images(robot)
+                # 保证图像是在上一条指令发出之后采集的
+                img_prompt = await get_all_images(robot, after_ts=robot.last_command_ts)
                 retry_count = 0
             except httpx.TimeoutException:
                 if retry_count < 5:
@@ -8,6 +8,16 @@ from rlb import RLBTask, RLBTaskSchema, RLBTaskSchemaType, DoarRobotAPIClient
 from dataset_bulider import DatasetManager
 from utils import AioImshow, safe_input
 
+
+def append_step(steps: list[dict], valid_prompts: dict[str, set[str]], target: str, prompt: str) -> None:
+    # 与单独发送指令时一样不区分大小写; 无效的指令只跳过这一步, 不影响另一个执行器
+    prompt = prompt.strip().lower()
+    if prompt not in valid_prompts.get(target, set()):
+        print(f"命令无效, 已跳过: {target} {prompt}")
+        return
+    steps.append({"target": target, "prompt": prompt, "settle": 3})
+
+
 async def record(
         tasks: list[RLBTask],
         ip: str,
@@ -20,6 +30,8 @@ async def record(
 
     client = DoarRobotAPIClient()
     await client.connect(ip, port)
+    # 可用指令以服务端为准
+    valid_prompts = await client.get_sequence_prompts()
 
     dataset_manager = DatasetManager(target_folder=save_dir, project_name=project_name)
 
@@ -31,20 +43,16 @@ async def record(
 
     try:
         while True:
-            available_cameras = await client.get_camera_list()
-
             current_images = []
 
-            # 并行请求
-            r_tasks = []
-            for camera in available_cameras:
-                r_tasks.append(client.get_camera_image(camera, quality=JPEG_QUALITY, max_length=IMG_MAX_LENGTH))
-
-            # 等待所有请求完成
-            results = await asyncio.gather(*r_tasks)
+            # 一次请求获取时间对齐的所有摄像头图像
+            snapshot = await client.get_all_camera_frames(quality=JPEG_QUALITY, max_length=IMG_MAX_LENGTH, aligned=True)
+            if not snapshot["aligned"]:
+                print(f"摄像头图像未对齐, 采集时间相差 {snapshot['skew_ms']:.1f} 毫秒")
 
             # 处理结果
-            for camera, image in zip(available_cameras, results):
+            for camera, frame in snapshot["frames"].items():
+                image = frame["image"]
                 if image is not None:
                     current_images.append(image)
                     await displayer.imshow(f"Camera: {camera}", image)
@@ -162,9 +170,10 @@ async def record(
             result = await safe_input()
             if result is None or result == "":
                 result = arm_prompt
+            # 机械臂与底盘命令作为一个序列在服务端执行, 每步之后等待3秒
+            steps = []
             if result is not None and result != "task_finish":
-                print(await client.arm_parse_prompt(result))
-                await asyncio.sleep(3)
+                append_step(steps, valid_prompts, "arm", result)
 
             if choice_prompt is not None:
                 print(f"您希望执行你输入的底盘命令<{choice_prompt}>或是覆写其吗?")
@@ -179,8 +188,14 @@ async def record(
             if result is None or result == "":
                 result = choice_prompt
             if result is not None and result != "task_finish":
-                print(await client.chassis_parse_prompt(result))
-                await asyncio.sleep(3)
+                append_step(steps, valid_prompts, "chassis", result)
+
+            if steps:
+                try:
+                    job = await client.run_sequence(steps)
+                    print(f"执行结果: {job['status']} {job['error'] or ''}")
+                except ValueError as e:
+                    print(f"命令无效: {e}")
 
 
     except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
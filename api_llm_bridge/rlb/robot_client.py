@@ -1,19 +1,56 @@
 import asyncio
 import base64
-from typing import Optional, List
+import json
+from typing import AsyncIterator, Optional, List
 
 import httpx
+import websockets
 import numpy as np
 import cv2
 
+def _decode_frame(headers, body: bytes) -> dict:
+    # 帧信息来自响应头或 multipart 分段头, 头名称为小写
+    nparr = np.frombuffer(body, np.uint8)
+    return {
+        "seq": int(headers["x-frame-seq"]),
+        "capture_ts": float(headers["x-capture-ts"]),
+        "receive_ts": float(headers["x-receive-ts"]),
+        "age_ms": float(headers["x-frame-age-ms"]),
+        "image": cv2.imdecode(nparr, cv2.IMREAD_COLOR),
+    }
+
+
+def _split_multipart(buffer: bytes, boundary: bytes) -> Optional[tuple[dict, bytes, bytes]]:
+    """
+    从缓冲区开头取出一个完整的分段, 返回 (分段头, 内容, 剩余数据); 数据不完整时返回 None
+    """
+    header_end = buffer.find(b"\r\n\r\n")
+    if not buffer.startswith(boundary + b"\r\n") or header_end < 0:
+        return None
+    headers = {}
+    for line in buffer[len(boundary) + 2:header_end].decode().split("\r\n"):
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body_end = header_end + 4 + int(headers["content-length"])
+    if len(buffer) < body_end + 2:
+        return None
+    return headers, buffer[header_end + 4:body_end], buffer[body_end + 2:]
+
+
 class DoarRobotAPIClient:
     def __init__(self):
         self._client: Optional[httpx.AsyncClient] = None
+        self._ws_url: Optional[str] = None
+        # 最近一条指令发出时的服务端时间, 可作为 after_ts 获取指令之后采集的帧
+        self.last_command_ts: Optional[float] = None
+        # 最近一条指令的id, 可用 get_command 查询是否已发送或被合并
+        self.last_command_id: Optional[str] = None
 
     async def connect(self, server_ip, server_port=11451):
         self._client = httpx.AsyncClient(
             base_url=f"http://{server_ip}:{server_port}"
         )
+        self._ws_url = f"ws://{server_ip}:{server_port}/ws"
 
     async def disconnect(self):
         if self._client:
@@ -28,8 +65,128 @@ class DoarRobotAPIClient:
         data = response.json()
         return data["nodes"]
 
+    @staticmethod
+    def _long_poll_params(params: dict, after_seq: Optional[int], after_ts: Optional[float],
+                          timeout: float) -> httpx.Timeout:
+        # 长轮询请求的读超时需要比服务端等待时间更长
+        if after_seq is None and after_ts is None:
+            return httpx.Timeout(5.0)
+        if after_seq is not None:
+            params["after_seq"] = after_seq
+        if after_ts is not None:
+            params["after_ts"] = after_ts
+        params["timeout"] = timeout
+        return httpx.Timeout(5.0, read=timeout + 5.0)
+
+    async def get_camera_frame(self, camera_node_name: str, quality: int = 90,
+                               max_length: Optional[int] = None, image_format: str = "jpeg",
+                               after_seq: Optional[int] = None, after_ts: Optional[float] = None,
+                               timeout: float = 10, etag: Optional[str] = None) -> Optional[dict]:
+        """
+        通过二进制接口获取最新帧, 返回包含 seq / capture_ts / receive_ts / age_ms / etag / image 的字典.
+
+        after_seq / after_ts: 等待 seq 更大或采集时间更晚的帧, 最多等待 timeout 秒
+        etag: 上一帧的 etag, 帧没有更新时不重复下载
+        没有帧、等待超时或帧没有更新时返回 None
+        """
+        params = {
+            "quality": quality,
+            "format": image_format
+        }
+        if max_length:
+            params["max_length"] = max_length
+        request_timeout = self._long_poll_params(params, after_seq, after_ts, timeout)
+        headers = {"If-None-Match": etag} if etag is not None else None
+
+        response = await self._client.get(f"/camera/node/{camera_node_name}/raw", params=params,
+                                          headers=headers, timeout=request_timeout)
+        if response.status_code != 200:
+            return None
+        frame = _decode_frame(response.headers, response.content)
+        frame["etag"] = response.headers.get("etag", None)
+        return frame
+
+    async def get_all_camera_frames(self, quality: int = 90, max_length: Optional[int] = None,
+                                    aligned: bool = False, tolerance_ms: float = 50,
+                                    cameras: Optional[List[str]] = None, after_ts: Optional[float] = None,
+                                    timeout: float = 10) -> dict:
+        """
+        一次请求获取所有摄像头的最新帧, 返回格式与 get_camera_snapshot 相同.
+        aligned 为 True 时返回采集时间最接近的一组帧;
+        给出 after_ts 时等待各摄像头采集时间晚于 after_ts 的帧, 最多等待 timeout 秒
+        """
+        params = {"quality": quality, "aligned": str(aligned).lower(), "tolerance_ms": tolerance_ms}
+        if max_length:
+            params["max_length"] = max_length
+        if cameras:
+            params["cameras"] = ",".join(cameras)
+        request_timeout = self._long_poll_params(params, None, after_ts, timeout)
+
+        response = await self._client.get("/camera/all", params=params, timeout=request_timeout)
+        response.raise_for_status()
+        boundary = b"--" + response.headers["content-type"].split("boundary=")[-1].encode()
+        frames = {}
+        buffer = response.content
+        while (part := _split_multipart(buffer, boundary)) is not None:
+            headers, body, buffer = part
+            frames[headers["x-camera"]] = _decode_frame(headers, body)
+
+        return {
+            "frames": frames,
+            "skew_ms": float(response.headers.get("x-skew-ms", 0)),
+            "aligned": response.headers.get("x-aligned", "true") == "true",
+        }
+
+    async def stream_camera(self, camera_node_name: str, fps: float = 10, quality: int = 80,
+                            max_length: Optional[int] = None) -> AsyncIterator[dict]:
+        """
+        通过一个长连接持续接收摄像头帧 (multipart/x-mixed-replace), 每帧的字典格式与 get_camera_frame 相同
+        """
+        params = {
+            "fps": fps,
+            "quality": quality
+        }
+        if max_length:
+            params["max_length"] = max_length
+
+        async with self._client.stream("GET", f"/camera/stream/{camera_node_name}", params=params,
+                                       timeout=httpx.Timeout(5.0, read=None)) as response:
+            boundary = b"--" + response.headers["content-type"].split("boundary=")[-1].encode()
+            buffer = b""
+            async for chunk in response.aiter_bytes():
+                buffer += chunk
+                while (part := _split_multipart(buffer, boundary)) is not None:
+                    headers, body, buffer = part
+                    yield _decode_frame(headers, body)
+
+    async def subscribe(self, cameras: Optional[List[str]] = None, fps: float = 10, quality: int = 80,
+                        max_length: Optional[int] = None, stats: bool = True) -> AsyncIterator[dict]:
+        """
+        通过 WebSocket 接收服务端推送的帧、统计与指令确认.
+        帧消息的 image 字段为解码后的图像, 其他消息原样返回
+        """
+        params = {"fps": fps, "quality": quality, "stats": str(stats).lower()}
+        if cameras:
+            params["cameras"] = ",".join(cameras)
+        if max_length:
+            params["max_length"] = max_length
+
+        url = f"{self._ws_url}?{httpx.QueryParams(params)}"
+        async with websockets.connect(url, max_size=None) as ws:
+            async for data in ws:
+                message = json.loads(data)
+                if message["type"] == "frame":
+                    nparr = np.frombuffer(await ws.recv(), np.uint8)
+                    message["image"] = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                yield message
+
     async def get_camera_image(self, camera_node_name: str, quality: int = 90,
-                               max_length: Optional[int] = None, encoding: str = "utf-8") -> Optional[np.ndarray]:
+                               max_length: Optional[int] = None, encoding: str = "utf-8",
+                               raw: bool = True) -> Optional[np.ndarray]:
+        if raw:
+            frame = await self.get_camera_frame(camera_node_name, quality=quality, max_length=max_length)
+            return frame["image"] if frame is not None else None
+
         params = {
             "quality": quality,
             "encoding": encoding
@@ -47,14 +204,146 @@ class DoarRobotAPIClient:
         else:
             return None
 
+    @staticmethod
+    def _decode_history_frames(frames: list[dict]) -> list[dict]:
+        for frame in frames:
+            nparr = np.frombuffer(base64.b64decode(frame["image"]), np.uint8)
+            frame["image"] = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        return frames
+
+    async def get_camera_history(self, camera_node_name: str, count: int = 1) -> List[dict]:
+        response = await self._client.get(f"/camera/history/{camera_node_name}/latest", params={"count": count})
+        return self._decode_history_frames(response.json().get("frames", []))
+
+    async def get_camera_history_range(self, camera_node_name: str, from_seq: Optional[int] = None,
+                                       to_seq: Optional[int] = None) -> List[dict]:
+        params = {}
+        if from_seq is not None:
+            params["from_seq"] = from_seq
+        if to_seq is not None:
+            params["to_seq"] = to_seq
+
+        response = await self._client.get(f"/camera/history/{camera_node_name}/range", params=params)
+        return self._decode_history_frames(response.json().get("frames", []))
+
+    async def get_camera_frame_near(self, camera_node_name: str, timestamp: float,
+                                    before: bool = False) -> Optional[dict]:
+        params = {"ts": timestamp, "before": str(before).lower()}
+        response = await self._client.get(f"/camera/history/{camera_node_name}/nearest", params=params)
+        frames = self._decode_history_frames(response.json().get("frames", []))
+        return frames[0] if frames else None
+
+    async def get_camera_snapshot(self, quality: int = 90, max_length: Optional[int] = None,
+                                  tolerance_ms: float = 50, cameras: Optional[List[str]] = None) -> dict:
+        """
+        一次请求获取所有摄像头采集时间最接近的一组图像, 返回的 skew_ms 为各帧采集时间的最大差值
+        """
+        params = {"quality": quality, "tolerance_ms": tolerance_ms}
+        if max_length:
+            params["max_length"] = max_length
+        if cameras:
+            params["cameras"] = ",".join(cameras)
+
+        response = await self._client.get("/camera/snapshot", params=params)
+        data = response.json()
+        for frame in data["frames"].values():
+            if frame["image"]:
+                nparr = np.frombuffer(base64.b64decode(frame["image"]), np.uint8)
+                frame["image"] = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        return data
+
+    def _record_command_ts(self, response: httpx.Response) -> None:
+        command_ts = response.headers.get("x-command-ts", None)
+        if command_ts is not None:
+            self.last_command_ts = float(command_ts)
+        command_id = response.headers.get("x-command-id", None)
+        if command_id is not None:
+            self.last_command_id = command_id
+
     async def arm_move(self, prompt: str) -> str:
         response = await self._client.post(f"/arm/{prompt}")
+        self._record_command_ts(response)
+        return response.text
+
+    async def arm_move_delta(
+            self,
+            dx: float = 0.0,
+            dy: float = 0.0,
+            dz: float = 0.0,
+            roll: float = 0.0,
+            pitch: float = 0.0,
+            yaw: float = 0.0,
+            speed: float = 0.1,
+    ) -> str:
+        """
+        机械臂末端一次完成相对移动, 平移单位为米, 旋转单位为弧度; 超出服务端的工作空间限制时抛出 ValueError
+        """
+        response = await self._client.post("/arm/move", json={
+            "dx": dx, "dy": dy, "dz": dz, "roll": roll, "pitch": pitch, "yaw": yaw, "speed": speed,
+        })
+        if response.status_code != 200:
+            raise ValueError(response.text)
+        self._record_command_ts(response)
         return response.text
 
     async def chassis_move(self, prompt: str) -> str:
         response = await self._client.post(f"/chassis/{prompt}")
+        self._record_command_ts(response)
         return response.text
 
+    async def get_command(self, command_id: Optional[str] = None) -> dict:
+        """
+        查询指令状态 (queued / sent / merged / failed), 默认查询最近一条指令
+        """
+        command_id = command_id if command_id is not None else self.last_command_id
+        response = await self._client.get(f"/command/{command_id}")
+        if response.status_code != 200:
+            raise ValueError(response.text)
+        return response.json()
+
+    async def chassis_velocity(self, linear: float, angular: float = 0.0, duration: float = 1.0) -> dict:
+        """
+        底盘以给定速度持续运动 duration 秒 (服务端限制最长时间), 到期后服务端自动停止;
+        需要持续运动时在到期前再次调用即可
+        """
+        response = await self._client.post(
+            "/chassis/velocity", json={"linear": linear, "angular": angular, "duration": duration}
+        )
+        if response.status_code != 200:
+            raise ValueError(response.text)
+        self._record_command_ts(response)
+        return response.json()
+
+    async def run_sequence(self, steps: List[dict], wait: bool = True, timeout: float = 30) -> dict:
+        """
+        提交一组在服务端按顺序执行的指令, 每一步为 {"target": "arm"|"chassis", "prompt": ..., "duration": 秒, "settle": 秒}.
+        wait 为 True 时等待序列结束 (最多 timeout 秒), 返回序列状态
+        """
+        response = await self._client.post("/sequence", json={"steps": steps})
+        if response.status_code != 200:
+            raise ValueError(response.text)
+        job = response.json()
+        if wait:
+            job = await self.get_sequence(job["job_id"], wait=timeout)
+        return job
+
+    async def get_sequence_prompts(self) -> dict[str, set[str]]:
+        """
+        指令序列中各执行器可用的指令, 由服务端给出, 与提交序列时的校验一致
+        """
+        response = await self._client.get("/sequence/prompts")
+        return {target: set(prompts) for target, prompts in response.json().items()}
+
+    async def get_sequence(self, job_id: str, wait: Optional[float] = None) -> dict:
+        params = {"wait": wait} if wait is not None else None
+        request_timeout = httpx.Timeout(5.0, read=wait + 5.0) if wait is not None else httpx.Timeout(5.0)
+        response = await self._client.get(f"/sequence/{job_id}", params=params, timeout=request_timeout)
+        return response.json()
+
+    async def cancel_sequence(self, job_id: str) -> dict:
+        response = await self._client.post(f"/sequence/{job_id}/cancel")
+        return response.json()
+
     # Arm movement convenience methods
     async def arm_forward(self) -> str:
         return await self.arm_move("forward")
@@ -142,20 +431,19 @@ async def _test():
     client = DoarRobotAPIClient()
     await client.connect("192.168.99.124", 11451)
 
-    try:
-        while True:
-            available_cameras = await client.get_camera_list()
+    # 每个摄像头一个长连接, 后台持续接收最新帧
+    latest_images = {}
 
-            # 并行请求
-            tasks = []
-            for camera in available_cameras:
-                tasks.append(client.get_camera_image(camera, quality=JPEG_QUALITY, max_length=IMG_MAX_LENGTH))
+    async def receive(camera: str):
+        async for frame in client.stream_camera(camera, fps=STREAM_FPS, quality=JPEG_QUALITY,
+                                                max_length=IMG_MAX_LENGTH):
+            latest_images[camera] = frame["image"]
 
-            # 等待所有请求完成
-            results = await asyncio.gather(*tasks)
+    streams = [asyncio.create_task(receive(camera)) for camera in await client.get_camera_list()]
 
-            # 处理结果
-            for camera, image in zip(available_cameras, results):
+    try:
+        while True:
+            for camera, image in list(latest_images.items()):
                 if image is not None:
                     cv2.imshow(f"Camera: {camera}", image)
 
@@ -196,11 +484,14 @@ async def _test():
             elif key == ord("x"):
                 await client.arm_go_home()
 
-            await asyncio.sleep(0)
+            await asyncio.sleep(0.01)
 
     except KeyboardInterrupt:
         print("Interrupted by user")
     finally:
+        for stream in streams:
+            stream.cancel()
+        await asyncio.gather(*streams, return_exceptions=True)
         await client.disconnect()
         # 关闭所有OpenCV窗口
         cv2.destroyAllWindows()
@@ -208,5 +499,6 @@ async def _test():
 if __name__ == "__main__":
     JPEG_QUALITY = 80
     IMG_MAX_LENGTH = 320
+    STREAM_FPS = 15
 
     asyncio.run(_test())
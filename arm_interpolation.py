@@ -1,8 +1,29 @@
-from dora import Node
-import pyarrow as pa
+import functools
+import math
+import os
+import re
+import time
+from collections import deque
 from enum import Enum
+from typing import Optional
 
-node = Node()
+import numpy as np
+import pyarrow as pa
+from dora import Node
+
+# 离散指令每次移动的距离 (米) 与 movec 的速度参数
+STEP = float(os.environ.get("ARM_STEP", 0.04))
+SPEED = float(os.environ.get("ARM_SPEED", 0.1))
+# 轨迹点的发送频率 (Hz)
+CONTROL_RATE = float(os.environ.get("CONTROL_RATE", 20))
+# 末端平移的速度 (m/s) 与加速度 (m/s²) 上限
+MAX_VELOCITY = float(os.environ.get("ARM_MAX_VELOCITY", 0.2))
+MAX_ACCELERATION = float(os.environ.get("ARM_MAX_ACCELERATION", 0.5))
+# 末端旋转的角速度 (rad/s) 与角加速度 (rad/s²) 上限
+MAX_ANGULAR_VELOCITY = float(os.environ.get("ARM_MAX_ANGULAR_VELOCITY", 0.5))
+MAX_ANGULAR_ACCELERATION = float(os.environ.get("ARM_MAX_ANGULAR_ACCELERATION", 1.0))
+# 一条移动指令的最大重复次数, 如 "arm forward 50" 只移动 MAX_REPEAT 步
+MAX_REPEAT = int(os.environ.get("ARM_MAX_REPEAT", 10))
 
 
 class Action(Enum):
@@ -42,12 +63,12 @@ class Action(Enum):
     # "movej",
     # [2, 0, 0, 0, 0, 0, 0],
     # )
-    FORWARD = ("arm forward", "movec", [0.04, 0, 0, 0, 0, 0, 0.1])
-    BACK = ("arm backward", "movec", [-0.04, 0, 0, 0, 0, 0, 0.1])
-    LEFT = ("arm left", "movec", [0, 0.04, 0, 0, 0, 0, 0.1])
-    RIGHT = ("arm right", "movec", [0, -0.04, 0, 0, 0, 0, 0.1])
-    UP = ("arm up", "movec", [0, 0, 0.04, 0, 0, 0, 0.1])
-    DOWN = ("arm down", "movec", [0, 0, -0.04, 0, 0, 0, 0.1])
+    FORWARD = ("arm forward", "movec", [STEP, 0, 0, 0, 0, 0, SPEED])
+    BACK = ("arm backward", "movec", [-STEP, 0, 0, 0, 0, 0, SPEED])
+    LEFT = ("arm left", "movec", [0, STEP, 0, 0, 0, 0, SPEED])
+    RIGHT = ("arm right", "movec", [0, -STEP, 0, 0, 0, 0, SPEED])
+    UP = ("arm up", "movec", [0, 0, STEP, 0, 0, 0, SPEED])
+    DOWN = ("arm down", "movec", [0, 0, -STEP, 0, 0, 0, SPEED])
     CLOSE = ("close", "claw", [0])
     OPEN = ("open", "claw", [100])
     # STOP = ("stop", "stop", [])
@@ -57,35 +78,291 @@ class Action(Enum):
     # TEACH = ("teach", "teach", [])
 
 
-go_to_box = False
+COUNT_WORDS = {
+    "once": 1, "twice": 2,
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+}
+
+
+def _phrase_pattern(actions: list[Action]) -> str:
+    # 长的短语优先, 词之间允许任意空白
+    phrases = sorted((action.value[0] for action in actions), key=len, reverse=True)
+    return "|".join(r"\s+".join(re.escape(word) for word in phrase.split()) for phrase in phrases)
 
-for event in node:
-    if event["type"] == "INPUT":
-        text = event["value"][0].as_py().lower()
-        text = text.replace(".", "")
-        text = text.replace(".", "")
 
-        if "save" in text:
-            node.send_output("save", pa.array([text.replace("save ", "")]))
-        elif "go" in text:
-            node.send_output("go_to", pa.array([text.replace("go ", "")]))
-        elif "go to " in text:
-            node.send_output("go_to", pa.array([text.replace("go to ", "")]))
+# 从左到右扫描整句话, 一次匹配出所有指令, 指令之间的 "then" / "and" 等词被跳过:
+# 移动指令后可跟重复次数 ("arm forward 3" / "arm up x2" / "arm left twice");
+# 值为空的指令 (save / go) 后跟位置名, 缺省为 home; 其余为不带参数的指令
+_MOVE_ACTIONS = [action for action in Action if action.value[1] == "movec"]
+_NAMED_ACTIONS = [action for action in Action if not action.value[2]]
+_PLAIN_ACTIONS = [action for action in Action if action not in _MOVE_ACTIONS and action not in _NAMED_ACTIONS]
+_COUNT = r"\d+|" + "|".join(COUNT_WORDS)
+COMMAND_PATTERN = re.compile(
+    rf"\b(?P<move>{_phrase_pattern(_MOVE_ACTIONS)})\b"
+    rf"(?:\s*(?:x\s*)?(?P<count>{_COUNT})\b(?:\s*(?:x|times?|steps?)\b)?)?"
+    rf"|\b(?P<named>{_phrase_pattern(_NAMED_ACTIONS)})\b(?:\s+to\b)?"
+    rf"(?:\s+(?!(?:then|and)\b)(?P<name>[a-z0-9_-]+))?"
+    rf"|\b(?P<plain>{_phrase_pattern(_PLAIN_ACTIONS)})\b",
+    re.IGNORECASE,
+)
+_ACTIONS_BY_PHRASE = {" ".join(action.value[0].split()): action for action in Action}
+
+
+def _action(phrase: str) -> Action:
+    return _ACTIONS_BY_PHRASE[" ".join(phrase.lower().split())]
+
+
+def parse_commands(text: str) -> list[tuple[str, list]]:
+    """
+    把一句话解析为按顺序执行的 (output_id, 值) 列表, 移动指令的值已乘以重复次数
+    """
+    commands = []
+    for match in COMMAND_PATTERN.finditer(text):
+        if match["move"]:
+            count = match["count"]
+            if count is None:
+                repeat = 1
+            else:
+                count = count.lower()
+                repeat = COUNT_WORDS[count] if count in COUNT_WORDS else int(count)
+            repeat = min(repeat, MAX_REPEAT)
+            *delta, speed = _action(match["move"]).value[2]
+            commands.append(("movec", [value * repeat for value in delta] + [speed]))
+        elif match["named"]:
+            commands.append((_action(match["named"]).value[1], [(match["name"] or "home").lower()]))
         else:
-            for action in Action:
-                if action.value[0] in text:
-                    node.send_output(action.value[1], pa.array(action.value[2]))
-                    # if action.value[0] == "close" and not go_to_box:
-                    #     already_close = True
-                    #     node.send_output(
-                    #         "prompt",
-                    #         pa.array(
-                    #             [
-                    #                 "Respond with left, right, forward, backward, open, close to drop the bottle in the box"
-                    #             ]
-                    #         ),
-                    #     )  # TODO: Remove this
-                    #     # node.send_output(
-                    #     #     "go_to", pa.array(["home"])
-                    #     # )  # TODO: Remove this
-                    # break
+            action = _action(match["plain"])
+            commands.append((action.value[1], action.value[2]))
+    return commands
+
+
+@functools.lru_cache(maxsize=256)
+def _payload(values: tuple) -> pa.Array:
+    # 固定指令的负载只构造一次, 之后重复使用同一个 Arrow 数组
+    return pa.array(list(values))
+
+
+@functools.lru_cache(maxsize=1024)
+def plan_commands(text: str) -> tuple[tuple[str, object], ...]:
+    """
+    把一句话编译为依次执行的步骤: 相邻且同方向的移动指令合并为一条轨迹 ("movec", (位姿增量, 速度)),
+    由 TrajectoryStreamer 展开为 movec 增量; 方向不同的移动 (如 "arm up then arm forward") 各自成为一条轨迹,
+    按顺序执行而不是合成斜向运动. 其他指令为 (output_id, 负载), 在前面的轨迹发送完后发送.
+    VLM 的输出重复度很高, 结果按原文缓存.
+    """
+    plan = []
+    delta, speed = None, 0.0
+    for output_id, values in parse_commands(text) + [("", [])]:
+        if output_id == "movec" and delta is not None and _same_direction(np.asarray(delta), np.asarray(values[:6])):
+            delta = [a + b for a, b in zip(delta, values[:6])]
+            speed = max(speed, values[6])
+            continue
+        if delta is not None:
+            plan.append(("movec", (tuple(delta), speed)))
+            delta, speed = None, 0.0
+        if output_id == "movec":
+            delta, speed = values[:6], values[6]
+        elif output_id:
+            plan.append((output_id, _payload(tuple(values))))
+    return tuple(plan)
+
+
+def trapezoidal_profile(
+        distance: float,
+        max_velocity: float,
+        max_acceleration: float,
+        dt: float,
+        initial_velocity: float = 0.0,
+) -> np.ndarray:
+    """
+    从0移动到 distance 的梯形速度曲线, 从 initial_velocity 出发、停止时速度为0;
+    返回每个控制周期结束时的位置, 最后一点恰为 distance
+    """
+    if distance <= 0:
+        return np.zeros(0)
+    initial_velocity = min(max(initial_velocity, 0.0), max_velocity)
+    peak_velocity = max_velocity
+    if (2 * peak_velocity ** 2 - initial_velocity ** 2) / (2 * max_acceleration) > distance:
+        # 距离太短达不到最大速度, 退化为三角形曲线
+        peak_velocity = math.sqrt(max_acceleration * distance + initial_velocity ** 2 / 2)
+    # 以初速度按最大加速度也来不及停下时整段减速
+    peak_velocity = max(peak_velocity, initial_velocity)
+
+    ramp_time = (peak_velocity - initial_velocity) / max_acceleration
+    ramp_distance = (peak_velocity ** 2 - initial_velocity ** 2) / (2 * max_acceleration)
+    stop_distance = min(peak_velocity ** 2 / (2 * max_acceleration), distance - ramp_distance)
+    cruise_time = max(distance - ramp_distance - stop_distance, 0.0) / peak_velocity
+    stop_time = 2 * stop_distance / peak_velocity
+    deceleration = peak_velocity / stop_time
+    duration = ramp_time + cruise_time + stop_time
+
+    t = np.minimum(np.arange(1, math.ceil(duration / dt - 1e-9) + 1) * dt, duration)
+    return np.where(
+        t < ramp_time,
+        initial_velocity * t + 0.5 * max_acceleration * t ** 2,
+        np.where(
+            t < ramp_time + cruise_time,
+            ramp_distance + peak_velocity * (t - ramp_time),
+            distance - 0.5 * deceleration * (duration - t) ** 2,
+        ),
+    )
+
+
+def plan_trajectory(
+        delta: list[float],
+        speed: float = SPEED,
+        rate: float = CONTROL_RATE,
+        previous_step: Optional[np.ndarray] = None,
+) -> list[pa.Array]:
+    """
+    把位姿增量 [dx, dy, dz, roll, pitch, yaw] 拆成按 rate 发送的一串 movec 增量.
+
+    所有轴共用一条归一化的梯形曲线, 平移 (按合成距离) 与旋转 (按最大的轴) 同时满足速度和加速度上限,
+    各轴同时开始、同时到达. 整条轨迹在收到指令时一次算完, 发送时只取出预先构造好的 Arrow 数组.
+    previous_step 为上一个控制周期已发送的增量, 给出时从该速度出发而不是从静止开始.
+    """
+    delta = np.asarray(delta[:6], dtype=np.float64)
+    translation = float(np.linalg.norm(delta[:3]))
+    rotation = float(np.abs(delta[3:]).max())
+    if translation < 1e-9 and rotation < 1e-9:
+        return []
+
+    # 归一化路程 s 从0到1, 各组的位移为 s 乘以各自的距离, 限制按距离缩放后取较严者
+    velocity_limits, acceleration_limits = [], []
+    if translation >= 1e-9:
+        velocity_limits.append(MAX_VELOCITY / translation)
+        acceleration_limits.append(MAX_ACCELERATION / translation)
+    if rotation >= 1e-9:
+        velocity_limits.append(MAX_ANGULAR_VELOCITY / rotation)
+        acceleration_limits.append(MAX_ANGULAR_ACCELERATION / rotation)
+    initial_velocity = 0.0
+    if previous_step is not None:
+        # 上一周期的增量在本次路径上的投影, 换算为每秒完成的路程比例
+        initial_velocity = float(np.dot(previous_step[:6], delta) / np.dot(delta, delta)) * rate
+    profile = trapezoidal_profile(
+        1.0, min(velocity_limits), min(acceleration_limits), 1 / rate, initial_velocity=initial_velocity
+    )
+
+    setpoints = np.empty((len(profile), 7))
+    setpoints[:, :6] = np.outer(np.diff(profile, prepend=0.0), delta)
+    setpoints[:, 6] = speed
+    return [pa.array(row) for row in setpoints]
+
+
+@functools.lru_cache(maxsize=256)
+def _trajectory(delta: tuple, speed: float) -> tuple[pa.Array, ...]:
+    return tuple(plan_trajectory(list(delta), speed=speed))
+
+
+def _same_direction(a: np.ndarray, b: np.ndarray) -> bool:
+    norm = np.linalg.norm(a) * np.linalg.norm(b)
+    return norm > 1e-12 and float(np.dot(a, b)) / norm > 0.99
+
+
+class TrajectoryStreamer:
+    """
+    按固定控制频率逐条发送编译好的指令, 每个控制周期发送一条 (轨迹增量或其他指令).
+
+    新的一句话取代尚未发送的全部内容, 包括排在旧轨迹之后的夹爪、save、go_to 等指令, 它们会被丢弃而不是补发.
+    新指令以与当前运动同方向的移动开头时 (如按住按键时重复的同一指令), 剩余位移与新位移合成一条
+    从当前速度出发的轨迹, 运动不会在每次重复时减速到零再重新加速.
+    """
+
+    def __init__(self, node: Node, rate: float = CONTROL_RATE):
+        self.node = node
+        self.rate = rate
+        self.interval = 1 / rate
+        self.pending: deque[tuple[str, pa.Array]] = deque()
+        self.next_send_at = 0.0
+        # 最近发送的 movec 增量, 轨迹结束或发送其他指令后为 None
+        self.last_step: Optional[np.ndarray] = None
+
+    @property
+    def active(self) -> bool:
+        return bool(self.pending)
+
+    def _remaining_motion(self) -> np.ndarray:
+        # 当前这段轨迹中尚未发送的位移, 排在后面的其他方向的轨迹不计入
+        remaining = np.zeros(6)
+        for output_id, payload in self.pending:
+            if output_id != "movec":
+                break
+            step = payload.to_numpy()[:6]
+            if not _same_direction(step, self.last_step):
+                break
+            remaining += step
+        return remaining
+
+    def start(self, plan: tuple[tuple[str, object], ...]) -> None:
+        steps = list(plan)
+        moving = self.last_step is not None and bool(self.pending) and self.pending[0][0] == "movec"
+        if moving and steps and steps[0][0] == "movec":
+            delta, speed = steps[0][1]
+            combined = self._remaining_motion() + np.asarray(delta)
+            if _same_direction(combined[:6], self.last_step):
+                # 沿用当前的发送节拍, 从当前速度继续
+                trajectory = plan_trajectory(combined, speed=speed, rate=self.rate, previous_step=self.last_step)
+                self.pending = deque(("movec", payload) for payload in trajectory)
+                self._extend(steps[1:])
+                return
+
+        self.pending = deque()
+        self._extend(steps)
+        # 第一条立即发送
+        self.next_send_at = time.monotonic()
+        self.step()
+
+    def _extend(self, steps: list[tuple[str, object]]) -> None:
+        for output_id, value in steps:
+            if output_id == "movec":
+                self.pending.extend(("movec", payload) for payload in _trajectory(*value))
+            else:
+                self.pending.append((output_id, value))
+
+    def cancel(self) -> None:
+        self.pending.clear()
+        self.last_step = None
+
+    def timeout(self) -> Optional[float]:
+        # 距下一条的发送时间, 没有待发送的指令时为 None (一直等待新事件)
+        if not self.pending:
+            return None
+        return max(self.next_send_at - time.monotonic(), 0.0)
+
+    def step(self) -> None:
+        now = time.monotonic()
+        if not self.pending or now < self.next_send_at:
+            return
+        output_id, payload = self.pending.popleft()
+        self.node.send_output(output_id, payload)
+        self.last_step = payload.to_numpy()[:6] if output_id == "movec" else None
+        # 按计划时间推进, 落后超过一个周期时从当前时间重新计时, 避免连续补发
+        self.next_send_at = max(self.next_send_at + self.interval, now)
+
+
+def main():
+    node = Node()
+    streamer = TrajectoryStreamer(node)
+
+    while True:
+        streamer.step()
+        timeout = streamer.timeout()
+        event = node.next(timeout=timeout) if timeout is not None else node.next()
+        if event is None:
+            if timeout is None:
+                break
+            continue
+        if event["type"] == "STOP":
+            break
+        if event["type"] != "INPUT":
+            continue
+
+        plan = plan_commands(event["value"][0].as_py())
+        if plan:
+            # 新指令取代正在执行的轨迹
+            streamer.start(plan)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+arm_interpolation 指令解析的吞吐量基准测试
+
+在一组模拟 VLM 输出的语料上, 对比原来的逐个 Action 子串扫描 (每次发送都重新构造 pa.array)
+与编译后的正则语法 (复用负载 / 同时计算轨迹 / 按原文缓存编译结果). 在仓库根目录执行:
+    python -m benchmarks.bench_arm_grammar
+"""
+import random
+import time
+
+import pyarrow as pa
+
+import arm_interpolation
+from arm_interpolation import Action, parse_commands, plan_commands
+
+ROUNDS = 20000
+SEED = 0
+
+CORPUS = [
+    "arm forward",
+    "Arm forward.",
+    "arm backward",
+    "arm left",
+    "arm right.",
+    "arm up",
+    "arm down",
+    "close",
+    "open",
+    "go home",
+    "go to home",
+    "save home",
+    "arm forward 3 then close",
+    "arm down twice, then close",
+    "arm up x2 and arm backward",
+    "I will move the arm forward to reach the bottle.",
+    "The bottle is on the left, arm left 2 then arm down.",
+    "open the claw, arm up, then go home",
+    "Move the arm down 3 times and close the gripper.",
+    "forward",
+    "left",
+    "The task is complete.",
+]
+
+
+def legacy_dispatch(text: str) -> list[tuple[str, pa.Array]]:
+    # 与原来事件循环中的处理相同
+    sent = []
+    text = text.lower()
+    text = text.replace(".", "")
+    if "save" in text:
+        sent.append(("save", pa.array([text.replace("save ", "")])))
+    elif "go" in text:
+        sent.append(("go_to", pa.array([text.replace("go ", "")])))
+    else:
+        for action in Action:
+            if action.value[0] in text:
+                sent.append((action.value[1], pa.array(action.value[2])))
+    return sent
+
+
+def compiled_dispatch(text: str) -> list[tuple[str, pa.Array]]:
+    # 只解析, 不计算轨迹, 与原来的处理方式可比
+    return [(output_id, arm_interpolation._payload(tuple(values))) for output_id, values in parse_commands(text)]
+
+
+def compiled_trajectory(text: str) -> list[tuple[str, object]]:
+    # 编译并展开轨迹 (与 TrajectoryStreamer.start 相同, 轨迹按增量缓存)
+    sent = []
+    for output_id, value in plan_commands.__wrapped__(text):
+        if output_id == "movec":
+            sent.extend(("movec", payload) for payload in arm_interpolation._trajectory(*value))
+        else:
+            sent.append((output_id, value))
+    return sent
+
+
+def run(name: str, dispatch, utterances: list[str]) -> None:
+    started_at = time.perf_counter()
+    for text in utterances:
+        dispatch(text)
+    elapsed = time.perf_counter() - started_at
+    print(f"{name:<32} {len(utterances) / elapsed:>12.0f} utterances/s  {elapsed / len(utterances) * 1e6:>8.2f} us")
+
+
+def main():
+    random.seed(SEED)
+    utterances = [random.choice(CORPUS) for _ in range(ROUNDS)]
+
+    for text in CORPUS[12:19]:
+        print(f"{text!r:<60} -> {[output_id for output_id, _ in legacy_dispatch(text)]} / "
+              f"{[output_id for output_id, _ in parse_commands(text)]}")
+    print()
+
+    run("legacy substring scan", legacy_dispatch, utterances)
+    run("compiled grammar", compiled_dispatch, utterances)
+    plan_commands.cache_clear()
+    run("compiled grammar + trajectory", compiled_trajectory, utterances[:ROUNDS // 10])
+    run("compiled + cached plan", plan_commands, utterances)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+图像负载下机械臂指令延迟的基准测试
+
+多个并发客户端持续请求摄像头图像的同时, 测量 ArmController 下发指令的延迟.
+对比图像处理在事件循环中同步执行与在线程池中执行两种方式. 在仓库根目录执行:
+    python -m benchmarks.bench_command_latency
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+import pyarrow as pa
+
+from benchmarks.bench_listener import FakeNode
+from dora_api_server.node_listener import DoraNodeListener, ImagesManager
+from dora_api_server.node_publisher import ArmController
+
+IMAGE_WIDTH = 640
+IMAGE_HEIGHT = 480
+CAMERA_IDS = ["image_1", "image_2"]
+FRAME_INTERVAL = 0.02
+IMAGE_CLIENTS = 16
+DURATION = 3.0
+COMMAND_INTERVAL = 0.02
+
+
+def make_event(camera_id: str, pixels: np.ndarray) -> dict:
+    return {
+        "type": "INPUT",
+        "id": camera_id,
+        "value": pa.array(pixels),
+        "metadata": {"encoding": "rgb8", "width": IMAGE_WIDTH, "height": IMAGE_HEIGHT},
+    }
+
+
+async def feed_frames(image_bucket: ImagesManager, stop_at: float):
+    pixels = np.random.randint(0, 255, IMAGE_WIDTH * IMAGE_HEIGHT * 3, dtype=np.uint8)
+    while time.perf_counter() < stop_at:
+        for camera_id in CAMERA_IDS:
+            image_bucket.on_image(make_event(camera_id, pixels))
+        await asyncio.sleep(FRAME_INTERVAL)
+
+
+async def poll_images(image_bucket: ImagesManager, stop_at: float, client_id: int):
+    # 每个客户端使用不同的参数, 使编码缓存无法命中
+    quality = 60 + client_id
+    max_length = [None, 320, 640][client_id % 3]
+    while time.perf_counter() < stop_at:
+        for camera_id in CAMERA_IDS:
+            await image_bucket.get_image(camera_id, jpeg_quality=quality, max_length=max_length)
+        await asyncio.sleep(0)
+
+
+async def measure(executor: Optional[ThreadPoolExecutor], image_clients: int) -> np.ndarray:
+    node = FakeNode(event_interval=None)
+    image_bucket = ImagesManager(executor=executor, history_size=0)
+    listener = DoraNodeListener(image_bucket=image_bucket, dora_node=node)
+    # 不限速, 只测量指令从提交到实际发送的延迟
+    arm = ArmController(sender=listener, max_rate=0)
+    await listener.start_listening()
+
+    stop_at = time.perf_counter() + DURATION
+    load = [asyncio.create_task(feed_frames(image_bucket, stop_at))]
+    load += [asyncio.create_task(poll_images(image_bucket, stop_at, i)) for i in range(image_clients)]
+
+    latencies = []
+    await asyncio.sleep(0.2)
+    while time.perf_counter() < stop_at:
+        issued_at = time.perf_counter()
+        command = await arm.forward()
+        await command.wait()
+        latencies.append(time.perf_counter() - issued_at)
+        await asyncio.sleep(COMMAND_INTERVAL)
+
+    await asyncio.gather(*load)
+    await listener.stop_listening()
+    return np.array(latencies) * 1000
+
+
+async def main():
+    print(f"{IMAGE_CLIENTS} image clients, {len(CAMERA_IDS)} cameras {IMAGE_WIDTH}x{IMAGE_HEIGHT} rgb8 @ "
+          f"{FRAME_INTERVAL * 1000:.0f} ms, one arm command every {COMMAND_INTERVAL * 1000:.0f} ms")
+
+    cases = [
+        ("no image load", None, 0),
+        ("image load, on event loop", None, IMAGE_CLIENTS),
+        ("image load, thread pool", ThreadPoolExecutor(max_workers=2), IMAGE_CLIENTS),
+    ]
+    for name, executor, image_clients in cases:
+        latencies_ms = await measure(executor, image_clients)
+        if executor is not None:
+            executor.shutdown()
+        print(f"{name:28s} command latency p50 {np.percentile(latencies_ms, 50):7.2f} ms "
+              f"p99 {np.percentile(latencies_ms, 99):7.2f} ms max {latencies_ms.max():7.2f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,137 @@
+"""
+DoraNodeListener 空闲CPU占用与指令下发延迟的基准测试
+
+用一个模拟的 dora Node 对比旧的 "加锁 + to_thread(next, timeout=0.001)" 轮询方式
+与专用接收线程方式. 在仓库根目录执行:
+    python -m benchmarks.bench_listener
+"""
+import asyncio
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+import pyarrow as pa
+
+from dora_api_server.node_listener import DoraNodeListener, ImagesManager
+
+IDLE_SECONDS = 3.0
+COMMANDS = 50
+COMMAND_INTERVAL = 0.05
+EVENT_INTERVAL: Optional[float] = None  # 设置为0.02可模拟摄像头事件持续到达
+
+
+class FakeNode:
+    """
+    模拟 dora Node: next 阻塞至超时或下一个事件, try_recv 不阻塞, send_output 记录调用时刻
+    """
+
+    def __init__(self, event_interval: Optional[float] = EVENT_INTERVAL):
+        self.event_interval = event_interval
+        self.next_event_at = time.perf_counter()
+        self.sent_at: list[float] = []
+        self._busy = threading.Lock()
+
+    def next(self, timeout: float = None) -> Optional[dict]:
+        # 与真实Node一样,不允许并发调用
+        if not self._busy.acquire(blocking=False):
+            raise RuntimeError("Already borrowed")
+        try:
+            deadline = time.perf_counter() + timeout
+            if self.event_interval is not None and self.next_event_at <= deadline:
+                time.sleep(max(self.next_event_at - time.perf_counter(), 0))
+                self.next_event_at += self.event_interval
+                return {"type": "ERROR", "id": "tick"}
+            time.sleep(timeout)
+            return None
+        finally:
+            self._busy.release()
+
+    def try_recv(self) -> Optional[dict]:
+        if not self._busy.acquire(blocking=False):
+            raise RuntimeError("Already borrowed")
+        try:
+            if self.event_interval is not None and self.next_event_at <= time.perf_counter():
+                self.next_event_at += self.event_interval
+                return {"type": "ERROR", "id": "tick"}
+            return None
+        finally:
+            self._busy.release()
+
+    def send_output(self, output_id: str, data: pa.Array, metadata: dict = None) -> None:
+        if not self._busy.acquire(blocking=False):
+            raise RuntimeError("Already borrowed")
+        try:
+            self.sent_at.append(time.perf_counter())
+        finally:
+            self._busy.release()
+
+
+class LegacyListener:
+    # 旧实现: 每毫秒一次线程池调用,与指令发送共享同一把锁
+    def __init__(self, node: FakeNode):
+        self.node = node
+        self.node_lock = asyncio.Lock()
+        self.is_listening = False
+        self.task: Optional[asyncio.Task] = None
+
+    async def start_listening(self):
+        self.is_listening = True
+        self.task = asyncio.create_task(self._listen())
+
+    async def stop_listening(self):
+        self.is_listening = False
+        await self.task
+
+    async def _listen(self):
+        while self.is_listening:
+            async with self.node_lock:
+                await asyncio.to_thread(self.node.next, timeout=0.001)
+            await asyncio.sleep(0)
+
+    async def send_output(self, output_id: str, data: pa.Array):
+        async with self.node_lock:
+            self.node.send_output(output_id, data)
+
+
+async def measure(listener, node: FakeNode) -> tuple[float, list[float]]:
+    await listener.start_listening()
+    await asyncio.sleep(0.2)
+
+    cpu_started_at = time.process_time()
+    wall_started_at = time.perf_counter()
+    await asyncio.sleep(IDLE_SECONDS)
+    idle_cpu = (time.process_time() - cpu_started_at) / (time.perf_counter() - wall_started_at)
+
+    latencies = []
+    payload = pa.array(["forward"])
+    for _ in range(COMMANDS):
+        await asyncio.sleep(COMMAND_INTERVAL * np.random.random())
+        issued_at = time.perf_counter()
+        await listener.send_output("chassis", payload)
+        latencies.append(node.sent_at[-1] - issued_at)
+
+    await listener.stop_listening()
+    return idle_cpu, latencies
+
+
+async def main():
+    legacy_node = FakeNode()
+    legacy = await measure(LegacyListener(legacy_node), legacy_node)
+
+    results = [("before (lock + 1 ms polling)", legacy)]
+    for receive_timeout in [0.005, 0.001]:
+        node = FakeNode()
+        listener = DoraNodeListener(image_bucket=ImagesManager(), dora_node=node, receive_timeout=receive_timeout)
+        results.append((f"after (thread, {receive_timeout * 1000:.0f} ms)", await measure(listener, node)))
+
+    print(f"idle {IDLE_SECONDS:.0f} s, {COMMANDS} commands, event interval: {EVENT_INTERVAL}")
+    for name, (idle_cpu, latencies) in results:
+        latencies_ms = np.array(latencies) * 1000
+        print(f"{name:30s} idle CPU {idle_cpu * 100:5.1f}% "
+              f"dispatch p50 {np.percentile(latencies_ms, 50):6.2f} ms "
+              f"p99 {np.percentile(latencies_ms, 99):6.2f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
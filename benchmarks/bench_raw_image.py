@@ -0,0 +1,85 @@
+"""
+base64-in-JSON 与二进制图像接口的每帧字节数及客户端解码耗时基准测试
+
+在仓库根目录执行:
+    python -m benchmarks.bench_raw_image
+"""
+import asyncio
+import base64
+import json
+import time
+
+import cv2
+import numpy as np
+import pyarrow as pa
+
+from dora_api_server.node_listener import ImagesManager
+
+IMAGE_WIDTH = 640
+IMAGE_HEIGHT = 480
+REPEATS = 200
+CASES = [(90, None), (90, 640), (80, 320)]
+
+
+def make_pixels() -> np.ndarray:
+    # 渐变背景加几何图形, 压缩率接近真实场景(纯随机噪声几乎无法压缩)
+    x = np.linspace(0, 255, IMAGE_WIDTH, dtype=np.float32)
+    y = np.linspace(0, 255, IMAGE_HEIGHT, dtype=np.float32)[:, None]
+    image = np.stack([np.broadcast_to(x, (IMAGE_HEIGHT, IMAGE_WIDTH)),
+                      np.broadcast_to(y, (IMAGE_HEIGHT, IMAGE_WIDTH)),
+                      (x + y) / 2], axis=-1).astype(np.uint8)
+    cv2.circle(image, (320, 240), 100, (20, 200, 40), -1)
+    cv2.rectangle(image, (60, 60), (200, 180), (200, 30, 30), -1)
+    cv2.putText(image, "gosim", (380, 420), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+    noise = np.random.default_rng(0).integers(-8, 8, image.shape)
+    return np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def decode_json(body: bytes) -> np.ndarray:
+    # 旧客户端: response.json() -> b64decode -> imdecode
+    img_data = base64.b64decode(json.loads(body)["image"])
+    return cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def decode_raw(body: bytes) -> np.ndarray:
+    return cv2.imdecode(np.frombuffer(body, np.uint8), cv2.IMREAD_COLOR)
+
+
+def time_per_call(func, body: bytes) -> float:
+    started_at = time.perf_counter()
+    for _ in range(REPEATS):
+        func(body)
+    return (time.perf_counter() - started_at) / REPEATS
+
+
+async def main():
+    manager = ImagesManager(history_size=0)
+    manager.on_image({
+        "type": "INPUT",
+        "id": "image_1",
+        "value": pa.array(make_pixels().reshape(-1)),
+        "metadata": {"encoding": "rgb8", "width": IMAGE_WIDTH, "height": IMAGE_HEIGHT},
+    })
+
+    print(f"{IMAGE_WIDTH}x{IMAGE_HEIGHT} synthetic frame, {REPEATS} client decodes per case")
+    for quality, max_length in CASES:
+        raw_body = await manager.encode_image_async("image_1", jpeg_quality=quality, max_length=max_length)
+        json_body = json.dumps({
+            "node": "image_1",
+            "image": await manager.get_image("image_1", jpeg_quality=quality, max_length=max_length),
+            "seq": 1,
+            "age_ms": 12.3,
+            "capture_ts": time.time(),
+            "receive_ts": time.time(),
+        }).encode()
+
+        json_seconds = time_per_call(decode_json, json_body)
+        raw_seconds = time_per_call(decode_raw, raw_body)
+        name = f"quality {quality}, max_length {max_length}"
+        print(f"{name:28s} json+base64 {len(json_body) / 1024:7.1f} KiB {json_seconds * 1000:6.2f} ms | "
+              f"raw {len(raw_body) / 1024:7.1f} KiB {raw_seconds * 1000:6.2f} ms | "
+              f"bytes -{(1 - len(raw_body) / len(json_body)) * 100:4.1f}%")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+"""
+按请求缩放与缩放金字塔在多客户端并发请求下的对比
+
+每个客户端使用不同的质量参数, 使编码缓存无法命中, 每个请求都需要缩放+编码. 在仓库根目录执行:
+    python -m benchmarks.bench_resize_pyramid
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pyarrow as pa
+
+from benchmarks.bench_raw_image import make_pixels
+from dora_api_server import node_listener
+from dora_api_server.node_listener import ImagesManager
+
+IMAGE_WIDTH = 1280
+IMAGE_HEIGHT = 720
+CAMERA_IDS = ["image_1", "image_2"]
+FRAME_INTERVAL = 0.033
+CLIENTS = 8
+MAX_LENGTHS = [320, 640, 480, 256]
+DURATION = 3.0
+
+
+def legacy_resize(np_image: np.ndarray, max_length: int) -> np.ndarray:
+    # 旧实现: 默认双线性插值, 每个请求都从原图缩放
+    return cv2.resize(np_image, node_listener._resized_size(np_image.shape[1], np_image.shape[0], max_length))
+
+
+async def feed_frames(image_bucket: ImagesManager, stop_at: float):
+    pixels = cv2.resize(make_pixels(), (IMAGE_WIDTH, IMAGE_HEIGHT)).reshape(-1)
+    while time.perf_counter() < stop_at:
+        for camera_id in CAMERA_IDS:
+            image_bucket.on_image({
+                "type": "INPUT",
+                "id": camera_id,
+                "value": pa.array(pixels),
+                "metadata": {"encoding": "rgb8", "width": IMAGE_WIDTH, "height": IMAGE_HEIGHT},
+            })
+        await asyncio.sleep(FRAME_INTERVAL)
+
+
+async def poll_images(image_bucket: ImagesManager, stop_at: float, client_id: int, latencies: list[float]):
+    quality = 60 + client_id
+    requests = 0
+    while time.perf_counter() < stop_at:
+        max_length = MAX_LENGTHS[(client_id + requests) % len(MAX_LENGTHS)]
+        for camera_id in CAMERA_IDS:
+            issued_at = time.perf_counter()
+            await image_bucket.encode_image_async(camera_id, jpeg_quality=quality, max_length=max_length)
+            latencies.append(time.perf_counter() - issued_at)
+        requests += 1
+
+
+async def measure(pyramid_levels: tuple[int, ...]) -> tuple[int, np.ndarray]:
+    executor = ThreadPoolExecutor(max_workers=2)
+    image_bucket = ImagesManager(executor=executor, history_size=0, pyramid_levels=pyramid_levels)
+    stop_at = time.perf_counter() + DURATION
+    latencies: list[float] = []
+    feeder = asyncio.create_task(feed_frames(image_bucket, stop_at))
+    await asyncio.sleep(0.1)
+    await asyncio.gather(*[poll_images(image_bucket, stop_at, i, latencies) for i in range(CLIENTS)])
+    await feeder
+    executor.shutdown()
+    return len(latencies), np.array(latencies) * 1000
+
+
+async def main():
+    print(f"{CLIENTS} clients, {len(CAMERA_IDS)} cameras {IMAGE_WIDTH}x{IMAGE_HEIGHT} rgb8 @ "
+          f"{FRAME_INTERVAL * 1000:.0f} ms, max_length cycling {MAX_LENGTHS}, {DURATION:.0f} s")
+
+    resize_long_side = node_listener._resize_long_side
+    cases = [
+        ("before (bilinear, per request)", legacy_resize, ()),
+        ("area/linear, per request", resize_long_side, ()),
+        ("area/linear, pyramid (320, 640)", resize_long_side, (320, 640)),
+    ]
+    for name, resize, pyramid_levels in cases:
+        node_listener._resize_long_side = resize
+        served, latencies_ms = await measure(pyramid_levels)
+        print(f"{name:32s} {served / DURATION:7.1f} images/s "
+              f"latency p50 {np.percentile(latencies_ms, 50):6.2f} ms p99 {np.percentile(latencies_ms, 99):6.2f} ms")
+    node_listener._resize_long_side = resize_long_side
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,44 +1,175 @@
 import asyncio
-from typing import Optional
+import base64
+import json
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional, Union
 
 import sanic
-from dora import Node
 
-from dora_api_server.node_listener import DoraNodeListener, ImagesManager
-from dora_api_server.node_publisher import ArmController, ChassisController
-
-global_dora_node: Node = Node(node_id="restapi")
-dora_node_lock: asyncio.Lock = asyncio.Lock()
+from dora_api_server.control import (
+    COMMAND_PROMPTS, ControlCenter, RemoteControl, ack_address, control_address, create_control
+)
+from dora_api_server.metrics import ServerMetrics
+from dora_api_server.node_listener import CapturedFrame, DoraNodeListener, HistoryFrame, ImagesManager
+from dora_api_server.node_owner import NodeOwner, SharedNodeListener
+from dora_api_server.node_publisher import ARM_SPEED
+from dora_api_server.push_hub import PushHub, Subscriber
 
 app = sanic.Sanic("GOSIM2024HackathonRestAPI")
 
-# global_dora_node: Optional[Node] = None
+# WORKERS > 1 时由单独的节点进程持有 dora Node 与控制状态, 各worker通过共享内存读取帧、通过控制服务提交指令
+WORKERS = int(os.environ.get("WORKERS", 1))
+FRAME_SHM_PREFIX = os.environ.get("FRAME_SHM_PREFIX", "restapi_frames")
+
+
+def create_image_executor() -> Optional[Executor]:
+    # IMAGE_EXECUTOR: thread(默认) / process / none(在事件循环中同步处理)
+    executor_type = os.environ.get("IMAGE_EXECUTOR", "thread").lower()
+    workers = int(os.environ.get("IMAGE_WORKERS", 2))
+    if executor_type == "thread":
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-worker")
+    elif executor_type == "process":
+        return ProcessPoolExecutor(max_workers=workers)
+    return None
+
+
+def _history_idle_timeout() -> Optional[float]:
+    # 为0时一直记录历史帧
+    timeout = float(os.environ.get("FRAME_HISTORY_IDLE_TIMEOUT", 30))
+    return timeout if timeout > 0 else None
+
+
+@app.main_process_start
+async def main_process_start(app):
+    if WORKERS <= 1:
+        return
+
+    node_owner = NodeOwner(
+        prefix=FRAME_SHM_PREFIX,
+        max_cameras=int(os.environ.get("FRAME_SHM_CAMERAS", 4)),
+        slot_bytes=int(os.environ.get("FRAME_SLOT_BYTES", 8 * 1024 * 1024)),
+        receive_timeout=float(os.environ.get("DORA_RECEIVE_TIMEOUT", 0.001)),
+        history_size=int(os.environ.get("FRAME_HISTORY_SIZE", 32)),
+        history_interval=float(os.environ.get("FRAME_HISTORY_INTERVAL", 0.2)),
+        history_idle_timeout=_history_idle_timeout(),
+    )
+    node_owner.start()
+    app.ctx.node_owner = node_owner
+    app.shared_ctx.frame_locks = node_owner.locks
+
+
+@app.main_process_stop
+async def main_process_stop(app):
+    if WORKERS > 1:
+        app.ctx.node_owner.stop()
+
 
 @app.before_server_start
 async def before_server_start(app):
     print("Starting server...")
 
-    image_bucket = ImagesManager()
-    dora_node_listener = DoraNodeListener(
-        image_bucket=image_bucket,
-        dora_node=global_dora_node,
-        node_lock=dora_node_lock
+    image_executor = create_image_executor()
+    image_bucket = ImagesManager(
+        frame_ttl=float(os.environ.get("FRAME_TTL", 10.0)),
+        memory_budget=int(os.environ.get("FRAME_MEMORY_BUDGET", 64 * 1024 * 1024)),
+        history_size=int(os.environ.get("FRAME_HISTORY_SIZE", 32)),
+        history_interval=float(os.environ.get("FRAME_HISTORY_INTERVAL", 0.2)),
+        history_idle_timeout=_history_idle_timeout(),
+        # 多worker模式下历史帧由节点进程编码一次
+        record_history=WORKERS <= 1,
+        executor=image_executor,
+        max_inflight_per_camera=int(os.environ.get("IMAGE_INFLIGHT_PER_CAMERA", 2)),
+        pyramid_levels=tuple(
+            int(level) for level in os.environ.get("FRAME_PYRAMID_LEVELS", "320,640").split(",") if level
+        ),
     )
-    arm_controller = ArmController(node=global_dora_node, node_lock=dora_node_lock)
-    chassis_controller = ChassisController(node=global_dora_node, node_lock=dora_node_lock)
+    if WORKERS > 1:
+        dora_node_listener = SharedNodeListener(
+            image_bucket=image_bucket,
+            prefix=FRAME_SHM_PREFIX,
+            locks=app.shared_ctx.frame_locks,
+        )
+        # 各worker的帧序号相同, ETag也需使用相同的前缀
+        etag_epoch_ms = dora_node_listener.bus.created_ms
+        control = RemoteControl(control_address(FRAME_SHM_PREFIX), ack_address(FRAME_SHM_PREFIX))
+        await control.start()
+    else:
+        # dora Node 在worker中创建, 不在导入时创建
+        dora_node_listener = DoraNodeListener(
+            image_bucket=image_bucket,
+            receive_timeout=float(os.environ.get("DORA_RECEIVE_TIMEOUT", 0.001)),
+        )
+        etag_epoch_ms = time.time_ns() // 1000000
+        control = create_control(dora_node_listener)
+
+    metrics = ServerMetrics(loop_lag_interval=float(os.environ.get("METRICS_LOOP_LAG_INTERVAL", 0.5)))
+    metrics.attach(image_bucket, dropped_events=lambda: dora_node_listener.dropped_events)
+    metrics.start()
 
     await dora_node_listener.start_listening()
 
+    app.ctx.image_executor = image_executor
     app.ctx.image_bucket = image_bucket
     app.ctx.dora_node_listener = dora_node_listener
-    app.ctx.arm_controller = arm_controller
-    app.ctx.chassis_controller = chassis_controller
+    app.ctx.control = control
+    app.ctx.metrics = metrics
+    app.ctx.stream_max_fps = float(os.environ.get("STREAM_MAX_FPS", 15))
+    app.ctx.long_poll_max_timeout = float(os.environ.get("LONG_POLL_MAX_TIMEOUT", 30))
+    app.ctx.etag_prefix = f"{etag_epoch_ms:x}"
+
+    push_hub = PushHub(
+        image_bucket=image_bucket,
+        stats_provider=_listener_stats,
+        command_handler=_run_command,
+        stats_interval=float(os.environ.get("WS_STATS_INTERVAL", 1.0)),
+    )
+    push_hub.start()
+    app.ctx.push_hub = push_hub
+    app.ctx.ws_queue_size = int(os.environ.get("WS_QUEUE_SIZE", 16))
+    # 指令与序列各步的确认; 多worker模式下由节点进程广播给所有worker
+    control.ack_listeners.append(push_hub.publish_ack)
 
 
 @app.after_server_stop
 async def after_server_stop(app):
     # TODO: 好吧我好像并不知道如何安全的关闭一个Dora Node
-    app.ctx.dora_node_listener.stop_listening()
+    await app.ctx.control.close()
+    await app.ctx.push_hub.stop()
+    await app.ctx.dora_node_listener.stop_listening()
+    await app.ctx.metrics.stop()
+    if app.ctx.image_executor is not None:
+        app.ctx.image_executor.shutdown(wait=False, cancel_futures=True)
+
+
+@app.on_request
+async def start_request_timer(request: sanic.Request):
+    request.ctx.started_at = time.perf_counter()
+
+
+@app.on_response
+async def observe_request_duration(request: sanic.Request, response: sanic.HTTPResponse):
+    started_at = getattr(request.ctx, "started_at", None)
+    if started_at is None or response is None:
+        return
+    # 按路由模板而非实际路径统计, 避免标签随摄像头名/任务ID增长; 流式响应统计到发送响应头为止
+    app.ctx.metrics.observe_request(
+        request.uri_template or "unmatched", request.method, response.status, time.perf_counter() - started_at
+    )
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics(_: sanic.Request):
+    try:
+        # 指令的指标由持有指令队列的 ControlCenter 记录, 多worker模式下在节点进程中
+        control: ControlCenter = app.ctx.control
+        return sanic.response.text(
+            app.ctx.metrics.render() + await control.render_metrics(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+    except Exception as e:
+        return sanic.response.text(f"Error: {e}", status=500)
 
 
 @app.route("/ping", methods=["GET", "POST"])
@@ -52,13 +183,73 @@ async def camera_list(_: sanic.Request):
         image_bucket: ImagesManager = app.ctx.image_bucket
         return sanic.response.json(
             {
-                "nodes": list(image_bucket.last_captured.keys())
+                "nodes": image_bucket.camera_ids()
             }
         )
 
     except Exception as e:
         return sanic.response.text(f"Error: {e}")
 
+def _frame_etag(frame: CapturedFrame) -> str:
+    # seq 在服务重启后从1开始, 加上启动时间避免与重启前的ETag相同
+    return f'"{app.ctx.etag_prefix}-{frame.seq}"'
+
+
+def _etag_matches(request: sanic.Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match", None)
+    if if_none_match is None:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def _long_poll_timeout(request: sanic.Request) -> float:
+    return min(float(request.args.get("timeout", 10)), app.ctx.long_poll_max_timeout)
+
+
+async def _poll_frame(
+        request: sanic.Request,
+        image_bucket: ImagesManager,
+        camera_id: str,
+) -> tuple[Optional[CapturedFrame], bool]:
+    """
+    带有 after_seq / after_ts 参数时等待更新的帧. 返回 (帧, 是否等待超时), 超时时返回当前帧
+    """
+    after_seq = request.args.get("after_seq", None)
+    after_ts = request.args.get("after_ts", None)
+    if after_seq is None and after_ts is None:
+        return image_bucket.get_frame(camera_id), False
+
+    frame = await image_bucket.wait_for_frame(
+        camera_id,
+        after_seq=int(after_seq) if after_seq is not None else 0,
+        timeout=_long_poll_timeout(request),
+        after_ts=float(after_ts) if after_ts is not None else None,
+    )
+    if frame is None:
+        return image_bucket.get_frame(camera_id), True
+    return frame, False
+
+
+def _unchanged_response(
+        request: sanic.Request,
+        frame: Optional[CapturedFrame],
+        timed_out: bool,
+) -> Optional[sanic.HTTPResponse]:
+    """
+    If-None-Match 与当前帧相同时返回304; 长轮询超时 (且ETag不匹配) 时返回带 X-Timed-Out 头的204;
+    其余情况返回 None, 由调用方返回当前帧
+    """
+    if frame is None:
+        return None
+    headers = {"ETag": _frame_etag(frame), **_frame_headers(frame)}
+    if _etag_matches(request, headers["ETag"]):
+        return sanic.response.empty(status=304, headers=headers)
+    if timed_out:
+        return sanic.response.empty(status=204, headers={**headers, "X-Timed-Out": "1"})
+    return None
+
+
 @app.route("/camera/node/<camera_node_name:str>", methods=["GET"])
 async def camera(request: sanic.Request, camera_node_name: str):
     try:
@@ -66,82 +257,551 @@ async def camera(request: sanic.Request, camera_node_name: str):
         jpeg_quality = request.args.get("quality", 90)
         max_length = request.args.get("max_length", None)
         base64_encoding = request.args.get("encoding", "utf-8")
-        encoded: Optional[str] = await image_bucket.get_image(
+        frame, timed_out = await _poll_frame(request, image_bucket, camera_node_name)
+        unchanged = _unchanged_response(request, frame, timed_out)
+        if unchanged is not None:
+            return unchanged
+
+        encoded: Optional[str] = None
+        if frame is not None:
+            encoded = await image_bucket.get_image(
+                camera_node_name,
+                jpeg_quality=jpeg_quality,
+                max_length=max_length,
+                base64_encoding=base64_encoding,
+                frame=frame,
+            )
+
+        payload = {
+            "node": camera_node_name,
+            "image": encoded,
+            "seq": frame.seq if frame is not None else None,
+            "age_ms": frame.age_ms(time.time()) if frame is not None else None,
+            "capture_ts": frame.capture_ts if frame is not None else None,
+            "receive_ts": frame.receive_ts if frame is not None else None,
+        }
+
+        headers = {"ETag": _frame_etag(frame), "Cache-Control": "no-cache"} if frame is not None else {}
+        return sanic.response.json(payload, headers=headers)
+    except Exception as e:
+        return sanic.response.text(f"Error: {e}")
+
+
+IMAGE_MIME_TYPES = {"jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+
+
+def _negotiate_image_format(request: sanic.Request) -> Optional[str]:
+    # format 参数优先, 否则按 Accept 头中的顺序选第一个支持的格式, 都没有时返回 None
+    image_format = request.args.get("format", None)
+    if image_format is not None:
+        image_format = image_format.lower()
+        return image_format if image_format in IMAGE_MIME_TYPES else None
+
+    accept = request.headers.get("accept", "")
+    if not accept:
+        return "jpeg"
+    for media_range in accept.split(","):
+        media_type = media_range.split(";")[0].strip().lower()
+        if media_type in ("*/*", "image/*"):
+            return "jpeg"
+        for image_format, mime_type in IMAGE_MIME_TYPES.items():
+            if media_type == mime_type:
+                return image_format
+    return None
+
+
+def _frame_headers(frame: Union[CapturedFrame, HistoryFrame]) -> dict:
+    return {
+        "X-Frame-Seq": str(frame.seq),
+        "X-Capture-Ts": f"{frame.capture_ts:.6f}",
+        "X-Receive-Ts": f"{frame.receive_ts:.6f}",
+        "X-Frame-Age-Ms": f"{max(time.time() - frame.capture_ts, 0.0) * 1000:.1f}",
+    }
+
+
+def _multipart_part(boundary: str, content_type: str, data: bytes, headers: dict) -> bytes:
+    part_headers = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    return (
+        f"--{boundary}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(data)}\r\n"
+        f"{part_headers}\r\n"
+    ).encode() + data + b"\r\n"
+
+
+@app.route("/camera/node/<camera_node_name:str>/raw", methods=["GET"])
+async def camera_raw(request: sanic.Request, camera_node_name: str):
+    try:
+        image_bucket: ImagesManager = app.ctx.image_bucket
+        jpeg_quality = request.args.get("quality", 90)
+        max_length = request.args.get("max_length", None)
+        image_format = _negotiate_image_format(request)
+        if image_format is None:
+            return sanic.response.text(
+                f"Error: supported formats are {', '.join(IMAGE_MIME_TYPES.values())}", status=406
+            )
+
+        frame, timed_out = await _poll_frame(request, image_bucket, camera_node_name)
+        unchanged = _unchanged_response(request, frame, timed_out)
+        if unchanged is not None:
+            return unchanged
+
+        encoded: Optional[bytes] = None
+        if frame is not None:
+            encoded = await image_bucket.encode_image_async(
+                camera_node_name,
+                jpeg_quality=jpeg_quality,
+                max_length=max_length,
+                image_format=image_format,
+                frame=frame,
+            )
+        if encoded is None:
+            return sanic.response.text(f"Error: no frame from {camera_node_name}", status=404)
+
+        return sanic.response.raw(
+            encoded,
+            content_type=IMAGE_MIME_TYPES[image_format],
+            headers={"ETag": _frame_etag(frame), "Cache-Control": "no-cache", **_frame_headers(frame)},
+        )
+    except Exception as e:
+        return sanic.response.text(f"Error: {e}", status=500)
+
+
+STREAM_BOUNDARY = "frame"
+
+
+@app.route("/camera/stream/<camera_node_name:str>", methods=["GET"])
+async def camera_stream(request: sanic.Request, camera_node_name: str):
+    image_bucket: ImagesManager = app.ctx.image_bucket
+    jpeg_quality = request.args.get("quality", 80)
+    max_length = request.args.get("max_length", None)
+    image_format = _negotiate_image_format(request)
+    if image_format is None:
+        return sanic.response.text(
+            f"Error: supported formats are {', '.join(IMAGE_MIME_TYPES.values())}", status=406
+        )
+    # 客户端请求的帧率不能超过服务端上限
+    fps = min(float(request.args.get("fps", app.ctx.stream_max_fps)), app.ctx.stream_max_fps)
+    frame_interval = 1 / fps if fps > 0 else 0
+
+    response = await request.respond(
+        content_type=f"multipart/x-mixed-replace; boundary={STREAM_BOUNDARY}",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+    last_seq = 0
+    next_frame_at = time.monotonic()
+    while not request.transport.is_closing():
+        # 按帧率上限节流, 期间到来的帧只发送最新的一帧
+        await asyncio.sleep(max(next_frame_at - time.monotonic(), 0))
+        frame = await image_bucket.wait_for_frame(camera_node_name, after_seq=last_seq, timeout=1.0)
+        if frame is None:
+            continue
+        next_frame_at = time.monotonic() + frame_interval
+
+        encoded = await image_bucket.encode_image_async(
             camera_node_name,
             jpeg_quality=jpeg_quality,
             max_length=max_length,
-            base64_encoding=base64_encoding,
+            image_format=image_format,
+            frame=frame,
         )
+        last_seq = frame.seq
+        if encoded is None:
+            continue
 
-        payload = {
+        await response.send(
+            _multipart_part(STREAM_BOUNDARY, IMAGE_MIME_TYPES[image_format], encoded, _frame_headers(frame))
+        )
+
+    await response.eof()
+
+
+async def _encode_snapshot_frame(
+        image_bucket: ImagesManager,
+        camera_id: str,
+        frame: Union[CapturedFrame, HistoryFrame],
+        jpeg_quality,
+        max_length,
+) -> Optional[bytes]:
+    if isinstance(frame, HistoryFrame):
+        return await image_bucket.encode_history_frame_async(frame, jpeg_quality=jpeg_quality, max_length=max_length)
+    return await image_bucket.encode_image_async(
+        camera_id, jpeg_quality=jpeg_quality, max_length=max_length, frame=frame
+    )
+
+
+async def _encode_frames(
+        image_bucket: ImagesManager,
+        frames: dict[str, Union[CapturedFrame, HistoryFrame]],
+        encode_params: Callable[[str], tuple],
+) -> list[Optional[bytes]]:
+    # 并行编码一组帧, encode_params(camera_id) 返回 (quality, max_length)
+    live_frames = [(camera_id, frame) for camera_id, frame in frames.items() if isinstance(frame, CapturedFrame)]
+    for _, frame in live_frames:
+        image_bucket.pin_frame(frame)
+    try:
+        return await asyncio.gather(*[
+            _encode_snapshot_frame(image_bucket, camera_id, frame, *encode_params(camera_id))
+            for camera_id, frame in frames.items()
+        ])
+    finally:
+        for camera_id, frame in live_frames:
+            image_bucket.unpin_frame(camera_id, frame)
+
+
+@app.route("/camera/snapshot", methods=["GET"])
+async def camera_snapshot(request: sanic.Request):
+    try:
+        image_bucket: ImagesManager = app.ctx.image_bucket
+        jpeg_quality = request.args.get("quality", 90)
+        max_length = request.args.get("max_length", None)
+        base64_encoding = request.args.get("encoding", "utf-8")
+        tolerance_ms = float(request.args.get("tolerance_ms", 50))
+        cameras = request.args.get("cameras", None)
+        camera_ids = cameras.split(",") if cameras else None
+
+        camera_ids = camera_ids if camera_ids is not None else image_bucket.camera_ids()
+        frames, skew_ms, aligned = image_bucket.snapshot(
+            camera_ids=camera_ids,
+            tolerance_ms=tolerance_ms,
+            max_lengths={camera_id: max_length for camera_id in camera_ids},
+        )
+        encoded = await _encode_frames(image_bucket, frames, lambda _: (jpeg_quality, max_length))
+
+        now = time.time()
+        return sanic.response.json({
+            "frames": {
+                camera_id: {
+                    "seq": frame.seq,
+                    "capture_ts": frame.capture_ts,
+                    "receive_ts": frame.receive_ts,
+                    "age_ms": max(now - frame.capture_ts, 0.0) * 1000,
+                    "image": base64.b64encode(data).decode(base64_encoding) if data is not None else None,
+                }
+                for (camera_id, frame), data in zip(frames.items(), encoded)
+            },
+            "skew_ms": skew_ms,
+            "aligned": aligned,
+        })
+    except Exception as e:
+        return sanic.response.text(f"Error: {e}")
+
+
+MULTIPART_BOUNDARY = "camera-frame"
+
+
+@app.route("/camera/all", methods=["GET"])
+async def camera_all(request: sanic.Request):
+    try:
+        image_bucket: ImagesManager = app.ctx.image_bucket
+        jpeg_quality = request.args.get("quality", 90)
+        max_length = request.args.get("max_length", None)
+        aligned = request.args.get("aligned", "false").lower() in ["1", "true", "yes"]
+        tolerance_ms = float(request.args.get("tolerance_ms", 50))
+        cameras = request.args.get("cameras", None)
+        camera_ids = cameras.split(",") if cameras else image_bucket.camera_ids()
+        after_ts = request.args.get("after_ts", None)
+        if after_ts is not None:
+            # 等待所有摄像头都有晚于 after_ts 的帧, 超时的摄像头使用当前帧
+            timeout = _long_poll_timeout(request)
+            await asyncio.gather(*[
+                image_bucket.wait_for_frame(camera_id, timeout=timeout, after_ts=float(after_ts))
+                for camera_id in camera_ids
+            ])
+
+        def encode_params(camera_id: str) -> tuple:
+            # quality.<camera> / max_length.<camera> 可以覆盖单个摄像头的参数
+            return (
+                request.args.get(f"quality.{camera_id}", jpeg_quality),
+                request.args.get(f"max_length.{camera_id}", max_length),
+            )
+
+        headers = {}
+        if aligned:
+            frames, skew_ms, is_aligned = image_bucket.snapshot(
+                camera_ids=camera_ids,
+                tolerance_ms=tolerance_ms,
+                after_ts=float(after_ts) if after_ts is not None else None,
+                max_lengths={camera_id: encode_params(camera_id)[1] for camera_id in camera_ids},
+            )
+            headers = {"X-Skew-Ms": f"{skew_ms:.1f}", "X-Aligned": str(is_aligned).lower()}
+        else:
+            frames = {}
+            for camera_id in camera_ids:
+                frame = image_bucket.get_frame(camera_id)
+                if frame is not None:
+                    frames[camera_id] = frame
+        encoded = await _encode_frames(image_bucket, frames, encode_params)
+
+        body = b"".join(
+            _multipart_part(
+                MULTIPART_BOUNDARY, IMAGE_MIME_TYPES["jpeg"], data, {"X-Camera": camera_id, **_frame_headers(frame)}
+            )
+            for (camera_id, frame), data in zip(frames.items(), encoded)
+            if data is not None
+        )
+        return sanic.response.raw(
+            body + f"--{MULTIPART_BOUNDARY}--\r\n".encode(),
+            content_type=f"multipart/mixed; boundary={MULTIPART_BOUNDARY}",
+            headers=headers,
+        )
+    except Exception as e:
+        return sanic.response.text(f"Error: {e}", status=500)
+
+
+def _listener_stats() -> dict:
+    image_bucket: ImagesManager = app.ctx.image_bucket
+    dora_node_listener: Union[DoraNodeListener, SharedNodeListener] = app.ctx.dora_node_listener
+    return {
+        "cameras": {
+            camera_id: stats.to_dict()
+            for camera_id, stats in image_bucket.camera_stats.items()
+        },
+        "dropped_events": dora_node_listener.dropped_events,
+    }
+
+
+@app.route("/camera/stats", methods=["GET"])
+async def camera_stats(_: sanic.Request):
+    try:
+        return sanic.response.json(_listener_stats())
+    except Exception as e:
+        return sanic.response.text(f"Error: {e}")
+
+
+@app.websocket("/ws")
+async def push_channel(request: sanic.Request, ws):
+    cameras = request.args.get("cameras", None)
+    max_length = request.args.get("max_length", None)
+    try:
+        subscriber = Subscriber(
+            cameras=cameras.split(",") if cameras else None,
+            fps=float(request.args.get("fps", 10)),
+            quality=int(request.args.get("quality", 80)),
+            max_length=int(max_length) if max_length else None,
+            image_format=request.args.get("format", "jpeg"),
+            stats=request.args.get("stats", "true").lower() in ["1", "true", "yes"],
+            queue_size=app.ctx.ws_queue_size,
+        )
+    except ValueError as e:
+        # 连接参数无效时回复 error 消息并关闭连接
+        await ws.send(json.dumps({"type": "error", "error": str(e)}))
+        await ws.close(code=1008, reason="invalid subscription")
+        return
+    await app.ctx.push_hub.serve(ws, subscriber)
+
+
+def _history_frame_payload(frame: HistoryFrame, base64_encoding: str = "utf-8") -> dict:
+    return {
+        "seq": frame.seq,
+        "capture_ts": frame.capture_ts,
+        "receive_ts": frame.receive_ts,
+        "width": frame.width,
+        "height": frame.height,
+        "image": base64.b64encode(frame.data).decode(base64_encoding),
+    }
+
+
+@app.route("/camera/history/<camera_node_name:str>/latest", methods=["GET"])
+async def camera_history_latest(request: sanic.Request, camera_node_name: str):
+    try:
+        image_bucket: ImagesManager = app.ctx.image_bucket
+        count = int(request.args.get("count", 1))
+        base64_encoding = request.args.get("encoding", "utf-8")
+        history = image_bucket.get_history(camera_node_name)
+        frames = history.latest(count) if history is not None else []
+
+        return sanic.response.json({
             "node": camera_node_name,
-            "image": encoded
-        }
+            "frames": [_history_frame_payload(frame, base64_encoding) for frame in frames],
+        })
+    except Exception as e:
+        return sanic.response.text(f"Error: {e}")
+
 
-        return sanic.response.json(payload)
+@app.route("/camera/history/<camera_node_name:str>/range", methods=["GET"])
+async def camera_history_range(request: sanic.Request, camera_node_name: str):
+    try:
+        image_bucket: ImagesManager = app.ctx.image_bucket
+        from_seq = request.args.get("from_seq", None)
+        to_seq = request.args.get("to_seq", None)
+        base64_encoding = request.args.get("encoding", "utf-8")
+        history = image_bucket.get_history(camera_node_name)
+        frames = history.seq_range(
+            from_seq=int(from_seq) if from_seq is not None else None,
+            to_seq=int(to_seq) if to_seq is not None else None,
+        ) if history is not None else []
+
+        return sanic.response.json({
+            "node": camera_node_name,
+            "frames": [_history_frame_payload(frame, base64_encoding) for frame in frames],
+        })
+    except Exception as e:
+        return sanic.response.text(f"Error: {e}")
+
+
+@app.route("/camera/history/<camera_node_name:str>/nearest", methods=["GET"])
+async def camera_history_nearest(request: sanic.Request, camera_node_name: str):
+    ts = request.args.get("ts", None)
+    if ts is None:
+        return sanic.response.text("Error: ts is required (unix timestamp in seconds)", status=400)
+    try:
+        timestamp = float(ts)
+    except ValueError:
+        return sanic.response.text(f"Error: ts must be a unix timestamp in seconds, got: {ts}", status=400)
+    try:
+        image_bucket: ImagesManager = app.ctx.image_bucket
+        before = request.args.get("before", "false").lower() in ["1", "true", "yes"]
+        base64_encoding = request.args.get("encoding", "utf-8")
+        history = image_bucket.get_history(camera_node_name)
+        frame = history.nearest(timestamp, before=before) if history is not None else None
+
+        return sanic.response.json({
+            "node": camera_node_name,
+            "frames": [_history_frame_payload(frame, base64_encoding)] if frame is not None else [],
+        })
     except Exception as e:
         return sanic.response.text(f"Error: {e}")
 
 
+async def _run_command(target: str, prompt: str) -> bool:
+    # 等待指令实际发送 (或被合并的指令发送) 后返回
+    control: ControlCenter = app.ctx.control
+    return await control.run_command(target, prompt)
+
+
+@app.route("/sequence", methods=["POST"])
+async def sequence_submit(request: sanic.Request):
+    try:
+        control: ControlCenter = app.ctx.control
+        body = request.json if request.body else None
+        if not isinstance(body, dict):
+            raise ValueError('request body must be a JSON object like {"steps": [...]}')
+        return sanic.response.json(await control.sequence_submit(body.get("steps", [])))
+    except Exception as e:
+        return sanic.response.text(f"Error: {e}", status=400)
+
+
+@app.route("/sequence/prompts", methods=["GET"])
+async def sequence_prompts(_: sanic.Request):
+    # 指令序列中各执行器可用的指令, 客户端据此校验, 不必自己维护一份
+    return sanic.response.json({target: sorted(prompts) for target, prompts in COMMAND_PROMPTS.items()})
+
+
+@app.route("/sequence/<job_id:str>", methods=["GET"])
+async def sequence_status(request: sanic.Request, job_id: str):
+    control: ControlCenter = app.ctx.control
+    # wait=<秒>: 最多等待这么久直到序列结束
+    wait = request.args.get("wait", None)
+    try:
+        wait = min(float(wait), app.ctx.long_poll_max_timeout) if wait is not None else None
+    except ValueError as e:
+        return sanic.response.text(f"Error: invalid wait: {e}", status=400)
+    job = await control.sequence_status(job_id, wait)
+    if job is None:
+        return sanic.response.text(f"Error: {job_id} not found", status=404)
+    return sanic.response.json(job)
+
+
+@app.route("/sequence/<job_id:str>/cancel", methods=["POST"])
+async def sequence_cancel(_: sanic.Request, job_id: str):
+    control: ControlCenter = app.ctx.control
+    job = await control.sequence_cancel(job_id)
+    if job is None:
+        return sanic.response.text(f"Error: {job_id} not found", status=404)
+    return sanic.response.json(job)
+
+
+async def _queue_command_response(target: str, prompt: str) -> sanic.HTTPResponse:
+    control: ControlCenter = app.ctx.control
+    try:
+        command = await control.submit(target, prompt)
+    except ValueError as e:
+        # 超出机械臂工作空间
+        return sanic.response.text(f"Error: {e}", status=400)
+    if command is None:
+        return sanic.response.text(f"Error: {prompt} not found")
+    return _command_response(command)
+
+
+def _command_response(command: dict) -> sanic.HTTPResponse:
+    # 确认由 ControlCenter 在指令发送 (或合并) 完成后推送; 指令提交时的服务端时间, 客户端可以用它作为 after_ts 等待指令之后的帧
+    return sanic.response.text(
+        "ok", headers={"X-Command-Id": command["id"], "X-Command-Ts": f"{command['submitted_at']:.6f}"}
+    )
+
+
+@app.route("/command/<command_id:str>", methods=["GET"])
+async def command_status(request: sanic.Request, command_id: str):
+    control: ControlCenter = app.ctx.control
+    command = await control.command_status(command_id)
+    if command is None:
+        return sanic.response.text(f"Error: {command_id} not found", status=404)
+    return sanic.response.json(command)
+
+
+def _float_params(request: sanic.Request, defaults: dict[str, Optional[float]]) -> dict[str, Optional[float]]:
+    """
+    从JSON请求体或查询参数中读取数值参数 (请求体优先), 都没有给出时使用 defaults 中的默认值
+    """
+    body = request.json if request.body else None
+    params = body if isinstance(body, dict) else {}
+    values = {}
+    for name, default in defaults.items():
+        value = params.get(name, request.args.get(name, default))
+        values[name] = float(value) if value is not None else None
+    return values
+
+
+@app.route("/arm/move", methods=["POST", "GET"])
+async def arm_move_delta(request: sanic.Request):
+    control: ControlCenter = app.ctx.control
+    if request.method == "GET":
+        return sanic.response.json(await control.workspace())
+
+    try:
+        # 平移单位为米, 旋转单位为弧度
+        command = await control.move(_float_params(request, {
+            **{name: 0.0 for name in ("dx", "dy", "dz", "roll", "pitch", "yaw")},
+            "speed": ARM_SPEED,
+        }))
+    except Exception as e:
+        return sanic.response.text(f"Error: {e}", status=400)
+    return _command_response(command)
+
+
 @app.route("/arm/<prompt:str>", methods=["POST", "GET"])
 async def arm_move(request: sanic.Request, prompt: str):
-    arm_controller: ArmController = app.ctx.arm_controller
-    match prompt:
-        case "forward":
-            await arm_controller.forward()
-        case "backward":
-            await arm_controller.backward()
-        case "turn_left":
-            await arm_controller.turn_left()
-        case "turn_right":
-            await arm_controller.turn_right()
-        case "down":
-            await arm_controller.down()
-        case "up":
-            await arm_controller.up()
-        case "hold":
-            await arm_controller.hold()
-        case "release":
-            await arm_controller.release()
-        case "set_home":
-            await arm_controller.set_home()
-        case "go_home":
-            await arm_controller.go_home()
-        case _:
-            return sanic.response.text(f"Error: {prompt} not found")
-
-    return sanic.response.text("ok")
+    return await _queue_command_response("arm", prompt)
+
+
+@app.route("/chassis/velocity", methods=["POST", "GET"])
+async def chassis_velocity(request: sanic.Request):
+    control: ControlCenter = app.ctx.control
+    if request.method == "GET":
+        return sanic.response.json(await control.velocity())
+
+    try:
+        params = _float_params(request, {"linear": 0.0, "angular": 0.0, "duration": None})
+        state = await control.set_velocity(params["linear"], params["angular"], params["duration"])
+        return sanic.response.json(state, headers={"X-Command-Ts": f"{time.time():.6f}"})
+    except Exception as e:
+        return sanic.response.text(f"Error: {e}", status=400)
 
 
 @app.route("/chassis/<prompt:str>", methods=["POST", "GET"])
 async def chassis_move(request: sanic.Request, prompt: str):
-    chassis_controller: ChassisController = app.ctx.chassis_controller
-    match prompt:
-        case "forward":
-            await chassis_controller.forward()
-        case "backward":
-            await chassis_controller.backward()
-        case "turn_left":
-            await chassis_controller.turn_left()
-        case "turn_right":
-            await chassis_controller.turn_right()
-        case "stop":
-            await chassis_controller.stop()
-        case _:
-            return sanic.response.text(f"Error: {prompt} not found")
-
-    return sanic.response.text("ok")
+    return await _queue_command_response("chassis", prompt)
 
 
 if __name__ == "__main__":
-    import os
-
     port = int(os.environ.get("PORT", 11451))
     host = os.environ.get("HOST", "0.0.0.0")
 
     try:
         print(f"Server Started at: {host}:{port}")
-        app.run(host=host, port=port, debug=False)
+        app.run(host=host, port=port, workers=WORKERS, debug=False)
     except KeyboardInterrupt:
         pass
     finally:
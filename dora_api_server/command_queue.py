@@ -0,0 +1,235 @@
+import asyncio
+import itertools
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Optional
+
+import pyarrow as pa
+
+
+class QueuedCommand:
+    def __init__(self, command_id: str, target: str, output_id: str, payload: pa.Array):
+        self.command_id = command_id
+        self.target = target
+        self.output_id = output_id
+        # 未合并时直接发送原始负载, 避免重新构造 Arrow 数组
+        self.payload = payload
+        self.values = payload.to_pylist()
+        # queued -> sent / merged / failed
+        self.status = "queued"
+        # 被合并到的指令id; 合并后相互抵消、没有发送任何指令时为 None
+        self.merged_into: Optional[str] = None
+        # 合并到本指令中的指令, 本指令完成时一起完成
+        self.merged: list["QueuedCommand"] = []
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.sent_at: Optional[float] = None
+        self._done = asyncio.get_running_loop().create_future()
+        self._callbacks: list[Callable[["QueuedCommand"], None]] = []
+
+    @property
+    def finished(self) -> bool:
+        return self._done.done()
+
+    def add_done_callback(self, callback: Callable[["QueuedCommand"], None]) -> None:
+        if self.finished:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    async def wait(self) -> bool:
+        """
+        等待指令发送, 返回是否成功; 被合并的指令在合并后的指令发送时完成
+        """
+        return await asyncio.shield(self._done)
+
+    def _finish(self, ok: bool) -> None:
+        if self.finished:
+            return
+        self._done.set_result(ok)
+        for callback in self._callbacks:
+            callback(self)
+        self._callbacks.clear()
+        for command in self.merged:
+            command._finish(ok)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.command_id,
+            "target": self.target,
+            "output": self.output_id,
+            "values": self.values,
+            "status": self.status,
+            "merged_into": self.merged_into,
+            "merged": [command.command_id for command in self.merged],
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "sent_at": self.sent_at,
+        }
+
+
+class CommandQueue:
+    """
+    单个执行器的指令队列: 提交后立即返回指令id, 由独立的任务按不超过 max_rate 的频率发送.
+
+    只有尚未发送的相邻指令才会合并, 不会改变不同指令之间的顺序:
+    latest_only 时新指令直接替换排队中的指令 (底盘的状态指令只有最后一条有意义);
+    additive_outputs 中的输出把位姿增量相加, 相互抵消时两条都不发送, 相加后 can_merge 返回False时分开发送;
+    其他输出只合并完全相同的重复指令.
+    """
+
+    def __init__(
+            self,
+            target: str,
+            send: Callable[[str, pa.Array], Awaitable[None]],
+            max_rate: float = 10.0,
+            latest_only: bool = False,
+            additive_outputs: tuple[str, ...] = (),
+            can_merge: Optional[Callable[[str, list], bool]] = None,
+            max_commands: int = 256,
+    ):
+        self.target = target
+        self.send = send
+        # 相邻两次发送的最小间隔, max_rate 为0时不限制
+        self.min_interval = 1 / max_rate if max_rate > 0 else 0.0
+        self.latest_only = latest_only
+        self.additive_outputs = additive_outputs
+        # 以 (output_id, 相加后的值) 调用, 用于检查合并后是否仍在单条指令的限制内
+        self.can_merge = can_merge
+        # 最多保留的指令数, 超出时删除最旧的已完成指令
+        self.max_commands = max_commands
+
+        self.commands: OrderedDict[str, QueuedCommand] = OrderedDict()
+        self._pending: deque[QueuedCommand] = deque()
+        self._ids = itertools.count(1)
+        self._ready: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sending: Optional[QueuedCommand] = None
+        self._last_sent_at = 0.0
+
+    def submit(self, output_id: str, payload: pa.Array) -> QueuedCommand:
+        command = QueuedCommand(f"{self.target}-{next(self._ids)}", self.target, output_id, payload)
+        self.commands[command.command_id] = command
+        self._prune()
+
+        if self._pending:
+            previous = self._pending[-1]
+            values = self._merge_values(previous, command)
+            if values is not None:
+                self._pending.pop()
+                # 已合并到 previous 的指令一并转移到新指令, merged_into 始终指向实际发送的指令
+                merged = previous.merged + [previous]
+                previous.merged = []
+                previous.status = "merged"
+                if self._cancels_out(command.output_id, values):
+                    # 增量相互抵消, 都不发送
+                    command.status = "merged"
+                    for merged_command in merged:
+                        merged_command.merged_into = None
+                        merged_command._finish(True)
+                    command._finish(True)
+                    return command
+                for merged_command in merged:
+                    merged_command.merged_into = command.command_id
+                if values != command.values:
+                    command.values = values
+                    command.payload = pa.array(values)
+                command.merged.extend(merged)
+
+        self._pending.append(command)
+        self._ensure_task()
+        self._ready.set()
+        return command
+
+    def get(self, command_id: str) -> Optional[QueuedCommand]:
+        return self.commands.get(command_id, None)
+
+    @property
+    def queued(self) -> int:
+        return len(self._pending)
+
+    def _merge_values(self, previous: QueuedCommand, command: QueuedCommand) -> Optional[list]:
+        """
+        返回两条指令合并后的值, 不能合并时返回 None
+        """
+        if previous.output_id != command.output_id:
+            return None
+        if self.latest_only:
+            return command.values
+        if command.output_id in self.additive_outputs:
+            # 前面为位姿增量, 相加; 最后一个为速度, 取较大者
+            deltas = [a + b for a, b in zip(previous.values[:-1], command.values[:-1])]
+            values = deltas + [max(previous.values[-1], command.values[-1])]
+            if self.can_merge is not None and not self.can_merge(command.output_id, values):
+                return None
+            return values
+        if previous.values == command.values:
+            return command.values
+        return None
+
+    def _cancels_out(self, output_id: str, values: list) -> bool:
+        return output_id in self.additive_outputs and all(abs(value) < 1e-9 for value in values[:-1])
+
+    def _prune(self) -> None:
+        # 指令基本按提交顺序完成, 只从最旧的一端删除已完成的指令, 避免每次提交都遍历
+        while len(self.commands) > self.max_commands:
+            command_id, command = next(iter(self.commands.items()))
+            if not command.finished:
+                return
+            del self.commands[command_id]
+
+    def _ensure_task(self) -> None:
+        if self._task is None or self._task.done():
+            self._ready = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await self._ready.wait()
+            # 限速等待期间到达的指令可以继续合并
+            delay = self._last_sent_at + self.min_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if not self._pending:
+                self._ready.clear()
+                continue
+
+            command = self._pending.popleft()
+            if not self._pending:
+                self._ready.clear()
+            self._last_sent_at = time.monotonic()
+            self._sending = command
+            try:
+                await self.send(command.output_id, command.payload)
+            except Exception as e:
+                self._fail(command, str(e))
+            else:
+                command.status = "sent"
+                command.sent_at = time.time()
+                command._finish(True)
+            finally:
+                self._sending = None
+
+    async def stop(self, timeout: float = 1.0) -> None:
+        """
+        在 timeout 秒内尽量发送完排队的指令, 之后取消发送任务
+        """
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (self._pending or self._sending is not None) and time.monotonic() < deadline:
+            await asyncio.sleep(min(self.min_interval or 0.01, deadline - time.monotonic()))
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        for command in self._pending:
+            self._fail(command, "Command queue stopped")
+        self._pending.clear()
+
+    @staticmethod
+    def _fail(command: QueuedCommand, error: str) -> None:
+        # 合并到本指令中的指令同样没有发送, 状态一起改为 failed
+        for merged in [command] + command.merged:
+            merged.status = "failed"
+            merged.error = error
+        command._finish(False)
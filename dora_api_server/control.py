@@ -0,0 +1,365 @@
+import asyncio
+import json
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.managers import BaseManager
+from typing import Callable, Optional
+
+from dora_api_server.command_queue import QueuedCommand
+from dora_api_server.metrics import ControlMetrics
+from dora_api_server.node_publisher import ArmController, ArmWorkspace, ChassisController, ChassisVelocityDriver
+from dora_api_server.sequence_runner import SequenceRunner
+
+# 与下面 submit_arm / submit_chassis 中的分支一致, 用于提前校验指令序列
+COMMAND_PROMPTS = {
+    "arm": {"forward", "backward", "turn_left", "turn_right", "down", "up", "hold", "release", "set_home", "go_home"},
+    "chassis": {"forward", "backward", "turn_left", "turn_right", "stop"},
+}
+
+
+def _optional_float(name: str) -> Optional[float]:
+    value = os.environ.get(name, "")
+    return float(value) if value else None
+
+
+def create_arm_workspace() -> ArmWorkspace:
+    # ARM_MIN_X ... ARM_MAX_Z: 相对 home 的偏移范围 (米), 未设置的不限制
+    return ArmWorkspace(
+        limits={
+            axis: (_optional_float(f"ARM_MIN_{axis.upper()}"), _optional_float(f"ARM_MAX_{axis.upper()}"))
+            for axis in ArmWorkspace.AXES
+        },
+        max_step=float(os.environ.get("ARM_MAX_STEP", 0.3)),
+        max_rotation=float(os.environ.get("ARM_MAX_ROTATION", 0.5)),
+        max_speed=float(os.environ.get("ARM_MAX_SPEED", 1.0)),
+    )
+
+
+def create_control(sender) -> "ControlCenter":
+    """
+    按环境变量创建控制状态, sender 为持有 dora Node 的 DoraNodeListener
+    """
+    arm_controller = ArmController(
+        sender=sender,
+        max_rate=float(os.environ.get("ARM_MAX_RATE", 10)),
+        workspace=create_arm_workspace(),
+    )
+    chassis_controller = ChassisController(
+        sender=sender, max_rate=float(os.environ.get("CHASSIS_MAX_RATE", 20)),
+    )
+    chassis_velocity = ChassisVelocityDriver(
+        chassis=chassis_controller,
+        rate=float(os.environ.get("CHASSIS_VELOCITY_RATE", 10)),
+        max_duration=float(os.environ.get("CHASSIS_VELOCITY_MAX_DURATION", 2.0)),
+    )
+    return ControlCenter(arm_controller, chassis_controller, chassis_velocity)
+
+
+class ControlCenter:
+    """
+    机械臂与底盘的全部控制状态: 指令队列 (合并、限速与指令ID)、机械臂工作空间、底盘速度指令与指令序列.
+
+    单worker时在worker中创建; 多worker时只在节点进程中创建一份, 各worker经由 RemoteControl 调用,
+    限速与安全状态不会按worker数量复制. REMOTE_METHODS 中的方法只收发可序列化的值.
+    指令完成时的确认通过 ack_listeners 回调发出, 不需要为每条指令等待.
+    """
+
+    REMOTE_METHODS = (
+        "submit", "run_command", "move", "command_status", "workspace", "render_metrics",
+        "set_velocity", "velocity", "sequence_submit", "sequence_status", "sequence_cancel",
+    )
+
+    def __init__(
+            self,
+            arm_controller: ArmController,
+            chassis_controller: ChassisController,
+            chassis_velocity: ChassisVelocityDriver,
+    ):
+        self.arm_controller = arm_controller
+        self.chassis_controller = chassis_controller
+        self.chassis_velocity = chassis_velocity
+        self.sequence_runner = SequenceRunner(command_handler=self._dispatch_command, valid_prompts=COMMAND_PROMPTS)
+        # submit / move 提交的指令以及序列中的每一步完成后以 (target, prompt, ok, 指令id) 调用, 用于推送确认;
+        # 序列的步骤没有指令id
+        self.ack_listeners: list[Callable[[str, str, bool, Optional[str]], None]] = []
+        self.metrics = ControlMetrics(self.controllers)
+
+    @property
+    def controllers(self) -> dict:
+        return {"arm": self.arm_controller, "chassis": self.chassis_controller}
+
+    async def submit_arm(self, prompt: str) -> Optional[QueuedCommand]:
+        arm_controller = self.arm_controller
+        match prompt:
+            case "forward":
+                return await arm_controller.forward()
+            case "backward":
+                return await arm_controller.backward()
+            case "turn_left":
+                return await arm_controller.turn_left()
+            case "turn_right":
+                return await arm_controller.turn_right()
+            case "down":
+                return await arm_controller.down()
+            case "up":
+                return await arm_controller.up()
+            case "hold":
+                return await arm_controller.hold()
+            case "release":
+                return await arm_controller.release()
+            case "set_home":
+                return await arm_controller.set_home()
+            case "go_home":
+                return await arm_controller.go_home()
+        return None
+
+    async def submit_chassis(self, prompt: str) -> Optional[QueuedCommand]:
+        chassis_controller = self.chassis_controller
+        match prompt:
+            case "forward":
+                command = await chassis_controller.forward()
+            case "backward":
+                command = await chassis_controller.backward()
+            case "turn_left":
+                command = await chassis_controller.turn_left()
+            case "turn_right":
+                command = await chassis_controller.turn_right()
+            case "stop":
+                command = await chassis_controller.stop()
+            case _:
+                # 未知指令不影响正在执行的速度指令, 到期后仍会自动停止
+                return None
+        # 有效的离散指令已放入队列后才接管底盘, 停止重发速度指令
+        self.chassis_velocity.cancel()
+        return command
+
+    async def submit_command(self, target: str, prompt: str) -> Optional[QueuedCommand]:
+        """
+        放入对应执行器的指令队列后立即返回, 未知指令返回None
+        """
+        match target:
+            case "arm":
+                return await self.submit_arm(prompt)
+            case "chassis":
+                return await self.submit_chassis(prompt)
+        return None
+
+    async def run_command(self, target: str, prompt: str) -> bool:
+        # 等待指令实际发送 (或被合并的指令发送) 后返回
+        command = await self.submit_command(target, prompt)
+        if command is None:
+            return False
+        return await command.wait()
+
+    def _publish_ack(self, target: str, prompt: str, ok: bool, command_id: Optional[str] = None) -> None:
+        for listener in self.ack_listeners:
+            listener(target, prompt, ok, command_id)
+
+    def _ack_when_done(self, prompt: str, command: QueuedCommand) -> None:
+        # 发送、合并或失败时推送确认
+        command.add_done_callback(
+            lambda done: self._publish_ack(done.target, prompt, done.status != "failed", done.command_id)
+        )
+
+    async def _dispatch_command(self, target: str, prompt: str) -> bool:
+        ok = await self.run_command(target, prompt)
+        self._publish_ack(target, prompt, ok)
+        return ok
+
+    def _find_command(self, command_id: str) -> tuple[object, Optional[QueuedCommand]]:
+        controller = self.arm_controller if command_id.startswith("arm-") else self.chassis_controller
+        return controller, controller.queue.get(command_id)
+
+    async def submit(self, target: str, prompt: str) -> Optional[dict]:
+        """
+        未知指令返回None, 超出机械臂工作空间时抛出 ValueError
+        """
+        command = await self.submit_command(target, prompt)
+        if command is None:
+            return None
+        self._ack_when_done(prompt, command)
+        return command.to_dict()
+
+    async def move(self, params: dict) -> dict:
+        command = await self.arm_controller.move(**params)
+        self._ack_when_done("move", command)
+        return command.to_dict()
+
+    async def command_status(self, command_id: str) -> Optional[dict]:
+        controller, command = self._find_command(command_id)
+        if command is None:
+            return None
+        return {**command.to_dict(), "queued": controller.queue.queued}
+
+    async def workspace(self) -> dict:
+        return self.arm_controller.workspace.to_dict()
+
+    async def render_metrics(self) -> str:
+        return self.metrics.render()
+
+    async def set_velocity(self, linear: float, angular: float, duration: Optional[float] = None) -> dict:
+        return await self.chassis_velocity.set_velocity(
+            linear=linear,
+            angular=angular,
+            duration=duration if duration is not None else self.chassis_velocity.max_duration,
+        )
+
+    async def velocity(self) -> dict:
+        return self.chassis_velocity.to_dict()
+
+    async def sequence_submit(self, steps: list[dict]) -> dict:
+        return self.sequence_runner.submit(steps).to_dict()
+
+    async def sequence_status(self, job_id: str, wait: Optional[float] = None) -> Optional[dict]:
+        job = self.sequence_runner.get(job_id)
+        if job is None:
+            return None
+        if wait is not None:
+            await self.sequence_runner.wait(job, wait)
+        return job.to_dict()
+
+    async def sequence_cancel(self, job_id: str) -> Optional[dict]:
+        job = self.sequence_runner.cancel(job_id)
+        if job is None:
+            return None
+        await self.sequence_runner.wait(job, timeout=1.0)
+        return job.to_dict()
+
+    async def close(self) -> None:
+        await self.sequence_runner.stop()
+        await self.chassis_velocity.close()
+        await self.arm_controller.queue.stop()
+        await self.chassis_controller.queue.stop()
+
+
+class ControlManager(BaseManager):
+    pass
+
+
+def control_address(prefix: str) -> str:
+    # Linux 抽象命名空间的 Unix 套接字, 不在文件系统中留下文件
+    return f"\0{prefix}_control"
+
+
+def ack_address(prefix: str) -> str:
+    return f"\0{prefix}_acks"
+
+
+class AckBroadcaster:
+    """
+    节点进程中把指令确认以一行JSON写给每个连接的worker; 写入由 asyncio 缓冲, 不阻塞指令队列也不会丢失
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self._writers: set[asyncio.StreamWriter] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        # uvloop 不接受抽象命名空间的路径, 由这里创建套接字
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.address)
+        self._server = await asyncio.start_unix_server(self._on_connect, sock=sock)
+
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._writers.add(writer)
+        try:
+            # worker 只接收, 断开时 read 返回
+            await reader.read()
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def publish(self, target: str, prompt: str, ok: bool, command_id: Optional[str] = None) -> None:
+        line = (json.dumps([target, prompt, ok, command_id]) + "\n").encode()
+        for writer in self._writers:
+            writer.write(line)
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+
+
+class ControlBridge:
+    """
+    节点进程中的控制服务: 管理器的连接线程通过它在事件循环中调用 ControlCenter
+    """
+
+    def __init__(self, control: ControlCenter, loop: asyncio.AbstractEventLoop):
+        self.control = control
+        self.loop = loop
+
+    def call(self, method: str, *args):
+        if method not in ControlCenter.REMOTE_METHODS:
+            raise AttributeError(f"Unknown control method: {method}")
+        return asyncio.run_coroutine_threadsafe(getattr(self.control, method)(*args), self.loop).result()
+
+
+class RemoteControl:
+    """
+    多worker模式下 worker 中的 ControlCenter 代理, 与 ControlCenter 的 REMOTE_METHODS 接口相同.
+
+    每次调用在专用线程池中经由节点进程的控制服务同步执行, 每个线程使用自己的连接, 长时间等待的调用互不阻塞.
+    指令确认不经由调用等待: start 之后从节点进程的 AckBroadcaster 接收, 交给 ack_listeners.
+    """
+
+    def __init__(self, address: str, acks_address: Optional[str] = None, max_workers: int = 16):
+        self.address = address
+        self.acks_address = acks_address
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="control-client")
+        self._proxy = None
+        self.ack_listeners: list[Callable[[str, str, bool, Optional[str]], None]] = []
+        self._ack_task: Optional[asyncio.Task] = None
+        self._ack_writer: Optional[asyncio.StreamWriter] = None
+
+    def _call(self, method: str, *args):
+        if self._proxy is None:
+            ControlManager.register("control")
+            manager = ControlManager(address=self.address)
+            manager.connect()
+            self._proxy = manager.control()
+        return self._proxy.call(method, *args)
+
+    def __getattr__(self, method: str):
+        if method not in ControlCenter.REMOTE_METHODS:
+            raise AttributeError(method)
+
+        async def call(*args):
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._call, method, *args)
+
+        return call
+
+    async def start(self) -> None:
+        if self.acks_address is not None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.acks_address)
+            # 需要保留 writer, 被回收时会关闭连接
+            reader, self._ack_writer = await asyncio.open_unix_connection(sock=sock)
+            self._ack_task = asyncio.create_task(self._receive_acks(reader))
+
+    async def _receive_acks(self, reader: asyncio.StreamReader) -> None:
+        while line := await reader.readline():
+            ack = json.loads(line)
+            for listener in self.ack_listeners:
+                listener(*ack)
+
+    async def close(self) -> None:
+        if self._ack_task is not None:
+            self._ack_task.cancel()
+            await asyncio.gather(self._ack_task, return_exceptions=True)
+            self._ack_writer.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def serve_control(control: ControlCenter, address: str, loop: asyncio.AbstractEventLoop) -> None:
+    """
+    在后台线程中提供控制服务; 连接使用与父进程相同的 authkey, 只有同一主进程启动的worker能连接
+    """
+    bridge = ControlBridge(control, loop)
+    ControlManager.register("control", callable=lambda: bridge)
+    server = ControlManager(address=address).get_server()
+    threading.Thread(target=server.serve_forever, name="control-server", daemon=True).start()
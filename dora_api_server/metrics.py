@@ -0,0 +1,232 @@
+import asyncio
+import bisect
+import math
+import time
+from typing import Callable, Iterable, Optional
+
+from dora_api_server.node_listener import ImagesManager
+
+# 单位均为秒
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FRAME_AGE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """
+    记录时只做一次二分查找和两次加法, 累计计数与文本格式化都推迟到被抓取时
+    """
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            label_names: tuple[str, ...] = (),
+            buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # 每组标签: [各桶(非累计)计数..., 超出最大桶的计数], 总和
+        self.counts: dict[tuple, list[int]] = {}
+        self.sums: dict[tuple, float] = {}
+
+    def observe(self, value: float, *label_values) -> None:
+        counts = self.counts.get(label_values, None)
+        if counts is None:
+            counts = [0] * (len(self.buckets) + 1)
+            self.counts[label_values] = counts
+            self.sums[label_values] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[label_values] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, counts in self.counts.items():
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(upper_bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.label_names, label_values, le)} {cumulative}"
+                )
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(self.sums[label_values])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Prometheus 文本格式的指标集合.
+
+    除了主动记录的 Histogram, 还可以注册在抓取时才读取现有统计的 collector,
+    这类指标在没有人抓取时没有任何开销.
+    """
+
+    def __init__(self):
+        self.metrics: list[Histogram] = []
+        self.collectors: list[Callable[[], Iterable[str]]] = []
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            label_names: tuple[str, ...] = (),
+            buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name, documentation, label_names, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[str]]) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+def render_samples(
+        name: str,
+        metric_type: str,
+        documentation: str,
+        label_names: tuple[str, ...],
+        samples: Iterable[tuple[tuple, float]],
+) -> list[str]:
+    """
+    供 collector 使用: 把 (标签值, 数值) 序列格式化为一个指标
+    """
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for label_values, value in samples:
+        lines.append(f"{name}{_format_labels(label_names, label_values)} {_format_value(value)}")
+    return lines
+
+
+class ControlMetrics:
+    """
+    指令的指标: 交给dora节点发送的耗时与各执行器排队中的指令数.
+
+    在持有指令队列的进程中记录; 多worker模式下由节点进程渲染, 各worker的 /metrics 经由控制服务取回.
+    """
+
+    def __init__(self, controllers: dict):
+        self.registry = MetricsRegistry()
+        self.send_duration = self.registry.histogram(
+            "restapi_dora_send_duration_seconds",
+            "Time until a controller output is handed to the dora node",
+            ("controller", "output"),
+        )
+        for name, controller in controllers.items():
+            controller.send_listeners.append(
+                lambda output_id, seconds, name=name: self.send_duration.observe(seconds, name, output_id)
+            )
+
+        self.registry.add_collector(lambda: render_samples(
+            "restapi_command_queue_depth", "gauge", "Commands waiting to be sent per controller", ("controller",),
+            [((name,), controller.queue.queued) for name, controller in controllers.items()],
+        ))
+
+    def render(self) -> str:
+        return self.registry.render()
+
+
+class ServerMetrics:
+    """
+    RestAPI 节点的指标: 请求耗时、图像处理各阶段耗时、每个摄像头的帧计数与帧龄与事件循环延迟;
+    指令的指标见 ControlMetrics.
+
+    帧计数直接读取 ImagesManager 已有的统计, 只在被抓取时格式化.
+    """
+
+    def __init__(self, loop_lag_interval: float = 0.5):
+        self.registry = MetricsRegistry()
+        self.request_duration = self.registry.histogram(
+            "restapi_request_duration_seconds",
+            "Time from receiving a request to sending the response headers",
+            ("route", "method", "status"),
+        )
+        self.image_stage_duration = self.registry.histogram(
+            "restapi_image_stage_duration_seconds",
+            "Duration of image decode / resize / encode steps",
+            ("stage",),
+        )
+        self.frame_age = self.registry.histogram(
+            "restapi_frame_age_seconds",
+            "Age of served frames, measured from the dora capture timestamp",
+            ("camera",),
+            buckets=FRAME_AGE_BUCKETS,
+        )
+        self.loop_lag = self.registry.histogram(
+            "restapi_event_loop_lag_seconds",
+            "Delay of a periodic timer on the event loop beyond its scheduled time",
+        )
+        # 每隔 loop_lag_interval 秒测量一次事件循环延迟, 为0时不测量
+        self.loop_lag_interval = loop_lag_interval
+        self._loop_lag_task: Optional[asyncio.Task] = None
+
+    def attach(self, image_bucket: ImagesManager, dropped_events: Callable[[], int]) -> None:
+        image_bucket.stage_listeners.append(lambda stage, seconds: self.image_stage_duration.observe(seconds, stage))
+        image_bucket.serve_listeners.append(
+            lambda camera_id, frame: self.frame_age.observe(frame.age_ms() / 1000, camera_id)
+        )
+        def collect_frames() -> list[str]:
+            lines = []
+            for field in ("received", "coalesced", "decoded", "served"):
+                lines.extend(render_samples(
+                    f"restapi_frames_{field}_total",
+                    "counter",
+                    f"Frames {field} per camera",
+                    ("camera",),
+                    [((camera_id,), getattr(stats, field)) for camera_id, stats in image_bucket.camera_stats.items()],
+                ))
+            lines.extend(render_samples(
+                "restapi_dropped_events_total", "counter", "Events dropped before processing", (),
+                [((), dropped_events())],
+            ))
+            return lines
+
+        self.registry.add_collector(collect_frames)
+
+    def observe_request(self, route: str, method: str, status: int, seconds: float) -> None:
+        self.request_duration.observe(seconds, route, method, status)
+
+    def start(self) -> None:
+        if self.loop_lag_interval > 0:
+            self._loop_lag_task = asyncio.create_task(self._measure_loop_lag())
+
+    async def stop(self) -> None:
+        if self._loop_lag_task is not None:
+            self._loop_lag_task.cancel()
+            await asyncio.gather(self._loop_lag_task, return_exceptions=True)
+            self._loop_lag_task = None
+
+    async def _measure_loop_lag(self) -> None:
+        while True:
+            scheduled_at = time.perf_counter() + self.loop_lag_interval
+            await asyncio.sleep(self.loop_lag_interval)
+            self.loop_lag.observe(max(time.perf_counter() - scheduled_at, 0.0))
+
+    def render(self) -> str:
+        return self.registry.render()
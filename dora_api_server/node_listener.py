@@ -1,6 +1,12 @@
 import asyncio
-from typing import Optional
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Optional, Union
 import base64
+import queue
+import threading
+import time
 
 import cv2
 import numpy as np
@@ -8,97 +14,1174 @@ from dora import Node
 import pyarrow as pa
 
 
-# TODO: 添加图像过期时间以避免潜在的内存问题
-class ImagesManager:
+IMAGE_FORMATS = ["jpeg", "png", "webp"]
+COMPRESSED_ENCODINGS = {
+    "jpeg": "jpeg",
+    "jpg": "jpeg",
+    "jpe": "jpeg",
+    "bmp": "bmp",
+    "webp": "webp",
+    "png": "png",
+}
+
+
+def _compressed_image_size(data: np.ndarray, encoding: str) -> Optional[tuple[int, int]]:
+    """
+    不解码图像,仅从文件头读取 (width, height); 无法识别时返回None
+    """
+    header = data[:32].tobytes()
+    if encoding == "png" and len(header) >= 24 and header[:8] == b"\x89PNG\r\n\x1a\n":
+        return int.from_bytes(header[16:20], "big"), int.from_bytes(header[20:24], "big")
+    if encoding != "jpeg" or header[:2] != b"\xff\xd8":
+        return None
+
+    # 逐个跳过JPEG段,直到遇到SOFn段
+    offset = 2
+    length = len(data)
+    while offset + 9 < length:
+        if data[offset] != 0xFF:
+            return None
+        marker = int(data[offset + 1])
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        segment_length = (int(data[offset + 2]) << 8) | int(data[offset + 3])
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = (int(data[offset + 5]) << 8) | int(data[offset + 6])
+            width = (int(data[offset + 7]) << 8) | int(data[offset + 8])
+            return width, height
+        offset += 2 + segment_length
+    return None
+
+
+def _metadata_timestamp(metadata: dict) -> Optional[float]:
+    """
+    读取dora元数据中的时间戳并转为unix秒; 旧版本dora不提供时返回None
+    """
+    timestamp = metadata.get("timestamp", None)
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    if isinstance(timestamp, (int, float)):
+        # 兼容以纳秒/毫秒为单位的整数时间戳
+        if timestamp > 1e17:
+            return timestamp / 1e9
+        if timestamp > 1e11:
+            return timestamp / 1e3
+        return float(timestamp)
+    return None
+
+
+def _resized_size(width: int, height: int, max_length: int) -> tuple[int, int]:
+    # 长边缩放到 max_length
+    if height > width:
+        return int(width * max_length / height), max_length
+    return max_length, int(height * max_length / width)
+
+
+# 以下函数不依赖 ImagesManager 的状态,可以在线程池或进程池中执行
+def _resize_long_side(np_image: np.ndarray, max_length: int) -> np.ndarray:
+    # 缩小到一半及以下时用区域插值避免混叠; 缩小不到一半时双线性插值的混叠可以忽略, 且比区域插值快得多
+    interpolation = cv2.INTER_AREA if max(np_image.shape[:2]) >= 2 * max_length else cv2.INTER_LINEAR
+    return cv2.resize(
+        np_image, _resized_size(np_image.shape[1], np_image.shape[0], max_length), interpolation=interpolation
+    )
+
+
+def _decode_payload(
+        encoding: str,
+        payload: np.ndarray,
+        width: Optional[int],
+        height: Optional[int],
+        dst: Optional[np.ndarray] = None,
+) -> Optional[np.ndarray]:
+    if encoding == "rgb8":
+        rgb_view = payload.reshape((height, width, 3))
+        if dst is None:
+            return cv2.cvtColor(rgb_view, cv2.COLOR_RGB2BGR)
+        # 通道交换与拷贝合并为一次写入预分配缓冲区
+        cv2.cvtColor(rgb_view, cv2.COLOR_RGB2BGR, dst=dst)
+        return dst
+
+    try:
+        np_image = cv2.imdecode(payload, cv2.IMREAD_COLOR)
+        if np_image is None:
+            raise Exception("Failed to decode image")
+    except Exception as e:
+        print(f"Failed to decode image: {e}")
+        return None
+    return np_image
+
+
+def _encode_array(
+        np_image: np.ndarray,
+        jpeg_quality: int,
+        max_length: Optional[int],
+        image_format: str,
+) -> Optional[bytes]:
+    if max_length is not None and max(np_image.shape[:2]) > max_length:
+        np_image = _resize_long_side(np_image, max_length)
+
+    if image_format == "jpeg":
+        encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality]
+    elif image_format == "webp":
+        encode_params = [int(cv2.IMWRITE_WEBP_QUALITY), jpeg_quality]
+    else:
+        encode_params = []
+    success, buffer = cv2.imencode(f".{image_format}", np_image, encode_params)
+    if not success:
+        return None
+    return buffer.tobytes()
+
+
+def _timed(func, *args):
+    # 在执行线程/进程内计时, 结果不包含在 executor 中排队等待的时间
+    started_at = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started_at
+
+
+# 计时统计中各处理函数对应的阶段名
+IMAGE_STAGES = {
+    _decode_payload: "decode",
+    _resize_long_side: "resize",
+    _encode_array: "encode",
+}
+
+
+def _history_min_length(live_frame: "CapturedFrame", max_length) -> Optional[int]:
+    """
+    历史帧可以代替该摄像头最新帧所需的最小长边: 请求的 max_length 与原图长边中较小者;
+    原图尺寸未知时返回 None, 不使用历史帧
+    """
+    if live_frame.width is None or live_frame.height is None:
+        return None
+    source_length = max(live_frame.width, live_frame.height)
+    if max_length is None or max_length == "":
+        return source_length
+    return min(int(max_length), source_length)
+
+
+class CapturedFrame:
+    def __init__(
+            self,
+            seq: int,
+            encoding: str,
+            width: Optional[int] = None,
+            height: Optional[int] = None,
+            payload: Optional[np.ndarray] = None,
+            source_quality: Optional[int] = None,
+            capture_ts: Optional[float] = None,
+            receive_ts: Optional[float] = None,
+    ):
+        # seq 按摄像头单调递增,用于区分不同帧
+        self.seq = seq
+        self.encoding = encoding
+        self.width = width
+        self.height = height
+        # 原始负载(Arrow缓冲区视图),压缩帧可直接透传给客户端
+        self.payload = payload
+        # 解码后的BGR图像,首次需要像素时才解码,新帧到来时随旧帧一起丢弃
+        self.image: Optional[np.ndarray] = None
+        self.source_quality = source_quality
+        # 正在使用该帧的异步任务数, 大于0时不回收其缓冲区
+        self.pins = 0
+        self.decoding: Optional[asyncio.Task] = None
+        # 按需生成的缩小图像, 键为长边长度, 与 image 一起丢弃
+        self.pyramid: dict[int, np.ndarray] = {}
+        self.resizing: dict[int, asyncio.Task] = {}
+        # 时间戳均为unix秒; 采集时间取自dora元数据,缺失时退化为接收时间
+        self.receive_ts = receive_ts if receive_ts is not None else time.time()
+        self.capture_ts = capture_ts if capture_ts is not None else self.receive_ts
+
+    @property
+    def nbytes(self) -> int:
+        nbytes = 0
+        if self.payload is not None:
+            nbytes += self.payload.nbytes
+        if self.image is not None:
+            nbytes += self.image.nbytes
+        for level_image in self.pyramid.values():
+            nbytes += level_image.nbytes
+        return nbytes
+
+    def age_ms(self, now: Optional[float] = None) -> float:
+        now = now if now is not None else time.time()
+        return max(now - self.capture_ts, 0.0) * 1000
+
+
+class HistoryFrame:
+    def __init__(
+            self,
+            seq: int,
+            capture_ts: float,
+            receive_ts: float,
+            width: int,
+            height: int,
+            data: bytes,
+    ):
+        self.seq = seq
+        self.capture_ts = capture_ts
+        self.receive_ts = receive_ts
+        self.width = width
+        self.height = height
+        # 已压缩的JPEG字节
+        self.data = data
+
+
+class FrameHistory:
+    """
+    单个摄像头的定长环形缓冲区,按seq递增顺序保存压缩后的历史帧
+    """
+
+    def __init__(self, capacity: int):
+        self.frames: deque[HistoryFrame] = deque(maxlen=capacity)
+        self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def append(self, frame: HistoryFrame) -> None:
+        # 异步编码可能乱序完成, 按seq插入到正确位置
+        index = len(self.frames)
+        while index > 0 and self.frames[index - 1].seq > frame.seq:
+            index -= 1
+        if index > 0 and self.frames[index - 1].seq == frame.seq:
+            return
+        if len(self.frames) == self.frames.maxlen:
+            if index == 0:
+                return
+            self.pop_oldest()
+            index -= 1
+        self.frames.insert(index, frame)
+        self.nbytes += len(frame.data)
+
+    def pop_oldest(self) -> None:
+        if self.frames:
+            self.nbytes -= len(self.frames.popleft().data)
+
+    def latest(self, count: int) -> list[HistoryFrame]:
+        if count <= 0:
+            return []
+        return list(self.frames)[-count:]
+
+    def seq_range(self, from_seq: Optional[int] = None, to_seq: Optional[int] = None) -> list[HistoryFrame]:
+        return [
+            frame
+            for frame in self.frames
+            if (from_seq is None or frame.seq >= from_seq) and (to_seq is None or frame.seq <= to_seq)
+        ]
+
+    def nearest(self, timestamp: float, before: bool = False) -> Optional[HistoryFrame]:
+        """
+        返回采集时间最接近 timestamp 的帧; before=True 时只考虑不晚于 timestamp 的帧
+        """
+        candidates = [
+            frame for frame in self.frames
+            if not before or frame.capture_ts <= timestamp
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda frame: abs(frame.capture_ts - timestamp))
+
+
+class CameraStats:
     def __init__(self):
-        self.last_captured: dict[str, np.ndarray] = {}
+        # received: 收到的帧数; coalesced: 因有更新的帧而被直接丢弃的帧数; decoded: 实际解码的帧数;
+        # served: 编码后返回给客户端的次数
+        self.received = 0
+        self.coalesced = 0
+        self.decoded = 0
+        self.served = 0
 
-    def on_image(self, event: dict) -> None:
-        if event.get("type", None) != "INPUT":
+    def to_dict(self) -> dict[str, int]:
+        return {
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "decoded": self.decoded,
+            "served": self.served,
+        }
+
+
+class ImagesManager:
+    def __init__(
+            self,
+            encode_cache_size: int = 16,
+            source_jpeg_quality: int = 95,
+            passthrough_quality_slack: int = 10,
+            frame_ttl: Optional[float] = 10.0,
+            memory_budget: Optional[int] = 64 * 1024 * 1024,
+            history_size: int = 32,
+            history_interval: float = 0.2,
+            history_quality: int = 80,
+            history_max_length: Optional[int] = 320,
+            record_history: bool = True,
+            history_idle_timeout: Optional[float] = 30.0,
+            executor: Optional[Executor] = None,
+            max_inflight_per_camera: int = 2,
+            pyramid_levels: tuple[int, ...] = (320, 640),
+    ):
+        self.last_captured: dict[str, CapturedFrame] = {}
+        self._last_seq: dict[str, int] = {}
+        self.camera_stats: dict[str, CameraStats] = {}
+        # 每个摄像头预分配的BGR缓冲区,帧被替换且不再被使用后归还,跨帧复用以避免每帧分配新数组
+        self._frame_buffers: dict[str, list[np.ndarray]] = {}
+        # 解码/缩放/编码在 executor 中执行, 为None时在事件循环中同步执行
+        self.executor = executor
+        self.max_inflight_per_camera = max_inflight_per_camera
+        self._camera_semaphores: dict[str, asyncio.Semaphore] = {}
+        self._pending_encodes: dict[tuple, asyncio.Task] = {}
+        self._background_tasks: set[asyncio.Task] = set()
+        # 等待新帧的请求, 每个摄像头一个Event, 新帧到来时置位并丢弃
+        self._frame_arrivals: dict[str, asyncio.Event] = {}
+        # 每个 Event 上正在等待的请求数, 最后一个请求超时或取消时删除该 Event
+        self._frame_waiters: dict[asyncio.Event, int] = {}
+        # 每收到一帧都会以 (camera_id, frame) 调用, 用于推送
+        self.frame_listeners: list[Callable[[str, CapturedFrame], None]] = []
+        # 每次返回一帧的编码结果时以 (camera_id, frame) 调用; 每次解码/缩放/编码后以 (阶段名, 秒) 调用
+        self.serve_listeners: list[Callable[[str, CapturedFrame], None]] = []
+        self.stage_listeners: list[Callable[[str, float], None]] = []
+        # 返回True表示该摄像头有订阅者需要每一帧; 每加入一帧历史帧以 (camera_id, frame) 调用
+        self.frame_watchers: list[Callable[[str], bool]] = []
+        self.history_listeners: list[Callable[[str, "HistoryFrame"], None]] = []
+        # 读取帧之前以 camera_id (None 表示全部摄像头) 调用, 多worker模式下由此按需从共享内存同步最新帧
+        self.frame_source: Optional[Callable[[Optional[str]], None]] = None
+        # 编码结果缓存, 键为 (camera_id, seq, quality, max_length, format)
+        self._encode_cache: OrderedDict[tuple, bytes] = OrderedDict()
+        self._encode_cache_bytes = 0
+        self.encode_cache_size = encode_cache_size
+        # 帧在接收后超过 frame_ttl 秒即视为过期 (None 表示永不过期)
+        self.frame_ttl = frame_ttl
+        # 帧与编码缓存占用的总字节上限 (None 表示不限制)
+        self.memory_budget = memory_budget
+        # 元数据未给出压缩质量时假定的源质量 (OpenCV默认为95)
+        self.source_jpeg_quality = source_jpeg_quality
+        # 请求质量不低于 源质量 - slack 时直接透传原始字节
+        self.passthrough_quality_slack = passthrough_quality_slack
+        # 客户端常用的 max_length, 每帧最多缩放一次并缓存, 其他 max_length 从不小于它的最近一层缩放
+        self.pyramid_levels = tuple(sorted(pyramid_levels))
+        # 历史帧: 每个摄像头最多保存 history_size 帧, 相邻两帧至少间隔 history_interval 秒
+        self.histories: dict[str, FrameHistory] = {}
+        self.history_size = history_size
+        self.history_interval = history_interval
+        self.history_quality = history_quality
+        self.history_max_length = history_max_length
+        # 为False时不自行编码历史帧, 只保存 append_history 加入的帧 (多worker模式下由节点进程统一编码)
+        self.record_history = record_history
+        self._history_recorded_at: dict[str, float] = {}
+        # 超过 history_idle_timeout 秒没有读取历史帧时不再记录, 下次读取后重新开始; None 表示一直记录
+        self.history_idle_timeout = history_idle_timeout
+        self._history_read_at = float("-inf")
+        # 读取历史帧时以当前时间调用; 给出 history_read_source 时以它返回的时间为准 (多worker模式下读取发生在其他进程)
+        self.history_read_listeners: list[Callable[[float], None]] = []
+        self.history_read_source: Optional[Callable[[], float]] = None
+
+    def _is_expired(self, frame: CapturedFrame, now: float) -> bool:
+        return self.frame_ttl is not None and now - frame.receive_ts > self.frame_ttl
+
+    def _drop_camera(self, camera_id: str) -> None:
+        self.last_captured.pop(camera_id, None)
+        self._frame_buffers.pop(camera_id, None)
+
+    def _pop_encode_cache(self) -> None:
+        _, encoded = self._encode_cache.popitem(last=False)
+        self._encode_cache_bytes -= len(encoded)
+
+    def memory_usage(self) -> int:
+        frame_bytes = sum(frame.nbytes for frame in self.last_captured.values())
+        history_bytes = sum(history.nbytes for history in self.histories.values())
+        return frame_bytes + history_bytes + self._encode_cache_bytes
+
+    def evict(self) -> None:
+        """
+        清理过期帧,并在超出内存预算时依次淘汰: 编码缓存 -> 可重新解码的图像 -> 最旧的历史帧 -> 最旧的帧
+        """
+        now = time.time()
+        for camera_id, frame in list(self.last_captured.items()):
+            if self._is_expired(frame, now):
+                self._drop_camera(camera_id)
+
+        if self.memory_budget is None:
             return
 
-        np_image: Optional[np.ndarray]
+        while self._encode_cache and self.memory_usage() > self.memory_budget:
+            self._pop_encode_cache()
+
+        frames = sorted(self.last_captured.items(), key=lambda item: item[1].receive_ts)
+        for _, frame in frames:
+            if self.memory_usage() <= self.memory_budget:
+                return
+            frame.pyramid.clear()
+
+        for _, frame in frames:
+            if self.memory_usage() <= self.memory_budget:
+                return
+            # 压缩帧仍保留原始负载,丢弃解码结果后可再次解码
+            if frame.image is not None and frame.payload is not None:
+                frame.image = None
+
+        while self.memory_usage() > self.memory_budget:
+            histories = [history for history in self.histories.values() if len(history) > 0]
+            if not histories:
+                break
+            min(histories, key=lambda history: history.frames[0].receive_ts).pop_oldest()
+
+        for camera_id, _ in frames:
+            if self.memory_usage() <= self.memory_budget:
+                return
+            self._drop_camera(camera_id)
+
+    def get_stats(self, camera_id: str) -> CameraStats:
+        stats = self.camera_stats.get(camera_id, None)
+        if stats is None:
+            stats = CameraStats()
+            self.camera_stats[camera_id] = stats
+        return stats
+
+    def on_coalesced(self, camera_id: str, count: int = 1) -> None:
+        stats = self.get_stats(camera_id)
+        stats.received += count
+        stats.coalesced += count
+
+    def is_watched(self, camera_id: str) -> bool:
+        # 有请求在等待该摄像头的新帧或有订阅者
+        return camera_id in self._frame_arrivals or any(watcher(camera_id) for watcher in self.frame_watchers)
+
+    def get_frame(self, camera_id: str) -> Optional[CapturedFrame]:
+        if self.frame_source is not None:
+            self.frame_source(camera_id)
+        frame = self.last_captured.get(camera_id, None)
+        if frame is None:
+            return None
+        if self._is_expired(frame, time.time()):
+            self._drop_camera(camera_id)
+            return None
+        return frame
+
+    async def wait_for_frame(
+            self,
+            camera_id: str,
+            after_seq: int = 0,
+            timeout: Optional[float] = None,
+            after_ts: Optional[float] = None,
+    ) -> Optional[CapturedFrame]:
+        """
+        等待 seq 大于 after_seq 且采集时间晚于 after_ts 的帧, 超时返回 None
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            frame = self.get_frame(camera_id)
+            if frame is not None and frame.seq > after_seq and (after_ts is None or frame.capture_ts > after_ts):
+                return frame
+
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                return None
+            arrival = self._frame_arrivals.get(camera_id, None)
+            if arrival is None:
+                arrival = asyncio.Event()
+                self._frame_arrivals[camera_id] = arrival
+            self._frame_waiters[arrival] = self._frame_waiters.get(arrival, 0) + 1
+            try:
+                await asyncio.wait_for(arrival.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                self._release_frame_waiter(camera_id, arrival)
+
+    def _release_frame_waiter(self, camera_id: str, arrival: asyncio.Event) -> None:
+        waiters = self._frame_waiters.pop(arrival) - 1
+        if waiters > 0:
+            self._frame_waiters[arrival] = waiters
+        elif self._frame_arrivals.get(camera_id, None) is arrival:
+            # 没有请求在等待且没有新帧到来, 删除 Event, 使 is_watched 不再因此返回True
+            del self._frame_arrivals[camera_id]
+
+    def camera_ids(self) -> list[str]:
+        if self.frame_source is not None:
+            self.frame_source(None)
+        now = time.time()
+        return [
+            camera_id
+            for camera_id, frame in self.last_captured.items()
+            if not self._is_expired(frame, now)
+        ]
+
+    def _acquire_frame_buffer(self, camera_id: str, shape: tuple[int, ...]) -> np.ndarray:
+        buffers = self._frame_buffers.setdefault(camera_id, [])
+        while buffers:
+            buffer = buffers.pop()
+            if buffer.shape == shape:
+                return buffer
+        return np.empty(shape, dtype=np.uint8)
+
+    def _release_frame(self, camera_id: str, frame: Optional[CapturedFrame]) -> None:
+        """
+        旧帧不再是最新帧且没有任务在使用时, 把它的rgb8缓冲区归还给缓冲池
+        """
+        if frame is None or frame.pins > 0 or frame is self.last_captured.get(camera_id, None):
+            return
+        frame.pyramid.clear()
+        if frame.encoding != "rgb8" or frame.image is None:
+            return
+
+        buffers = self._frame_buffers.setdefault(camera_id, [])
+        if len(buffers) < self.max_inflight_per_camera:
+            buffers.append(frame.image)
+        frame.image = None
+
+    def on_image(self, event: dict, seq: Optional[int] = None, receive_ts: Optional[float] = None) -> None:
+        """
+        seq 与 receive_ts 由上游统一分配时传入 (多worker模式下各worker的帧序号与接收时间保持一致),
+        否则按接收顺序递增、取当前时间
+        """
+        if event.get("type", None) != "INPUT":
+            return
 
         metadata: Optional[dict] = event.get("metadata", None)
         if metadata is None:
             return
 
+        camera_id = event["id"]
+        self.get_stats(camera_id).received += 1
+        receive_ts = receive_ts if receive_ts is not None else time.time()
+        capture_ts = _metadata_timestamp(metadata)
         encoding: Optional[str] = metadata.get("encoding", None)
         im_width: Optional[int] = metadata.get("width", None)
         im_height: Optional[int] = metadata.get("height", None)
-        payload: Optional[pa.array] = event.get("value", None)
-        if encoding is None or payload is None:
-            self.last_failed_reason = f"Missing encoding or payload: {encoding}, {type(payload)}"
+        value: Optional[pa.array] = event.get("value", None)
+        if seq is None:
+            seq = self._last_seq.get(camera_id, 0) + 1
+
+        if encoding is None or value is None:
+            self.last_failed_reason = f"Missing encoding or payload: {encoding}, {type(value)}"
             return
-        elif encoding.lower() == "rgb8":
+
+        # 这里只保存原始负载的视图,解码推迟到有请求需要像素时
+        try:
+            payload = value.to_numpy(zero_copy_only=True)
+        except pa.ArrowInvalid:
+            payload = value.to_numpy(zero_copy_only=False)
+
+        if encoding.lower() == "rgb8":
             if im_width is None or im_height is None:
                 self.last_failed_reason = f"Missing im_width or im_height: {im_width}, {im_height}"
                 return
-            np_image = payload.to_numpy().reshape((im_height, im_width, 3))
-            np_image = cv2.cvtColor(np_image, cv2.COLOR_RGB2BGR)
-        elif encoding.lower() in ["jpeg", "jpg", "jpe", "bmp", "webp", "png"]:
-            # WARN: 此功能异常,无法解码图像
-            # raise NotImplementedError
-            try:
-                np_array = payload.to_numpy()
-                np_image = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
-                if np_image is None:
-                    raise Exception("Failed to decode image")
-            except Exception as e:
-                print(f"Failed to decode image: {e}")
-                return
+            frame = CapturedFrame(
+                seq=seq,
+                encoding="rgb8",
+                width=im_width,
+                height=im_height,
+                payload=payload,
+                capture_ts=capture_ts,
+                receive_ts=receive_ts,
+            )
+        elif encoding.lower() in COMPRESSED_ENCODINGS:
+            encoding = COMPRESSED_ENCODINGS[encoding.lower()]
+            if im_width is None or im_height is None:
+                size = _compressed_image_size(payload, encoding)
+                if size is not None:
+                    im_width, im_height = size
+            frame = CapturedFrame(
+                seq=seq,
+                encoding=encoding,
+                width=im_width,
+                height=im_height,
+                payload=payload,
+                source_quality=metadata.get("quality", None),
+                capture_ts=capture_ts,
+                receive_ts=receive_ts,
+            )
         else:
             print(f"Not Incompatible encoding type: {encoding}")
             return
 
-        if np_image is not None:
-            self.last_captured[event["id"]] = np_image
+        previous_frame = self.last_captured.get(camera_id, None)
+        self._last_seq[camera_id] = seq
+        self.last_captured[camera_id] = frame
+        self._release_frame(camera_id, previous_frame)
+        self._record_history(camera_id, frame)
+        self.evict()
+
+        arrival = self._frame_arrivals.pop(camera_id, None)
+        if arrival is not None:
+            arrival.set()
+        for listener in self.frame_listeners:
+            listener(camera_id, frame)
 
         return
 
+    def _decode_buffer(self, camera_id: str, frame: CapturedFrame) -> Optional[np.ndarray]:
+        # 进程池无法写入本进程的缓冲区
+        if frame.encoding != "rgb8" or isinstance(self.executor, ProcessPoolExecutor):
+            return None
+        return self._acquire_frame_buffer(camera_id, (frame.height, frame.width, 3))
+
+    @staticmethod
+    def _store_decoded(frame: CapturedFrame, np_image: np.ndarray) -> None:
+        frame.image = np_image
+        frame.height, frame.width = np_image.shape[:2]
+        if frame.encoding == "rgb8":
+            # 原始rgb8负载不会被透传,转换后即可释放Arrow缓冲区
+            frame.payload = None
+
+    def _decode(self, camera_id: str, frame: CapturedFrame) -> Optional[np.ndarray]:
+        if frame.image is not None:
+            return frame.image
+        if frame.payload is None:
+            return None
+
+        np_image = self._call(
+            _decode_payload,
+            frame.encoding, frame.payload, frame.width, frame.height, self._decode_buffer(camera_id, frame),
+        )
+        if np_image is None:
+            return None
+
+        self.get_stats(camera_id).decoded += 1
+        self._store_decoded(frame, np_image)
+        return np_image
+
+    def _call(self, func, *args):
+        if not self.stage_listeners:
+            return func(*args)
+        result, elapsed = _timed(func, *args)
+        self._observe_stage(func, elapsed)
+        return result
+
+    async def _run(self, func, *args):
+        if self.executor is None:
+            return self._call(func, *args)
+        if not self.stage_listeners:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        result, elapsed = await asyncio.get_running_loop().run_in_executor(self.executor, _timed, func, *args)
+        self._observe_stage(func, elapsed)
+        return result
+
+    def _observe_stage(self, func, elapsed: float) -> None:
+        stage = IMAGE_STAGES.get(func, func.__name__)
+        for listener in self.stage_listeners:
+            listener(stage, elapsed)
+
+    async def _decode_task(self, camera_id: str, frame: CapturedFrame) -> Optional[np.ndarray]:
+        frame.pins += 1
+        try:
+            np_image = await self._run(
+                _decode_payload,
+                frame.encoding, frame.payload, frame.width, frame.height, self._decode_buffer(camera_id, frame),
+            )
+            if np_image is not None:
+                self.get_stats(camera_id).decoded += 1
+                self._store_decoded(frame, np_image)
+            return np_image
+        finally:
+            frame.decoding = None
+            frame.pins -= 1
+            self._release_frame(camera_id, frame)
+
+    async def _decode_async(self, camera_id: str, frame: CapturedFrame) -> Optional[np.ndarray]:
+        if frame.image is not None:
+            return frame.image
+        if frame.payload is None:
+            return None
+
+        # 同一帧的并发请求共享一次解码
+        task = frame.decoding
+        if task is None:
+            task = asyncio.ensure_future(self._decode_task(camera_id, frame))
+            frame.decoding = task
+        return await asyncio.shield(task)
+
+    def _history(self, camera_id: str) -> FrameHistory:
+        history = self.histories.get(camera_id, None)
+        if history is None or history.frames.maxlen != self.history_size:
+            history = FrameHistory(self.history_size)
+            self.histories[camera_id] = history
+        return history
+
+    def mark_history_read(self) -> None:
+        now = time.time()
+        self._history_read_at = now
+        for listener in self.history_read_listeners:
+            listener(now)
+
+    def _history_wanted(self, now: float) -> bool:
+        if self.history_idle_timeout is None:
+            return True
+        read_at = self.history_read_source() if self.history_read_source is not None else self._history_read_at
+        return now - read_at <= self.history_idle_timeout
+
+    def _record_history(self, camera_id: str, frame: CapturedFrame) -> None:
+        if self.history_size <= 0 or not self.record_history:
+            return
+
+        if frame.receive_ts - self._history_recorded_at.get(camera_id, 0.0) < self.history_interval:
+            return
+        # 没有人读取历史帧时不解码、不编码, 保持按需解码
+        if not self._history_wanted(frame.receive_ts):
+            return
+        self._history_recorded_at[camera_id] = frame.receive_ts
+        history = self._history(camera_id)
+
+        if self.executor is None:
+            self._append_history(camera_id, history, frame, self._encode_history(camera_id, frame))
+            return
+
+        task = asyncio.get_running_loop().create_task(self._record_history_async(camera_id, history, frame))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def _history_length(self, frame: CapturedFrame) -> Optional[int]:
+        if self.history_max_length is None or max(frame.width, frame.height) <= self.history_max_length:
+            return None
+        return self.history_max_length
+
+    def _encode_history(self, camera_id: str, frame: CapturedFrame) -> Optional[bytes]:
+        # 历史帧不计入 served, 也不放入编码缓存, 不会挤掉客户端请求的编码结果
+        np_image = self._decode(camera_id, frame)
+        if np_image is None:
+            return None
+        max_length = self._history_length(frame)
+        level = self._pyramid_level(frame, max_length)
+        if level is not None:
+            np_image = self._pyramid(frame, level, np_image)
+        return self._call(_encode_array, np_image, self.history_quality, max_length, "jpeg")
+
+    async def _encode_history_async(self, camera_id: str, frame: CapturedFrame) -> Optional[bytes]:
+        frame.pins += 1
+        try:
+            async with self._camera_semaphore(camera_id):
+                np_image = await self._decode_async(camera_id, frame)
+                if np_image is None:
+                    return None
+                max_length = self._history_length(frame)
+                level = self._pyramid_level(frame, max_length)
+                if level is not None:
+                    np_image = await self._pyramid_async(frame, level, np_image)
+                return await self._run(_encode_array, np_image, self.history_quality, max_length, "jpeg")
+        finally:
+            frame.pins -= 1
+            self._release_frame(camera_id, frame)
+
+    async def _record_history_async(self, camera_id: str, history: FrameHistory, frame: CapturedFrame) -> None:
+        try:
+            encoded = await self._encode_history_async(camera_id, frame)
+        except Exception as e:
+            print(f"Failed to record history: {e}")
+            return
+        self._append_history(camera_id, history, frame, encoded)
+
+    def _append_history(
+            self, camera_id: str, history: FrameHistory, frame: CapturedFrame, encoded: Optional[bytes]
+    ) -> None:
+        if encoded is None:
+            return
+
+        width, height = frame.width, frame.height
+        if self.history_max_length is not None and max(width, height) > self.history_max_length:
+            width, height = _resized_size(width, height, self.history_max_length)
+
+        history_frame = HistoryFrame(
+            seq=frame.seq,
+            capture_ts=frame.capture_ts,
+            receive_ts=frame.receive_ts,
+            width=width,
+            height=height,
+            data=encoded,
+        )
+        history.append(history_frame)
+        for listener in self.history_listeners:
+            listener(camera_id, history_frame)
+
+    def append_history(self, camera_id: str, frame: HistoryFrame) -> None:
+        # 加入在其他地方编码好的历史帧 (多worker模式下由节点进程编码)
+        if self.history_size <= 0:
+            return
+        self._history(camera_id).append(frame)
+        self.evict()
+
+    def get_history(self, camera_id: str) -> Optional[FrameHistory]:
+        self.mark_history_read()
+        return self.histories.get(camera_id, None)
+
+    def snapshot(
+            self,
+            camera_ids: Optional[list[str]] = None,
+            tolerance_ms: float = 50.0,
+            after_ts: Optional[float] = None,
+            max_lengths: Optional[dict[str, Optional[int]]] = None,
+    ) -> tuple[dict[str, Union[CapturedFrame, HistoryFrame]], float, bool]:
+        """
+        以各摄像头的最新帧为基准, 选出采集时间最接近的一组帧.
+
+        历史帧只在采集时间距最新帧不超过一个 history_interval、晚于 after_ts,
+        且分辨率不低于请求的 max_lengths (缺省为原图) 时参与选择. 容差内有多组时取最新的一组,
+        都不在容差内时直接返回各摄像头的最新帧. 返回 (摄像头 -> 帧, 最大时间差毫秒, 是否在容差内),
+        没有最新帧的摄像头不出现在结果中.
+        """
+        self.mark_history_read()
+        camera_ids = camera_ids if camera_ids is not None else self.camera_ids()
+        live_frames: dict[str, CapturedFrame] = {}
+        for camera_id in camera_ids:
+            frame = self.get_frame(camera_id)
+            if frame is not None:
+                live_frames[camera_id] = frame
+        if not live_frames:
+            return {}, 0.0, True
+
+        earliest_ts = max(frame.capture_ts for frame in live_frames.values()) - self.history_interval
+        candidates: dict[str, list[Union[CapturedFrame, HistoryFrame]]] = {}
+        for camera_id, live_frame in live_frames.items():
+            options: list[Union[CapturedFrame, HistoryFrame]] = [live_frame]
+            history = self.histories.get(camera_id, None)
+            min_length = _history_min_length(live_frame, (max_lengths or {}).get(camera_id, None))
+            if history is not None and min_length is not None:
+                options.extend(
+                    frame for frame in history.frames
+                    if frame.seq < live_frame.seq
+                    and frame.capture_ts >= earliest_ts
+                    and (after_ts is None or frame.capture_ts > after_ts)
+                    and max(frame.width, frame.height) >= min_length
+                )
+            candidates[camera_id] = options
+
+        def skew(frames) -> float:
+            timestamps = [frame.capture_ts for frame in frames]
+            return (max(timestamps) - min(timestamps)) * 1000
+
+        best_ts = None
+        best_frames: dict[str, Union[CapturedFrame, HistoryFrame]] = {}
+        best_skew_ms = 0.0
+        for anchor_camera_id, anchor_options in candidates.items():
+            for anchor in anchor_options:
+                frames = {
+                    camera_id: anchor if camera_id == anchor_camera_id else min(
+                        options, key=lambda frame: abs(frame.capture_ts - anchor.capture_ts)
+                    )
+                    for camera_id, options in candidates.items()
+                }
+                skew_ms = skew(frames.values())
+                oldest_ts = min(frame.capture_ts for frame in frames.values())
+                if skew_ms <= tolerance_ms and (best_ts is None or oldest_ts > best_ts):
+                    best_ts, best_frames, best_skew_ms = oldest_ts, frames, skew_ms
+
+        if best_ts is None:
+            # 没有对齐的一组时不退回到更旧的帧
+            return dict(live_frames), skew(live_frames.values()), False
+        return best_frames, best_skew_ms, True
+
+    def pin_frame(self, frame: CapturedFrame) -> None:
+        """
+        在 await 之前持有帧, 防止其缓冲区在新帧到来时被回收
+        """
+        frame.pins += 1
+
+    def unpin_frame(self, camera_id: str, frame: CapturedFrame) -> None:
+        frame.pins -= 1
+        self._release_frame(camera_id, frame)
+
+    async def encode_history_frame_async(
+            self,
+            frame: HistoryFrame,
+            jpeg_quality: int = 90,
+            max_length: Optional[int] = None,
+    ) -> Optional[bytes]:
+        # 历史帧本身已压缩, 仅在需要进一步缩小时重新编码
+        if max_length is None or max(frame.width, frame.height) <= int(max_length):
+            return frame.data
+
+        np_image = await self._run(_decode_payload, "jpeg", np.frombuffer(frame.data, dtype=np.uint8), None, None)
+        if np_image is None:
+            return None
+        return await self._run(_encode_array, np_image, int(jpeg_quality), int(max_length), "jpeg")
+
+    def get_frame_image(self, camera_id: str) -> Optional[np.ndarray]:
+        frame = self.get_frame(camera_id)
+        if frame is None:
+            return None
+        return self._decode(camera_id, frame)
+
+    def _can_passthrough(self, frame: CapturedFrame, jpeg_quality: int, image_format: str) -> bool:
+        if frame.payload is None or frame.encoding != image_format:
+            return False
+        if image_format == "png":
+            return True
+        source_quality = frame.source_quality if frame.source_quality is not None else self.source_jpeg_quality
+        return jpeg_quality >= int(source_quality) - self.passthrough_quality_slack
+
+    def encode_image(
+            self,
+            camera_id: str,
+            jpeg_quality: int = 90,
+            max_length: Optional[int] = None,
+            image_format: str = "jpeg",
+            frame: Optional[CapturedFrame] = None,
+    ) -> Optional[bytes]:
+        if frame is None:
+            frame = self.get_frame(camera_id)
+        if frame is None:
+            return None
+
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format: {image_format}")
+
+        # 文件头中读不到尺寸时只能先解码
+        if frame.width is None or frame.height is None:
+            if self._decode(camera_id, frame) is None:
+                return None
+
+        cache_key, encoded = self._lookup_encoded(camera_id, frame, jpeg_quality, max_length, image_format)
+        if encoded is not None:
+            return encoded
+
+        np_image = self._decode(camera_id, frame)
+        if np_image is None:
+            return None
+
+        _, _, jpeg_quality, max_length, _ = cache_key
+        level = self._pyramid_level(frame, max_length)
+        if level is not None:
+            np_image = self._pyramid(frame, level, np_image)
+        encoded = self._call(_encode_array, np_image, jpeg_quality, max_length, image_format)
+        if encoded is None:
+            print(f"Failed to encode image: {camera_id}")
+            return None
+
+        self._store_encoded(cache_key, encoded)
+        return encoded
+
+    def _lookup_encoded(
+            self,
+            camera_id: str,
+            frame: CapturedFrame,
+            jpeg_quality: int,
+            max_length: Optional[int],
+            image_format: str,
+    ) -> tuple[tuple, Optional[bytes]]:
+        """
+        规范化编码参数并返回 (缓存键, 已缓存或可透传的字节)
+        """
+        jpeg_quality = int(jpeg_quality)
+        # 不需要缩放时统一为None,使缓存键一致
+        if max_length is not None and max(frame.width, frame.height) <= int(max_length):
+            max_length = None
+        max_length = int(max_length) if max_length is not None else None
+
+        cache_key = (camera_id, frame.seq, jpeg_quality, max_length, image_format)
+        encoded = self._encode_cache.get(cache_key, None)
+        if encoded is not None:
+            self._encode_cache.move_to_end(cache_key)
+            return cache_key, encoded
+
+        if max_length is None and self._can_passthrough(frame, jpeg_quality, image_format):
+            encoded = frame.payload.tobytes()
+            self._store_encoded(cache_key, encoded)
+        return cache_key, encoded
+
+    def _pyramid_level(self, frame: CapturedFrame, max_length: Optional[int]) -> Optional[int]:
+        """
+        返回用于缩放到 max_length 的缓存层: 不小于 max_length 的最小一层; 没有合适的层时返回 None (从原图缩放)
+        """
+        if max_length is None:
+            return None
+        for level in self.pyramid_levels:
+            if max_length <= level < max(frame.width, frame.height):
+                return level
+        return None
+
+    def _pyramid_parent(self, frame: CapturedFrame, level: int) -> Optional[int]:
+        # 每一层从相邻的更大一层缩放 (例如 1280 -> 640 -> 320, 每步缩小一半, 区域插值最快); 最大一层从原图缩放
+        for larger in self.pyramid_levels:
+            if level < larger < max(frame.width, frame.height):
+                return larger
+        return None
+
+    def _pyramid(self, frame: CapturedFrame, level: int, np_image: np.ndarray) -> np.ndarray:
+        level_image = frame.pyramid.get(level, None)
+        if level_image is None:
+            parent = self._pyramid_parent(frame, level)
+            source = self._pyramid(frame, parent, np_image) if parent is not None else np_image
+            level_image = self._call(_resize_long_side, source, level)
+            frame.pyramid[level] = level_image
+        return level_image
+
+    async def _pyramid_task(self, frame: CapturedFrame, level: int, np_image: np.ndarray) -> np.ndarray:
+        try:
+            parent = self._pyramid_parent(frame, level)
+            source = await self._pyramid_async(frame, parent, np_image) if parent is not None else np_image
+            level_image = await self._run(_resize_long_side, source, level)
+            frame.pyramid[level] = level_image
+            return level_image
+        finally:
+            frame.resizing.pop(level, None)
+
+    async def _pyramid_async(self, frame: CapturedFrame, level: int, np_image: np.ndarray) -> np.ndarray:
+        level_image = frame.pyramid.get(level, None)
+        if level_image is not None:
+            return level_image
+
+        # 同一帧同一层的并发请求共享一次缩放
+        task = frame.resizing.get(level, None)
+        if task is None:
+            task = asyncio.ensure_future(self._pyramid_task(frame, level, np_image))
+            frame.resizing[level] = task
+        return await asyncio.shield(task)
+
+    def _store_encoded(self, cache_key: tuple, encoded: bytes) -> None:
+        self._encode_cache[cache_key] = encoded
+        self._encode_cache_bytes += len(encoded)
+        while len(self._encode_cache) > self.encode_cache_size:
+            self._pop_encode_cache()
+
+    def _camera_semaphore(self, camera_id: str) -> asyncio.Semaphore:
+        semaphore = self._camera_semaphores.get(camera_id, None)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_inflight_per_camera)
+            self._camera_semaphores[camera_id] = semaphore
+        return semaphore
+
+    async def _encode_task(self, camera_id: str, frame: CapturedFrame, cache_key: tuple) -> Optional[bytes]:
+        _, _, jpeg_quality, max_length, image_format = cache_key
+        frame.pins += 1
+        try:
+            # 限制每个摄像头同时进行的任务数, 避免单个摄像头占满工作线程
+            async with self._camera_semaphore(camera_id):
+                np_image = await self._decode_async(camera_id, frame)
+                if np_image is None:
+                    return None
+                level = self._pyramid_level(frame, max_length)
+                if level is not None:
+                    np_image = await self._pyramid_async(frame, level, np_image)
+                encoded = await self._run(_encode_array, np_image, jpeg_quality, max_length, image_format)
+        finally:
+            frame.pins -= 1
+            self._release_frame(camera_id, frame)
+
+        if encoded is None:
+            print(f"Failed to encode image: {camera_id}")
+            return None
+        self._store_encoded(cache_key, encoded)
+        return encoded
+
+    async def encode_image_async(
+            self,
+            camera_id: str,
+            jpeg_quality: int = 90,
+            max_length: Optional[int] = None,
+            image_format: str = "jpeg",
+            frame: Optional[CapturedFrame] = None,
+    ) -> Optional[bytes]:
+        """
+        与 encode_image 相同, 但解码/缩放/编码在 executor 中执行, 事件循环只负责调度
+        """
+        if frame is None:
+            frame = self.get_frame(camera_id)
+        encoded = await self._encode_image_async(camera_id, jpeg_quality, max_length, image_format, frame)
+        if encoded is not None:
+            self.get_stats(camera_id).served += 1
+            for listener in self.serve_listeners:
+                listener(camera_id, frame)
+        return encoded
+
+    async def _encode_image_async(
+            self,
+            camera_id: str,
+            jpeg_quality: int,
+            max_length: Optional[int],
+            image_format: str,
+            frame: Optional[CapturedFrame],
+    ) -> Optional[bytes]:
+        if self.executor is None:
+            return self.encode_image(camera_id, jpeg_quality, max_length, image_format, frame)
+
+        if frame is None:
+            return None
+
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format: {image_format}")
+
+        frame.pins += 1
+        try:
+            if frame.width is None or frame.height is None:
+                if await self._decode_async(camera_id, frame) is None:
+                    return None
+
+            cache_key, encoded = self._lookup_encoded(camera_id, frame, jpeg_quality, max_length, image_format)
+            if encoded is not None:
+                return encoded
+
+            # 相同参数的并发请求共享同一个编码任务
+            task = self._pending_encodes.get(cache_key, None)
+            if task is None:
+                task = asyncio.ensure_future(self._encode_task(camera_id, frame, cache_key))
+                self._pending_encodes[cache_key] = task
+                task.add_done_callback(lambda _: self._pending_encodes.pop(cache_key, None))
+            return await asyncio.shield(task)
+        finally:
+            frame.pins -= 1
+            self._release_frame(camera_id, frame)
+
     async def get_image(
             self,
             camera_id: str,
             jpeg_quality: str = 90,
             max_length: Optional[str] = None,
             base64_encoding: str = "utf-8",
+            frame: Optional[CapturedFrame] = None,
     ) -> Optional[str]:
-        np_image = self.last_captured.get(camera_id, None)
+        encoded = await self.encode_image_async(
+            camera_id, jpeg_quality=jpeg_quality, max_length=max_length, frame=frame
+        )
 
-        if np_image is None:
+        if encoded is None:
             return None
 
-        if max_length is not None and max(np_image.shape) > int(max_length):
-            max_length = int(max_length)
-            if np_image.shape[0] > np_image.shape[1]:
-                np_image = cv2.resize(np_image,
-                                      (max_length, int(np_image.shape[0] * max_length / np_image.shape[1])))
-            else:
-                np_image = cv2.resize(np_image,
-                                      (int(np_image.shape[1] * max_length / np_image.shape[0]), max_length))
-
-        _, buffer = cv2.imencode(".jpeg", np_image, [int(cv2.IMWRITE_JPEG_QUALITY), int(jpeg_quality)])
-
         try:
-            return base64.b64encode(buffer).decode(base64_encoding)
+            return base64.b64encode(encoded).decode(base64_encoding)
         except Exception as e:
             print(f"Failed to encode image: {e}")
             return None
 
 
 class DoraNodeListener:
+    """
+    dora Node 的唯一持有者.
+
+    Node.next 与 Node.send_output 不能在不同线程上并发调用, 阻塞在 Node.next 中时也无法被唤醒,
+    因此由一个专用线程用不阻塞的 Node.try_recv 取出全部事件, 之后在自己的 threading.Event 上等待.
+    输出在接收线程没有使用 Node 时由事件循环直接发送, 否则排队并立即唤醒接收线程发送;
+    没有事件时接收线程每隔 receive_timeout 再检查一次.
+    事件交给事件循环按批处理, 每批只保留每个摄像头的最新一帧.
+    """
+
     def __init__(
             self,
             image_bucket: ImagesManager,
             dora_node: Node = None,
-            node_lock: asyncio.Lock = asyncio.Lock(),
+            event_queue_size: int = 8,
+            receive_timeout: float = 0.001,
     ):
         self.image_bucket: ImagesManager = image_bucket
         self.node = dora_node if dora_node is not None else Node(node_id="restapi")
-        self.node_lock = node_lock
+
+        # 没有事件时两次检查之间的最长间隔, 也是空闲时新事件的最大延迟; 输出不受影响, 排队后立即发送
+        self.receive_timeout = receive_timeout
+        self.event_queue_size = event_queue_size
+        self._pending_events: list[dict] = []
+        self._events_ready: Optional[asyncio.Event] = None
+        self._outputs: queue.SimpleQueue = queue.SimpleQueue()
+        self._wakeup = threading.Event()
+        # 接收线程调用 Node 期间持有
+        self._node_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
 
         self.is_listening: bool = False
         self.task: Optional[asyncio.Task] = None
+        # 待处理事件超过 event_queue_size 时被丢弃的非图像事件数
+        self.dropped_events: int = 0
 
         self.debug_info = ""
 
@@ -113,11 +1196,110 @@ class DoraNodeListener:
         else:
             print(f"Not Incompatible event type: {event_id}")
 
+    async def send_output(self, output_id: str, data: pa.Array, metadata: Optional[dict] = None) -> None:
+        """
+        交给接收线程发送, 在实际调用 Node.send_output 后返回
+        """
+        if not self.is_listening:
+            # 接收线程未运行时直接发送
+            self._send(output_id, data, metadata)
+            return
+
+        if self._node_lock.acquire(blocking=False):
+            try:
+                # 没有排队的输出时直接发送, 不改变输出的顺序
+                if self._outputs.empty():
+                    self._send(output_id, data, metadata)
+                    return
+            finally:
+                self._node_lock.release()
+
+        future = self._loop.create_future()
+        self._outputs.put((output_id, data, metadata, future))
+        self._wakeup.set()
+        await future
+
+    def _send(self, output_id: str, data: pa.Array, metadata: Optional[dict]) -> None:
+        if metadata is None:
+            self.node.send_output(output_id, data)
+        else:
+            self.node.send_output(output_id, data, metadata)
+
+    def _flush_outputs(self) -> None:
+        while True:
+            try:
+                output_id, data, metadata, future = self._outputs.get_nowait()
+            except queue.Empty:
+                return
+
+            try:
+                self._send(output_id, data, metadata)
+            except Exception as e:
+                self._loop.call_soon_threadsafe(_resolve_future, future, e)
+            else:
+                self._loop.call_soon_threadsafe(_resolve_future, future, None)
+
+    @staticmethod
+    def _is_image_event(event: dict) -> bool:
+        return event.get("type", None) == "INPUT" and "image" in (event.get("id", None) or "")
+
+    def _put_event(self, event: dict) -> None:
+        self._pending_events.append(event)
+        if len(self._pending_events) > self.event_queue_size:
+            # 积压过多时丢弃最旧的事件,保证处理的总是较新的帧
+            dropped = self._pending_events.pop(0)
+            if self._is_image_event(dropped):
+                self.image_bucket.on_coalesced(dropped["id"])
+            else:
+                self.dropped_events += 1
+        self._events_ready.set()
+
+    def _coalesce(self, events: list[dict]) -> list[dict]:
+        """
+        每个摄像头只保留最新一帧, 其余事件保持原有顺序
+        """
+        latest_index: dict[str, int] = {}
+        for index, event in enumerate(events):
+            if self._is_image_event(event):
+                latest_index[event["id"]] = index
+
+        batch = []
+        for index, event in enumerate(events):
+            if self._is_image_event(event) and latest_index[event["id"]] != index:
+                self.image_bucket.on_coalesced(event["id"])
+                continue
+            batch.append(event)
+        return batch
+
+    def _receive_loop(self) -> None:
+        while self.is_listening:
+            try:
+                with self._node_lock:
+                    self._flush_outputs()
+                    event = self.node.try_recv()
+                if event is None:
+                    # 没有事件时等待, 有输出排队时 send_output 立即唤醒
+                    self._wakeup.wait(self.receive_timeout)
+                    self._wakeup.clear()
+                    continue
+                self._loop.call_soon_threadsafe(self._put_event, event)
+            except Exception as e:
+                print(f"Error in receiving: {e}")
+                time.sleep(1)
+
+        with self._node_lock:
+            self._flush_outputs()
+
     async def start_listening(self):
         if self.is_listening:
             return
 
+        self._loop = asyncio.get_running_loop()
+        self._pending_events = []
+        self._events_ready = asyncio.Event()
         self.is_listening = True
+        self._thread = threading.Thread(target=self._receive_loop, name="dora-receiver", daemon=True)
+        self._thread.start()
         self.task = asyncio.create_task(self._listen())
 
     async def stop_listening(self):
@@ -125,41 +1307,35 @@ class DoraNodeListener:
             return
 
         self.is_listening = False
+        self._wakeup.set()
+        if self._thread:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
         if self.task:
-            await self.task
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
             self.task = None
 
     async def _listen(self):
         while self.is_listening:
-            try:
-                # async for event in self._async_iter(self.node):
-                #     if not self.is_listening:
-                #         break
-                #
-                #     if event is None:
-                #         continue
-                #
-                #     await self._parse_once(event)
-                # print(type(self.node))
-                async with self.node_lock:
-                    event = await asyncio.to_thread(self.node.next, timeout=0.001)
-
-                if not self.is_listening:
-                    break
+            await self._events_ready.wait()
+            self._events_ready.clear()
+            events, self._pending_events = self._pending_events, []
 
-                if event is None:
-                    await asyncio.sleep(0)
-                    continue
+            for event in self._coalesce(events):
+                try:
+                    await self._parse_once(event)
+                except Exception as e:
+                    print(f"Error in listening: {e}")
 
-                await self._parse_once(event)
 
-                await asyncio.sleep(0)
-            except Exception as e:
-                print(f"Error in listening: {e}")
-                await asyncio.sleep(1)
-
-    # @staticmethod
-    # async def _async_iter(iterable):
-    #     for item in iterable:
-    #         yield item
-    #         await asyncio.sleep(0)  # 让出控制权，使其成为真正的异步迭代器
+def _resolve_future(future: asyncio.Future, error: Optional[Exception]) -> None:
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
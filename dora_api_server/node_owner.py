@@ -0,0 +1,631 @@
+import asyncio
+import math
+import multiprocessing
+import os
+import socket
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+import pyarrow as pa
+
+from dora_api_server.control import AckBroadcaster, ack_address, control_address, create_control, serve_control
+from dora_api_server.node_listener import DoraNodeListener, HistoryFrame, ImagesManager, _metadata_timestamp
+
+# 目录: generation, max_cameras, slot_bytes, dropped_frames, created_ms, 之后每个摄像头名占 NAME_SIZE 字节,
+# 最后是 MAX_LISTENERS 个等待唤醒的worker进程号
+DIRECTORY_FORMAT = "<QIIQQ"
+# 目录头中紧随其后: 各worker最近一次读取历史帧的时间
+HISTORY_READ_OFFSET = struct.calcsize(DIRECTORY_FORMAT)
+DIRECTORY_HEADER_SIZE = 64
+NAME_SIZE = 64
+MAX_LISTENERS = 64
+
+# 帧槽: 8字节计数, 之后依次为 seq, capture_ts, receive_ts, width, height, quality, length, encoding 与负载
+SLOT_FORMAT = "<QQddIIIQ16s"
+SLOT_HEADER_SIZE = 128
+# 等待帧槽锁的最长时间 (秒)
+LOCK_TIMEOUT = 0.5
+
+
+def _unlink_stale(name: str) -> None:
+    # 上次异常退出时残留的共享内存
+    try:
+        stale = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    stale.close()
+    stale.unlink()
+
+
+def _wake_address(prefix: str, pid: int) -> str:
+    # Linux 抽象命名空间的 Unix 套接字, 进程退出后自动释放
+    return f"\0{prefix}_wake_{pid}"
+
+
+class FrameSlot:
+    """
+    一个摄像头的共享内存帧槽, 节点进程写入、各worker读取.
+
+    读写都持有该摄像头的进程间锁: 锁 (POSIX信号量) 的获取与释放带有内存屏障,
+    在 ARM 等弱内存序的CPU上读取方也不会看到写了一半的帧. 计数每写入一帧加一, 读取方据此判断是否有新帧.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, lock):
+        self.shm = shm
+        self.lock = lock
+        self.capacity = shm.size - SLOT_HEADER_SIZE
+        self._data = np.ndarray((self.capacity,), dtype=np.uint8, buffer=shm.buf, offset=SLOT_HEADER_SIZE)
+
+    def _counter(self) -> int:
+        return struct.unpack_from("<Q", self.shm.buf, 0)[0]
+
+    def write(
+            self,
+            seq: int,
+            metadata: dict,
+            payload: np.ndarray,
+            capture_ts: Optional[float],
+            receive_ts: float,
+    ) -> bool:
+        payload = np.ascontiguousarray(payload).view(np.uint8).reshape(-1)
+        if payload.size > self.capacity:
+            return False
+
+        # 持锁的worker被强制结束时锁不会释放, 等待超时后丢弃这一帧而不是让节点进程一直阻塞
+        if not self.lock.acquire(timeout=LOCK_TIMEOUT):
+            return False
+        try:
+            struct.pack_into(
+                SLOT_FORMAT, self.shm.buf, 0,
+                self._counter() + 1,
+                seq,
+                capture_ts if capture_ts is not None else math.nan,
+                receive_ts,
+                metadata.get("width", None) or 0,
+                metadata.get("height", None) or 0,
+                metadata.get("quality", None) or 0,
+                payload.size,
+                str(metadata.get("encoding", "")).encode("ascii", errors="ignore")[:16],
+            )
+            self._data[:payload.size] = payload
+        finally:
+            self.lock.release()
+        return True
+
+    def read(self, last_counter: int) -> Optional[tuple[int, int, dict, float, np.ndarray]]:
+        """
+        返回 (计数, seq, 元数据, receive_ts, 负载副本); 计数与 last_counter 相同 (没有新帧) 时返回None
+        """
+        if not self.lock.acquire(timeout=LOCK_TIMEOUT):
+            return None
+        try:
+            counter, seq, capture_ts, receive_ts, width, height, quality, length, encoding = struct.unpack_from(
+                SLOT_FORMAT, self.shm.buf, 0
+            )
+            if counter == last_counter or length > self.capacity:
+                return None
+            payload = self._data[:length].copy()
+        finally:
+            self.lock.release()
+
+        metadata = {
+            "encoding": encoding.rstrip(b"\0").decode("ascii"),
+            "width": width or None,
+            "height": height or None,
+            "quality": quality or None,
+            "timestamp": None if math.isnan(capture_ts) else capture_ts,
+        }
+        return counter, seq, metadata, receive_ts, payload
+
+    def close(self) -> None:
+        # numpy视图引用着缓冲区, 必须先释放才能关闭
+        self._data = None
+        self.shm.close()
+
+
+class SharedFrameBus:
+    """
+    节点进程写入、各worker读取的共享内存帧总线.
+
+    主进程在启动worker前创建目录与全部帧槽并在退出时删除; 每个摄像头有一个最新帧槽与一个历史帧槽,
+    节点进程按摄像头首次出现的顺序分配, worker发现目录的 generation 变化后再读取新的摄像头名.
+    locks[0] 保护目录, locks[1 + i] 保护第 i 个摄像头的两个帧槽.
+    """
+
+    def __init__(
+            self,
+            prefix: str,
+            directory: shared_memory.SharedMemory,
+            slots: list[FrameSlot],
+            history_slots: list[FrameSlot],
+            lock,
+    ):
+        self.prefix = prefix
+        self.directory = directory
+        self.slots = slots
+        self.history_slots = history_slots
+        self.lock = lock
+        self.camera_slots: dict[str, tuple[FrameSlot, FrameSlot]] = {}
+        self._generation = -1
+        self._seq: dict[str, int] = {}
+        self._wake_socket: Optional[socket.socket] = None
+
+    @staticmethod
+    def _slot_name(prefix: str, index: int) -> str:
+        return f"{prefix}_{index}"
+
+    @staticmethod
+    def _history_slot_name(prefix: str, index: int) -> str:
+        return f"{prefix}_h{index}"
+
+    @classmethod
+    def create(
+            cls,
+            prefix: str,
+            locks: tuple,
+            slot_bytes: int = 8 * 1024 * 1024,
+            history_bytes: int = 1024 * 1024,
+    ) -> "SharedFrameBus":
+        max_cameras = len(locks) - 1
+        _unlink_stale(f"{prefix}_dir")
+        directory = shared_memory.SharedMemory(
+            name=f"{prefix}_dir", create=True,
+            size=DIRECTORY_HEADER_SIZE + max_cameras * NAME_SIZE + MAX_LISTENERS * 4,
+        )
+        struct.pack_into(DIRECTORY_FORMAT, directory.buf, 0, 0, max_cameras, slot_bytes, 0, time.time_ns() // 1000000)
+
+        slots, history_slots = [], []
+        for index in range(max_cameras):
+            # tmpfs 按需分配页面, 未写入的部分不占用内存
+            for name, size, target in (
+                    (cls._slot_name(prefix, index), slot_bytes, slots),
+                    (cls._history_slot_name(prefix, index), history_bytes, history_slots),
+            ):
+                _unlink_stale(name)
+                shm = shared_memory.SharedMemory(name=name, create=True, size=SLOT_HEADER_SIZE + size)
+                target.append(FrameSlot(shm, locks[1 + index]))
+        return cls(prefix, directory, slots, history_slots, locks[0])
+
+    @classmethod
+    def attach(cls, prefix: str, locks: tuple) -> "SharedFrameBus":
+        directory = shared_memory.SharedMemory(name=f"{prefix}_dir")
+        max_cameras = struct.unpack_from(DIRECTORY_FORMAT, directory.buf, 0)[1]
+        slots = [
+            FrameSlot(shared_memory.SharedMemory(name=cls._slot_name(prefix, index)), locks[1 + index])
+            for index in range(max_cameras)
+        ]
+        history_slots = [
+            FrameSlot(shared_memory.SharedMemory(name=cls._history_slot_name(prefix, index)), locks[1 + index])
+            for index in range(max_cameras)
+        ]
+        return cls(prefix, directory, slots, history_slots, locks[0])
+
+    def _header(self) -> tuple[int, int, int, int, int]:
+        return struct.unpack_from(DIRECTORY_FORMAT, self.directory.buf, 0)
+
+    @property
+    def created_ms(self) -> int:
+        return self._header()[4]
+
+    @property
+    def dropped_frames(self) -> int:
+        with self.lock:
+            return self._header()[3]
+
+    def mark_history_read(self, read_at: float) -> None:
+        # 读取方: 节点进程据此判断是否还需要记录历史帧
+        with self.lock:
+            struct.pack_into("<d", self.directory.buf, HISTORY_READ_OFFSET, read_at)
+
+    def history_read_at(self) -> float:
+        with self.lock:
+            return struct.unpack_from("<d", self.directory.buf, HISTORY_READ_OFFSET)[0]
+
+    def _camera_name(self, index: int) -> str:
+        offset = DIRECTORY_HEADER_SIZE + index * NAME_SIZE
+        return bytes(self.directory.buf[offset:offset + NAME_SIZE]).rstrip(b"\0").decode("utf-8")
+
+    def refresh(self) -> None:
+        # 读取方: 目录有新摄像头时更新映射
+        with self.lock:
+            generation = self._header()[0]
+            if generation == self._generation:
+                return
+            self._generation = generation
+            names = [self._camera_name(index) for index in range(len(self.slots))]
+        for index, name in enumerate(names):
+            if name:
+                self.camera_slots[name] = (self.slots[index], self.history_slots[index])
+
+    def _assign_slot(self, camera_id: str) -> Optional[tuple[FrameSlot, FrameSlot]]:
+        # 写入方: 摄像头名与 generation 在目录锁内一起更新
+        if camera_id in self.camera_slots:
+            return self.camera_slots[camera_id]
+        index = len(self.camera_slots)
+        name = camera_id.encode("utf-8")
+        if index >= len(self.slots) or len(name) > NAME_SIZE:
+            return None
+
+        offset = DIRECTORY_HEADER_SIZE + index * NAME_SIZE
+        with self.lock:
+            self.directory.buf[offset:offset + len(name)] = name
+            struct.pack_into("<Q", self.directory.buf, 0, self._header()[0] + 1)
+        self.camera_slots[camera_id] = (self.slots[index], self.history_slots[index])
+        return self.camera_slots[camera_id]
+
+    def _count_dropped(self) -> None:
+        with self.lock:
+            generation, max_cameras, slot_bytes, dropped_frames, created_ms = self._header()
+            struct.pack_into(
+                DIRECTORY_FORMAT, self.directory.buf, 0,
+                generation, max_cameras, slot_bytes, dropped_frames + 1, created_ms,
+            )
+
+    def publish(self, event: dict, receive_ts: float) -> Optional[int]:
+        """
+        写入一帧并返回分配的 seq, 没有写入时返回None
+        """
+        metadata: Optional[dict] = event.get("metadata", None)
+        value: Optional[pa.Array] = event.get("value", None)
+        if metadata is None or value is None:
+            return None
+
+        camera_id = event["id"]
+        slots = self._assign_slot(camera_id)
+        if slots is None:
+            self._count_dropped()
+            return None
+
+        try:
+            payload = value.to_numpy(zero_copy_only=True)
+        except pa.ArrowInvalid:
+            payload = value.to_numpy(zero_copy_only=False)
+
+        seq = self._seq.get(camera_id, 0) + 1
+        if not slots[0].write(seq, metadata, payload, _metadata_timestamp(metadata), receive_ts):
+            # 超出帧槽容量, 需要调大 FRAME_SLOT_BYTES
+            self._count_dropped()
+            return None
+        self._seq[camera_id] = seq
+        return seq
+
+    def publish_history(self, camera_id: str, frame: HistoryFrame) -> bool:
+        slots = self._assign_slot(camera_id)
+        if slots is None:
+            return False
+        return slots[1].write(
+            frame.seq,
+            {"encoding": "jpeg", "width": frame.width, "height": frame.height},
+            np.frombuffer(frame.data, dtype=np.uint8),
+            frame.capture_ts,
+            frame.receive_ts,
+        )
+
+    def _listener_offset(self, index: int) -> int:
+        return DIRECTORY_HEADER_SIZE + len(self.slots) * NAME_SIZE + index * 4
+
+    def add_listener(self, pid: int) -> bool:
+        with self.lock:
+            for index in range(MAX_LISTENERS):
+                if struct.unpack_from("<I", self.directory.buf, self._listener_offset(index))[0] == 0:
+                    struct.pack_into("<I", self.directory.buf, self._listener_offset(index), pid)
+                    return True
+        return False
+
+    def remove_listener(self, pid: int) -> None:
+        with self.lock:
+            for index in range(MAX_LISTENERS):
+                if struct.unpack_from("<I", self.directory.buf, self._listener_offset(index))[0] == pid:
+                    struct.pack_into("<I", self.directory.buf, self._listener_offset(index), 0)
+
+    def notify(self) -> None:
+        """
+        写入方: 向每个登记的worker发送一个数据报, 唤醒其事件循环
+        """
+        if self._wake_socket is None:
+            self._wake_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._wake_socket.setblocking(False)
+        with self.lock:
+            pids = [
+                pid for index in range(MAX_LISTENERS)
+                if (pid := struct.unpack_from("<I", self.directory.buf, self._listener_offset(index))[0])
+            ]
+        for pid in pids:
+            try:
+                self._wake_socket.sendto(b"\0", _wake_address(self.prefix, pid))
+            except BlockingIOError:
+                # 接收队列已满, worker 还没处理的唤醒已经足够
+                pass
+            except OSError:
+                # worker 已退出
+                self.remove_listener(pid)
+
+    def close(self) -> None:
+        if self._wake_socket is not None:
+            self._wake_socket.close()
+            self._wake_socket = None
+        for slot in self.slots + self.history_slots:
+            slot.close()
+        self.directory.close()
+
+    def unlink(self) -> None:
+        for slot in self.slots + self.history_slots:
+            slot.shm.unlink()
+        self.directory.unlink()
+
+
+class OwnerNodeListener(DoraNodeListener):
+    """
+    节点进程中的 DoraNodeListener: 图像写入共享内存帧总线后唤醒各worker,
+    历史帧只在这里编码一次, 再经由历史帧槽分发给各worker.
+    """
+
+    def __init__(self, image_bucket: ImagesManager, bus: SharedFrameBus, **kwargs):
+        super().__init__(image_bucket, **kwargs)
+        self.bus = bus
+        image_bucket.history_listeners.append(self._publish_history)
+        image_bucket.history_read_source = bus.history_read_at
+
+    async def _parse_once(self, event: dict):
+        if event.get("type", None) != "INPUT":
+            return
+
+        event_id: Optional[str] = event.get("id", None)
+        if "image" not in event_id:
+            print(f"Not Incompatible event type: {event_id}")
+            return
+
+        receive_ts = time.time()
+        seq = self.bus.publish(event, receive_ts)
+        if seq is None:
+            return
+        self.bus.notify()
+        # 只用于按 history_interval 编码历史帧
+        self.image_bucket.on_image(event, seq=seq, receive_ts=receive_ts)
+
+    def _publish_history(self, camera_id: str, frame: HistoryFrame) -> None:
+        if self.bus.publish_history(camera_id, frame):
+            self.bus.notify()
+
+
+async def _run_node_owner(
+        prefix: str,
+        locks: tuple,
+        ready,
+        stop_event,
+        receive_timeout: float,
+        history_size: int,
+        history_interval: float,
+        history_idle_timeout: Optional[float],
+) -> None:
+    bus = SharedFrameBus.attach(prefix, locks)
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-encoder")
+    image_bucket = ImagesManager(
+        history_size=history_size,
+        history_interval=history_interval,
+        history_idle_timeout=history_idle_timeout,
+        executor=executor,
+    )
+    listener = OwnerNodeListener(image_bucket, bus, receive_timeout=receive_timeout)
+    # 指令队列、限速、机械臂工作空间、底盘速度指令与指令序列只在这里保存一份
+    control = create_control(listener)
+    serve_control(control, control_address(prefix), asyncio.get_running_loop())
+    acks = AckBroadcaster(ack_address(prefix))
+    await acks.start()
+    control.ack_listeners.append(acks.publish)
+    await listener.start_listening()
+    ready.set()
+    try:
+        await asyncio.to_thread(stop_event.wait)
+    finally:
+        await control.close()
+        await acks.close()
+        await listener.stop_listening()
+        executor.shutdown(wait=False, cancel_futures=True)
+        bus.close()
+
+
+def run_node_owner(
+        prefix: str,
+        locks: tuple,
+        ready,
+        stop_event,
+        receive_timeout: float = 0.001,
+        history_size: int = 32,
+        history_interval: float = 0.2,
+        history_idle_timeout: Optional[float] = 30.0,
+) -> None:
+    """
+    节点进程入口: 唯一持有 dora Node 与控制状态, 把图像写入共享内存, 并执行各worker转发的指令
+    """
+    asyncio.run(_run_node_owner(
+        prefix, locks, ready, stop_event, receive_timeout, history_size, history_interval, history_idle_timeout
+    ))
+
+
+class NodeOwner:
+    """
+    在主进程中创建帧总线, 并启动持有 dora Node 与控制状态的子进程.
+
+    必须在启动 Sanic worker 之前调用 start; worker 通过 locks 附加同名的帧总线,
+    通过 control_address(prefix) 上的控制服务提交指令.
+    """
+
+    def __init__(
+            self,
+            prefix: str,
+            max_cameras: int = 4,
+            slot_bytes: int = 8 * 1024 * 1024,
+            history_bytes: int = 1024 * 1024,
+            receive_timeout: float = 0.001,
+            history_size: int = 32,
+            history_interval: float = 0.2,
+            history_idle_timeout: Optional[float] = 30.0,
+    ):
+        self.prefix = prefix
+        self.slot_bytes = slot_bytes
+        self.history_bytes = history_bytes
+        self.receive_timeout = receive_timeout
+        self.history_size = history_size
+        self.history_interval = history_interval
+        self.history_idle_timeout = history_idle_timeout
+
+        context = multiprocessing.get_context("spawn")
+        self.locks = tuple(context.Lock() for _ in range(max_cameras + 1))
+        self._ready = context.Event()
+        self._stop_event = context.Event()
+        self._context = context
+        self.bus: Optional[SharedFrameBus] = None
+        self.process: Optional[multiprocessing.Process] = None
+
+    def start(self, timeout: float = 30.0) -> None:
+        self.bus = SharedFrameBus.create(
+            self.prefix, self.locks, slot_bytes=self.slot_bytes, history_bytes=self.history_bytes
+        )
+        self.process = self._context.Process(
+            target=run_node_owner,
+            args=(
+                self.prefix, self.locks, self._ready, self._stop_event,
+                self.receive_timeout, self.history_size, self.history_interval, self.history_idle_timeout,
+            ),
+            name="dora-node-owner",
+            daemon=True,
+        )
+        self.process.start()
+        # 控制服务就绪后才启动worker, 避免worker的第一条指令连接失败
+        if not self._ready.wait(timeout):
+            self.stop()
+            raise RuntimeError("dora node owner failed to start")
+
+    def stop(self, timeout: float = 2.0) -> None:
+        self._stop_event.set()
+        if self.process is not None:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        if self.bus is not None:
+            self.bus.close()
+            self.bus.unlink()
+            self.bus = None
+
+
+class SharedNodeListener:
+    """
+    多worker模式下替代 DoraNodeListener: 从共享内存帧总线读取节点进程发布的帧与历史帧.
+
+    节点进程每写入一帧就通过 Unix 数据报套接字唤醒各worker; 此时只复制有请求在等待或有订阅者的摄像头,
+    其余摄像头在读取时 (ImagesManager.frame_source) 才复制最新一帧, 没有请求的帧不会被复制.
+    帧序号与接收时间沿用节点进程分配的值, 没有复制就被覆盖的帧计入 coalesced.
+    """
+
+    def __init__(self, image_bucket: ImagesManager, prefix: str, locks: tuple):
+        self.image_bucket: ImagesManager = image_bucket
+        self.prefix = prefix
+        self.bus: SharedFrameBus = SharedFrameBus.attach(prefix, locks)
+        self._last_counter: dict[str, int] = {}
+        self._last_history_counter: dict[str, int] = {}
+        self._last_seq: dict[str, int] = {}
+        self._socket: Optional[socket.socket] = None
+
+        self.is_listening: bool = False
+
+    @property
+    def dropped_events(self) -> int:
+        # 节点进程因帧槽不足或帧过大而丢弃的帧数
+        return self.bus.dropped_frames
+
+    def _read_frame(self, camera_id: str, slot: FrameSlot) -> None:
+        result = slot.read(self._last_counter.get(camera_id, 0))
+        if result is None:
+            return
+
+        counter, seq, metadata, receive_ts, payload = result
+        self._last_counter[camera_id] = counter
+        skipped = seq - self._last_seq.get(camera_id, seq - 1) - 1
+        if skipped > 0:
+            self.image_bucket.on_coalesced(camera_id, skipped)
+        self._last_seq[camera_id] = seq
+        self.image_bucket.on_image(
+            {"type": "INPUT", "id": camera_id, "value": pa.array(payload), "metadata": metadata},
+            seq=seq,
+            receive_ts=receive_ts,
+        )
+
+    def _read_history(self, camera_id: str, slot: FrameSlot) -> None:
+        result = slot.read(self._last_history_counter.get(camera_id, 0))
+        if result is None:
+            return
+
+        counter, seq, metadata, receive_ts, payload = result
+        self._last_history_counter[camera_id] = counter
+        self.image_bucket.append_history(camera_id, HistoryFrame(
+            seq=seq,
+            capture_ts=metadata["timestamp"],
+            receive_ts=receive_ts,
+            width=metadata["width"],
+            height=metadata["height"],
+            data=payload.tobytes(),
+        ))
+
+    def sync(self, camera_id: Optional[str] = None) -> None:
+        """
+        复制该摄像头 (None 表示全部摄像头) 在共享内存中的最新帧, 没有新帧时不复制
+        """
+        self.bus.refresh()
+        if camera_id is not None:
+            slots = self.bus.camera_slots.get(camera_id, None)
+            if slots is not None:
+                self._read_frame(camera_id, slots[0])
+            return
+        for camera_id, (slot, _) in self.bus.camera_slots.items():
+            self._read_frame(camera_id, slot)
+
+    def _on_wake(self) -> None:
+        try:
+            while True:
+                self._socket.recv(64)
+        except BlockingIOError:
+            pass
+
+        try:
+            self.bus.refresh()
+            for camera_id, (slot, history_slot) in self.bus.camera_slots.items():
+                self._read_history(camera_id, history_slot)
+                if self.image_bucket.is_watched(camera_id):
+                    self._read_frame(camera_id, slot)
+        except Exception as e:
+            print(f"Error in listening: {e}")
+
+    async def start_listening(self):
+        if self.is_listening:
+            return
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(_wake_address(self.prefix, os.getpid()))
+        self._socket.setblocking(False)
+        asyncio.get_running_loop().add_reader(self._socket.fileno(), self._on_wake)
+        if not self.bus.add_listener(os.getpid()):
+            print("Too many workers listening on the frame bus, frames are only read on request")
+        self.image_bucket.frame_source = self.sync
+        self.image_bucket.history_read_listeners.append(self.bus.mark_history_read)
+        self.is_listening = True
+        # 启动前写入的历史帧
+        self._on_wake()
+
+    async def stop_listening(self):
+        if not self.is_listening:
+            return
+
+        self.is_listening = False
+        self.image_bucket.frame_source = None
+        self.image_bucket.history_read_listeners.remove(self.bus.mark_history_read)
+        self.bus.remove_listener(os.getpid())
+        asyncio.get_running_loop().remove_reader(self._socket.fileno())
+        self._socket.close()
+        self._socket = None
+        self.bus.close()
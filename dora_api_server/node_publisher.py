@@ -1,16 +1,26 @@
-from typing import Optional
+import asyncio
+import math
+import time
+from typing import Callable, Optional
 
-from dora import Node
 import pyarrow as pa
 
+from dora_api_server.command_queue import CommandQueue, QueuedCommand
+from dora_api_server.node_listener import DoraNodeListener
+
+
+# 离散指令每次移动的距离 (米) 与默认速度
+ARM_STEP = 0.04
+ARM_SPEED = 0.1
+
 
 class ArmCommands:
-    FORWARD = ("movec", pa.array([0.04, 0, 0, 0, 0, 0, 0.1]))
-    BACKWARD = ("movec", pa.array([-0.04, 0, 0, 0, 0, 0, 0.1]))
-    TURN_LEFT = ("movec", pa.array([0, 0.04, 0, 0, 0, 0, 0.1]))
-    TURN_RIGHT = ("movec", pa.array([0, -0.04, 0, 0, 0, 0, 0.1]))
-    DOWN = ("movec", pa.array( [0, 0, -0.04, 0, 0, 0, 0.1]))
-    UP = ("movec", pa.array([0, 0, 0.04, 0, 0, 0, 0.1]))
+    FORWARD = ("movec", pa.array([ARM_STEP, 0, 0, 0, 0, 0, ARM_SPEED]))
+    BACKWARD = ("movec", pa.array([-ARM_STEP, 0, 0, 0, 0, 0, ARM_SPEED]))
+    TURN_LEFT = ("movec", pa.array([0, ARM_STEP, 0, 0, 0, 0, ARM_SPEED]))
+    TURN_RIGHT = ("movec", pa.array([0, -ARM_STEP, 0, 0, 0, 0, ARM_SPEED]))
+    DOWN = ("movec", pa.array([0, 0, -ARM_STEP, 0, 0, 0, ARM_SPEED]))
+    UP = ("movec", pa.array([0, 0, ARM_STEP, 0, 0, 0, ARM_SPEED]))
     SET_HOME = ("save", pa.array(["home"]))
     GO_HOME = ("go_to", pa.array(["home"]))
     HOLD = ("claw", pa.array([0]))
@@ -24,123 +34,391 @@ class ChassisCommands:
     STOP = pa.array(["stop"])
 
 
-import asyncio
-from typing import Optional
+class OutputController:
+    def __init__(self, sender: DoraNodeListener, queue: CommandQueue):
+        # 所有输出经由 DoraNodeListener 的接收线程发送
+        self.sender = sender
+        # 每次发送完成后以 (output_id, 耗时秒) 调用
+        self.send_listeners: list[Callable[[str, float], None]] = []
+        # 指令先进入队列, 由队列的发送任务合并、限速后调用 _send
+        self.queue = queue
+
+    def _submit(self, output_id: str, payload: pa.Array) -> QueuedCommand:
+        return self.queue.submit(output_id, payload)
+
+    async def _send(self, output_id: str, payload: pa.Array):
+        started_at = time.perf_counter()
+        await self.sender.send_output(output_id, payload)
+        for listener in self.send_listeners:
+            listener(output_id, time.perf_counter() - started_at)
+
+
+class ArmWorkspace:
+    """
+    movec 是相对移动, 服务端累计经由本服务提交的位移, 估计末端相对 home 的偏移并检查工作空间.
+
+    limits 为各轴相对 home 的 (下限, 上限), None 表示不限制; go_home / set_home 后偏移归零.
+    其他节点直接移动机械臂时估计会失准, 机械臂节点自身的限制 (如 MIN_Z) 仍然生效.
+    """
+
+    AXES = ("x", "y", "z")
+
+    def __init__(
+            self,
+            limits: Optional[dict[str, tuple[Optional[float], Optional[float]]]] = None,
+            max_step: float = 0.3,
+            max_rotation: float = 0.5,
+            max_speed: float = 1.0,
+    ):
+        self.limits = limits or {}
+        # 单条指令的最大平移 (米, 各轴)、最大旋转 (弧度, 各轴) 与最大速度
+        self.max_step = max_step
+        self.max_rotation = max_rotation
+        self.max_speed = max_speed
+        self.offset = [0.0, 0.0, 0.0]
+
+    def check_command(self, values: list[float]) -> None:
+        """
+        values 为 movec 的 [dx, dy, dz, roll, pitch, yaw, speed], 超出单条指令的限制时抛出 ValueError
+        """
+        if len(values) != 7 or not all(math.isfinite(value) for value in values):
+            raise ValueError("movec requires 7 finite numbers")
+        *deltas, speed = values
+        if not 0 < speed <= self.max_speed:
+            raise ValueError(f"speed must be in (0, {self.max_speed}]")
+        for axis, delta in zip(self.AXES, deltas[:3]):
+            if abs(delta) > self.max_step:
+                raise ValueError(f"d{axis} exceeds the maximum step of {self.max_step} m")
+        for axis, delta in zip(("roll", "pitch", "yaw"), deltas[3:]):
+            if abs(delta) > self.max_rotation:
+                raise ValueError(f"{axis} exceeds the maximum rotation of {self.max_rotation} rad")
+
+    def within_command_limits(self, values: list[float]) -> bool:
+        try:
+            self.check_command(values)
+        except ValueError:
+            return False
+        return True
+
+    def check(self, values: list[float]) -> None:
+        """
+        检查单条指令的限制与移动后的偏移, 超出时抛出 ValueError
+        """
+        self.check_command(values)
+        deltas = values[:3]
+        for axis, offset, delta in zip(self.AXES, self.offset, deltas):
+            low, high = self.limits.get(axis, (None, None))
+            target = offset + delta
+            if (low is not None and target < low - 1e-9) or (high is not None and target > high + 1e-9):
+                raise ValueError(f"{axis} would move to {target:+.3f} m from home, outside [{low}, {high}]")
+
+    def apply(self, values: list[float], sign: float = 1.0) -> None:
+        for index, delta in enumerate(values[:3]):
+            self.offset[index] += sign * delta
+
+    def reset(self) -> None:
+        self.offset = [0.0, 0.0, 0.0]
+
+    def to_dict(self) -> dict:
+        return {
+            "offset": dict(zip(self.AXES, self.offset)),
+            "limits": {axis: list(self.limits.get(axis, (None, None))) for axis in self.AXES},
+            "max_step": self.max_step,
+            "max_rotation": self.max_rotation,
+            "max_speed": self.max_speed,
+        }
+
+
+class ArmController(OutputController):
+    def __init__(
+            self,
+            sender: DoraNodeListener,
+            max_rate: float = 10.0,
+            workspace: Optional[ArmWorkspace] = None,
+    ):
+        # movec 的位姿增量可以相加合并, 合并结果仍需满足单条指令的限制
+        super().__init__(
+            sender,
+            CommandQueue(
+                "arm", self._send, max_rate=max_rate, additive_outputs=("movec",), can_merge=self._can_merge
+            ),
+        )
+        self.workspace = workspace or ArmWorkspace()
 
-class ArmController:
-    def __init__(self, node: Optional[Node], node_lock: asyncio.Lock = asyncio.Lock()):
-        self.node = node if node is not None else Node(node_id="restapi")
-        self.node_lock = node_lock
+    def _submit(self, output_id: str, payload: pa.Array) -> QueuedCommand:
+        if output_id != "movec":
+            command = super()._submit(output_id, payload)
+            if output_id in ("go_to", "save"):
+                # 回到 home 或把当前位置设为 home 后, 偏移从零开始累计
+                self.workspace.reset()
+            return command
+
+        values = payload.to_pylist()
+        self.workspace.check(values)
+        command = super()._submit(output_id, payload)
+        # 提交时就计入偏移, 排队中的指令也参与后续检查; 发送失败时撤销
+        self.workspace.apply(values)
+        command.add_done_callback(self._revert_failed)
+        return command
+
+    def _can_merge(self, output_id: str, values: list) -> bool:
+        return self.workspace.within_command_limits(values)
+
+    def _revert_failed(self, command: QueuedCommand) -> None:
+        # 合并后的指令失败时 values 已包含被合并的增量, 被合并的指令本身不再撤销
+        if command.status == "failed":
+            self.workspace.apply(command.values, sign=-1.0)
+
+    async def move(
+            self,
+            dx: float = 0.0,
+            dy: float = 0.0,
+            dz: float = 0.0,
+            roll: float = 0.0,
+            pitch: float = 0.0,
+            yaw: float = 0.0,
+            speed: float = ARM_SPEED,
+    ):
+        """
+        一条指令完成任意的相对移动, 平移单位为米, 旋转单位为弧度
+        """
+        return self._submit("movec", pa.array([dx, dy, dz, roll, pitch, yaw, speed], type=pa.float64()))
 
     async def forward(self):
-        async with self.node_lock:
-            output_id, payload = ArmCommands.FORWARD
-            self.node.send_output(output_id, payload)
+        output_id, payload = ArmCommands.FORWARD
+        return self._submit(output_id, payload)
 
     async def backward(self):
-        async with self.node_lock:
-            output_id, payload = ArmCommands.BACKWARD
-            self.node.send_output(output_id, payload)
+        output_id, payload = ArmCommands.BACKWARD
+        return self._submit(output_id, payload)
 
     async def turn_left(self):
-        async with self.node_lock:
-            output_id, payload = ArmCommands.TURN_LEFT
-            self.node.send_output(output_id, payload)
+        output_id, payload = ArmCommands.TURN_LEFT
+        return self._submit(output_id, payload)
 
     async def turn_right(self):
-        async with self.node_lock:
-            output_id, payload = ArmCommands.TURN_RIGHT
-            self.node.send_output(output_id, payload)
+        output_id, payload = ArmCommands.TURN_RIGHT
+        return self._submit(output_id, payload)
 
     async def down(self):
-        async with self.node_lock:
-            output_id, payload = ArmCommands.DOWN
-            self.node.send_output(output_id, payload)
+        output_id, payload = ArmCommands.DOWN
+        return self._submit(output_id, payload)
 
     async def up(self):
-        async with self.node_lock:
-            output_id, payload = ArmCommands.UP
-            self.node.send_output(output_id, payload)
+        output_id, payload = ArmCommands.UP
+        return self._submit(output_id, payload)
 
     async def set_home(self):
-        async with self.node_lock:
-            output_id, payload = ArmCommands.SET_HOME
-            self.node.send_output(output_id, payload)
+        output_id, payload = ArmCommands.SET_HOME
+        return self._submit(output_id, payload)
 
     async def go_home(self):
-        async with self.node_lock:
-            output_id, payload = ArmCommands.GO_HOME
-            self.node.send_output(output_id, payload)
+        output_id, payload = ArmCommands.GO_HOME
+        return self._submit(output_id, payload)
 
     async def hold(self):
-        async with self.node_lock:
-            output_id, payload = ArmCommands.HOLD
-            self.node.send_output(output_id, payload)
+        output_id, payload = ArmCommands.HOLD
+        return self._submit(output_id, payload)
 
     async def release(self):
-        async with self.node_lock:
-            output_id, payload = ArmCommands.RELEASE
-            self.node.send_output(output_id, payload)
+        output_id, payload = ArmCommands.RELEASE
+        return self._submit(output_id, payload)
 
 
-class ChassisController:
+class ChassisController(OutputController):
     def __init__(
             self,
-            node: Optional[Node],
+            sender: DoraNodeListener,
             output_id: str = "chassis",
-            node_lock: asyncio.Lock = asyncio.Lock(),
+            max_rate: float = 20.0,
     ):
-        self.node = node if node is not None else Node(node_id="restapi")
+        # 底盘指令是状态, 排队中的指令只需发送最后一条
+        super().__init__(sender, CommandQueue("chassis", self._send, max_rate=max_rate, latest_only=True))
         self.output_id = output_id
-        self.node_lock = node_lock
 
     async def forward(self):
-        async with self.node_lock:
-            self.node.send_output(self.output_id, ChassisCommands.FORWARD)
+        return self._submit(self.output_id, ChassisCommands.FORWARD)
 
     async def backward(self):
-        async with self.node_lock:
-            self.node.send_output(self.output_id, ChassisCommands.BACKWARD)
+        return self._submit(self.output_id, ChassisCommands.BACKWARD)
 
     async def turn_left(self):
-        async with self.node_lock:
-            self.node.send_output(self.output_id, ChassisCommands.TURN_LEFT)
+        return self._submit(self.output_id, ChassisCommands.TURN_LEFT)
 
     async def turn_right(self):
-        async with self.node_lock:
-            self.node.send_output(self.output_id, ChassisCommands.TURN_RIGHT)
+        return self._submit(self.output_id, ChassisCommands.TURN_RIGHT)
 
     async def stop(self):
-        async with self.node_lock:
-            self.node.send_output(self.output_id, ChassisCommands.STOP)
+        return self._submit(self.output_id, ChassisCommands.STOP)
+
+
+class ChassisVelocityDriver:
+    """
+    把速度指令 (linear m/s, angular rad/s) 按固定频率持续发送到底盘, 直到过期或被新指令替换.
+
+    底盘节点只接受 forward / backward / left / right / stop 文本, 因此速度被量化为
+    占主导的方向; 速度大小只用于判断主导方向与死区. 过期后服务端自动发送 stop,
+    客户端断开或停止刷新时底盘不会一直运动.
+    """
+
+    def __init__(
+            self,
+            chassis: ChassisController,
+            rate: float = 10.0,
+            max_duration: float = 2.0,
+            max_linear: float = 0.5,
+            max_angular: float = 1.0,
+            deadband: float = 0.1,
+    ):
+        self.chassis = chassis
+        # 重发频率 (Hz) 与单条指令的最长有效时间 (秒)
+        self.rate = rate
+        self.max_duration = max_duration
+        # 线速度/角速度按各自的最大值归一化后比较, 都小于 deadband 时视为停止
+        self.max_linear = max_linear
+        self.max_angular = max_angular
+        self.deadband = deadband
 
+        self.linear = 0.0
+        self.angular = 0.0
+        self.prompt = "stop"
+        self.expires_at: Optional[float] = None
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def active(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def quantize(self, linear: float, angular: float) -> str:
+        linear_ratio = linear / self.max_linear
+        angular_ratio = angular / self.max_angular
+        if max(abs(linear_ratio), abs(angular_ratio)) < self.deadband:
+            return "stop"
+        if abs(linear_ratio) >= abs(angular_ratio):
+            return "forward" if linear_ratio > 0 else "backward"
+        return "turn_left" if angular_ratio > 0 else "turn_right"
+
+    async def _send(self, prompt: str) -> None:
+        match prompt:
+            case "forward":
+                await self.chassis.forward()
+            case "backward":
+                await self.chassis.backward()
+            case "turn_left":
+                await self.chassis.turn_left()
+            case "turn_right":
+                await self.chassis.turn_right()
+            case _:
+                await self.chassis.stop()
+
+    async def set_velocity(self, linear: float, angular: float, duration: float) -> dict:
+        if not all(math.isfinite(value) for value in (linear, angular, duration)):
+            raise ValueError("linear, angular and duration must be finite numbers")
+        if duration <= 0:
+            raise ValueError("duration must be positive")
+
+        self.linear = linear
+        self.angular = angular
+        self.prompt = self.quantize(linear, angular)
+        if self.prompt == "stop":
+            await self.stop()
+            return self.to_dict()
+
+        self.expires_at = time.time() + min(duration, self.max_duration)
+        if self.active:
+            self._changed.set()
+        else:
+            self._task = asyncio.create_task(self._run())
+        return self.to_dict()
+
+    def cancel(self) -> None:
+        """
+        停止重发但不发送 stop, 用于被其他底盘指令接管时
+        """
+        if self.active:
+            self._task.cancel()
+        self._task = None
+        self.expires_at = None
+
+    async def stop(self) -> None:
+        self.cancel()
+        self.prompt = "stop"
+        self.linear = self.angular = 0.0
+        await self.chassis.stop()
+
+    async def close(self) -> None:
+        if self.active:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            await self.chassis.stop()
+        self._task = None
+
+    async def _run(self) -> None:
+        interval = 1 / self.rate
+        while self.expires_at is not None:
+            self._changed.clear()
+            remaining = self.expires_at - time.time()
+            if remaining <= 0:
+                # 过期后自动停止; 发送 stop 期间收到新指令时继续重发
+                self.prompt = "stop"
+                self.linear = self.angular = 0.0
+                self.expires_at = None
+                await self.chassis.stop()
+                continue
+            try:
+                await self._send(self.prompt)
+            except Exception as e:
+                print(f"Error in sending chassis velocity: {e}")
+            try:
+                # 新指令到达时立即发送, 否则按固定频率重发
+                await asyncio.wait_for(self._changed.wait(), min(interval, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+    def to_dict(self) -> dict:
+        return {
+            "command": self.prompt,
+            "linear": self.linear,
+            "angular": self.angular,
+            "expires_at": self.expires_at,
+            "rate": self.rate,
+        }
 
 
 if __name__ == "__main__":
-    import time
-    node = Node(node_id="restapi")
-    # chassis = ChassisController(node, output_id="chassis")
-    # chassis.forward()
+    from dora_api_server.node_listener import ImagesManager
+
+    async def _demo():
+        listener = DoraNodeListener(image_bucket=ImagesManager())
+        await listener.start_listening()
+        # chassis = ChassisController(listener, output_id="chassis")
+        # await chassis.forward()
+
+        arm = ArmController(listener)
 
-    arm = ArmController(node)
+        try:
+            while True:
+                await arm.forward()
+                await asyncio.sleep(3)
+                await arm.backward()
+                await asyncio.sleep(3)
+                await arm.turn_left()
+                await asyncio.sleep(3)
+                await arm.turn_right()
+                await asyncio.sleep(3)
+                await arm.down()
+                await asyncio.sleep(3)
+                await arm.up()
+                await asyncio.sleep(3)
+                await arm.hold()
+                await asyncio.sleep(3)
+                await arm.release()
+                await asyncio.sleep(3)
+        finally:
+            await listener.stop_listening()
 
     try:
-        while True:
-            arm.forward()
-            time.sleep(3)
-            arm.backward()
-            time.sleep(3)
-            arm.turn_left()
-            time.sleep(3)
-            arm.turn_right()
-            time.sleep(3)
-            arm.down()
-            time.sleep(3)
-            arm.up()
-            time.sleep(3)
-            arm.hold()
-            time.sleep(3)
-            arm.release()
-            time.sleep(3)
+        asyncio.run(_demo())
     except KeyboardInterrupt:
         pass
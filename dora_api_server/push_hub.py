@@ -0,0 +1,272 @@
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from dora_api_server.node_listener import IMAGE_FORMATS, CapturedFrame, ImagesManager
+
+
+class Subscriber:
+    """
+    一个 WebSocket 订阅者的发送队列.
+
+    每个摄像头只保留最新的一帧, 客户端处理不过来时旧帧直接被新帧替换;
+    统计与指令确认放在定长队列中, 满时丢弃最旧的一条.
+    """
+
+    def __init__(
+            self,
+            cameras: Optional[list[str]] = None,
+            fps: float = 10.0,
+            quality: int = 80,
+            max_length: Optional[int] = None,
+            image_format: str = "jpeg",
+            stats: bool = True,
+            queue_size: int = 16,
+    ):
+        # cameras 为 None 表示订阅全部摄像头
+        self.cameras: Optional[set[str]] = self._check_cameras(cameras)
+        self.fps = fps
+        self.quality = quality
+        self.max_length = max_length
+        self.image_format = self._check_format(image_format)
+        self.stats = stats
+
+        self.pending_frames: dict[str, CapturedFrame] = {}
+        self.messages: deque[dict] = deque(maxlen=queue_size)
+        self.next_frame_at: dict[str, float] = {}
+        self.ready = asyncio.Event()
+
+        self.sent_frames = 0
+        self.dropped_frames = 0
+        self.dropped_messages = 0
+
+    def configure(self, options: dict) -> None:
+        if "cameras" in options:
+            self.cameras = self._check_cameras(options["cameras"])
+        if "fps" in options:
+            self.fps = float(options["fps"])
+        if "quality" in options:
+            self.quality = int(options["quality"])
+        if "max_length" in options:
+            self.max_length = int(options["max_length"]) if options["max_length"] else None
+        if "format" in options:
+            self.image_format = self._check_format(options["format"])
+        if "stats" in options:
+            self.stats = bool(options["stats"])
+
+    @staticmethod
+    def _check_cameras(cameras) -> Optional[set[str]]:
+        # 与连接参数相同, 也接受逗号分隔的字符串; 否则必须是摄像头名称列表
+        if cameras is None:
+            return None
+        if isinstance(cameras, str):
+            return {camera for camera in cameras.split(",") if camera}
+        if not isinstance(cameras, list) or not all(isinstance(camera, str) for camera in cameras):
+            raise ValueError(f"cameras must be a list of camera names, got: {cameras!r}")
+        return set(cameras)
+
+    @staticmethod
+    def _check_format(image_format: str) -> str:
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format: {image_format}")
+        return image_format
+
+    def wants(self, camera_id: str) -> bool:
+        return self.fps > 0 and (self.cameras is None or camera_id in self.cameras)
+
+    def frame_timeout(self, now: float) -> Optional[float]:
+        # 距下一帧允许发送的时间, 没有待发送帧时为 None
+        if not self.pending_frames:
+            return None
+        due_at = min(self.next_frame_at.get(camera_id, 0.0) for camera_id in self.pending_frames)
+        return max(due_at - now, 0.0)
+
+    def offer_message(self, message: dict) -> None:
+        if len(self.messages) == self.messages.maxlen:
+            self.dropped_messages += 1
+        self.messages.append(message)
+        self.ready.set()
+
+    def to_dict(self) -> dict:
+        return {
+            "cameras": sorted(self.cameras) if self.cameras is not None else None,
+            "fps": self.fps,
+            "quality": self.quality,
+            "max_length": self.max_length,
+            "format": self.image_format,
+            "sent_frames": self.sent_frames,
+            "dropped_frames": self.dropped_frames,
+            "dropped_messages": self.dropped_messages,
+        }
+
+
+class PushHub:
+    """
+    WebSocket 推送: 新帧到达时立即分发给订阅者, 并定时推送统计与指令确认.
+
+    每个订阅者有独立的发送协程与队列, 慢速客户端只会丢掉自己的旧帧, 不影响其他订阅者.
+    """
+
+    def __init__(
+            self,
+            image_bucket: ImagesManager,
+            stats_provider: Callable[[], dict],
+            command_handler: Callable[[str, str], Awaitable[bool]],
+            stats_interval: float = 1.0,
+    ):
+        self.image_bucket = image_bucket
+        self.stats_provider = stats_provider
+        self.command_handler = command_handler
+        self.stats_interval = stats_interval
+        self.subscribers: set[Subscriber] = set()
+        self._stats_task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.image_bucket.frame_listeners.append(self.on_frame)
+        self.image_bucket.frame_watchers.append(self.wants)
+        if self.stats_interval > 0:
+            self._stats_task = asyncio.create_task(self._publish_stats())
+
+    async def stop(self) -> None:
+        if self.on_frame in self.image_bucket.frame_listeners:
+            self.image_bucket.frame_listeners.remove(self.on_frame)
+        if self.wants in self.image_bucket.frame_watchers:
+            self.image_bucket.frame_watchers.remove(self.wants)
+        if self._stats_task is not None:
+            self._stats_task.cancel()
+            await asyncio.gather(self._stats_task, return_exceptions=True)
+
+    def wants(self, camera_id: str) -> bool:
+        return any(subscriber.wants(camera_id) for subscriber in self.subscribers)
+
+    def on_frame(self, camera_id: str, frame: CapturedFrame) -> None:
+        for subscriber in self.subscribers:
+            if not subscriber.wants(camera_id):
+                continue
+            # 待发送的帧在编码前需要保持缓冲区不被回收
+            self.image_bucket.pin_frame(frame)
+            stale_frame = subscriber.pending_frames.get(camera_id, None)
+            subscriber.pending_frames[camera_id] = frame
+            if stale_frame is not None:
+                subscriber.dropped_frames += 1
+                self.image_bucket.unpin_frame(camera_id, stale_frame)
+            subscriber.ready.set()
+
+    def publish(self, message: dict) -> None:
+        for subscriber in self.subscribers:
+            subscriber.offer_message(message)
+
+    def publish_ack(self, target: str, prompt: str, ok: bool, command_id=None) -> None:
+        self.publish({
+            "type": "ack",
+            "id": command_id,
+            "target": target,
+            "prompt": prompt,
+            "ok": ok,
+            "ts": time.time(),
+        })
+
+    async def _publish_stats(self) -> None:
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            stats = self.stats_provider()
+            for subscriber in self.subscribers:
+                if subscriber.stats:
+                    subscriber.offer_message({"type": "stats", "subscriber": subscriber.to_dict(), **stats})
+
+    async def serve(self, ws, subscriber: Subscriber) -> None:
+        """
+        处理一个 WebSocket 连接直至断开
+        """
+        self.subscribers.add(subscriber)
+        sender = asyncio.create_task(self._send_loop(ws, subscriber))
+        try:
+            await self._receive_loop(ws, subscriber)
+        finally:
+            self.subscribers.discard(subscriber)
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+            for camera_id, frame in subscriber.pending_frames.items():
+                self.image_bucket.unpin_frame(camera_id, frame)
+            subscriber.pending_frames.clear()
+
+    async def _receive_loop(self, ws, subscriber: Subscriber) -> None:
+        async for data in ws:
+            try:
+                message = json.loads(data)
+                match message.get("type", None):
+                    case "subscribe":
+                        subscriber.configure(message)
+                        subscriber.offer_message({"type": "subscribed", **subscriber.to_dict()})
+                    case "command":
+                        target, prompt = message["target"], message["prompt"]
+                        ok = await self.command_handler(target, prompt)
+                        self.publish_ack(target, prompt, ok, command_id=message.get("id", None))
+                    case other:
+                        subscriber.offer_message({"type": "error", "error": f"Unknown message type: {other}"})
+            except Exception as e:
+                subscriber.offer_message({"type": "error", "error": str(e)})
+
+    async def _send_loop(self, ws, subscriber: Subscriber) -> None:
+        """
+        单帧编码失败时回复 error 消息后继续; 其他异常 (如连接已断开) 打印原因并关闭连接, 使接收循环随之结束
+        """
+        try:
+            await self._send_pending(ws, subscriber)
+        except Exception as e:
+            print(f"WebSocket push to subscriber failed: {e!r}")
+            try:
+                await ws.close(code=1011, reason="push failed")
+            except Exception:
+                pass
+
+    async def _send_pending(self, ws, subscriber: Subscriber) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(subscriber.ready.wait(), subscriber.frame_timeout(time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+            subscriber.ready.clear()
+
+            while subscriber.messages:
+                await ws.send(json.dumps(subscriber.messages.popleft()))
+
+            now = time.monotonic()
+            due = [
+                camera_id for camera_id in subscriber.pending_frames
+                if subscriber.next_frame_at.get(camera_id, 0.0) <= now
+            ]
+            for camera_id in due:
+                frame = subscriber.pending_frames.pop(camera_id)
+                try:
+                    encoded = await self.image_bucket.encode_image_async(
+                        camera_id,
+                        jpeg_quality=subscriber.quality,
+                        max_length=subscriber.max_length,
+                        image_format=subscriber.image_format,
+                        frame=frame,
+                    )
+                except Exception as e:
+                    subscriber.offer_message({"type": "error", "camera": camera_id, "error": str(e)})
+                    continue
+                finally:
+                    self.image_bucket.unpin_frame(camera_id, frame)
+                subscriber.next_frame_at[camera_id] = now + (1 / subscriber.fps if subscriber.fps > 0 else 0)
+                if encoded is None:
+                    continue
+
+                # 先发送帧信息, 紧接着发送图像字节
+                await ws.send(json.dumps({
+                    "type": "frame",
+                    "camera": camera_id,
+                    "seq": frame.seq,
+                    "capture_ts": frame.capture_ts,
+                    "receive_ts": frame.receive_ts,
+                    "age_ms": frame.age_ms(time.time()),
+                    "format": subscriber.image_format,
+                    "size": len(encoded),
+                }))
+                await ws.send(encoded)
+                subscriber.sent_frames += 1
@@ -0,0 +1,171 @@
+import asyncio
+import itertools
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+
+class SequenceStep:
+    def __init__(self, target: str, prompt: str, duration: float = 0.0, settle: float = 0.0):
+        self.target = target
+        self.prompt = prompt
+        # 底盘指令持续 duration 秒后自动发送 stop, 为0时不自动停止
+        self.duration = duration
+        # 本步骤完成后等待 settle 秒再执行下一步
+        self.settle = settle
+
+    @classmethod
+    def from_dict(cls, data: dict, valid_prompts: dict[str, set[str]]) -> "SequenceStep":
+        if not isinstance(data, dict):
+            raise ValueError(f"Each step must be a JSON object, got: {data!r}")
+        target = data.get("target", None)
+        prompt = data.get("prompt", None)
+        if target not in valid_prompts:
+            raise ValueError(f"Unknown target: {target}")
+        if prompt not in valid_prompts[target]:
+            raise ValueError(f"Unknown {target} prompt: {prompt}")
+
+        duration = float(data.get("duration", 0.0))
+        settle = float(data.get("settle", 0.0))
+        if duration < 0 or settle < 0:
+            raise ValueError("duration and settle must be non-negative")
+        if duration > 0 and target != "chassis":
+            raise ValueError("duration is only supported for chassis steps")
+        return cls(target=target, prompt=prompt, duration=duration, settle=settle)
+
+    def to_dict(self) -> dict:
+        return {
+            "target": self.target,
+            "prompt": self.prompt,
+            "duration": self.duration,
+            "settle": self.settle,
+        }
+
+
+class SequenceJob:
+    def __init__(self, job_id: str, steps: list[SequenceStep]):
+        self.job_id = job_id
+        self.steps = steps
+        # queued -> running -> done / cancelled / failed
+        self.status = "queued"
+        self.current_step: Optional[int] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "cancelled", "failed")
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "current_step": self.current_step,
+            "steps": [step.to_dict() for step in self.steps],
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class SequenceRunner:
+    """
+    在服务端按顺序执行一组机械臂/底盘指令, 步骤间的等待由服务端控制.
+
+    同一时间只执行一个序列, 后提交的序列排队等待, 避免不同序列的动作交错.
+    取消正在移动底盘的序列时会发送 stop.
+    """
+
+    def __init__(
+            self,
+            command_handler: Callable[[str, str], Awaitable[bool]],
+            valid_prompts: dict[str, set[str]],
+            max_finished_jobs: int = 32,
+    ):
+        self.command_handler = command_handler
+        self.valid_prompts = valid_prompts
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs: OrderedDict[str, SequenceJob] = OrderedDict()
+        self._job_ids = itertools.count(1)
+        self._lock = asyncio.Lock()
+
+    def submit(self, steps: list[dict]) -> SequenceJob:
+        """
+        校验全部步骤后再开始执行, 任何一步无效时整个序列都不会执行
+        """
+        if not isinstance(steps, list):
+            raise ValueError("steps must be a list")
+        if not steps:
+            raise ValueError("steps must not be empty")
+        parsed_steps = [SequenceStep.from_dict(step, self.valid_prompts) for step in steps]
+
+        job = SequenceJob(job_id=f"seq-{next(self._job_ids)}", steps=parsed_steps)
+        job.task = asyncio.create_task(self._run(job))
+        self.jobs[job.job_id] = job
+        self._prune()
+        return job
+
+    def get(self, job_id: str) -> Optional[SequenceJob]:
+        return self.jobs.get(job_id, None)
+
+    def cancel(self, job_id: str) -> Optional[SequenceJob]:
+        job = self.jobs.get(job_id, None)
+        if job is not None and not job.finished:
+            job.task.cancel()
+        return job
+
+    async def wait(self, job: SequenceJob, timeout: Optional[float]) -> None:
+        if job.finished:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(job.task), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def stop(self) -> None:
+        tasks = [job.task for job in self.jobs.values() if not job.finished]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.max_finished_jobs, 0)]:
+            del self.jobs[job_id]
+
+    async def _run(self, job: SequenceJob) -> None:
+        chassis_moving = False
+        try:
+            async with self._lock:
+                job.status = "running"
+                job.started_at = time.time()
+                for index, step in enumerate(job.steps):
+                    job.current_step = index
+                    if not await self.command_handler(step.target, step.prompt):
+                        raise RuntimeError(f"{step.target} command failed: {step.prompt}")
+                    if step.target == "chassis":
+                        chassis_moving = step.prompt != "stop"
+
+                    if step.duration > 0:
+                        await asyncio.sleep(step.duration)
+                        await self.command_handler("chassis", "stop")
+                        chassis_moving = False
+                    if step.settle > 0:
+                        await asyncio.sleep(step.settle)
+                job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            if chassis_moving:
+                await self.command_handler("chassis", "stop")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            if chassis_moving:
+                await self.command_handler("chassis", "stop")
+        finally:
+            job.finished_at = time.time()
+            self._prune()
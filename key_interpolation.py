@@ -1,42 +1,128 @@
-from dora import Node
+import json
+import os
+import time
+from typing import Optional
+
 import pyarrow as pa
+from dora import Node
+
+# 默认按键映射; 值可以是文本, 也可以是 {"text": 按下时发送的文本, "release": 松开时发送的文本}
+DEFAULT_KEY_MAP = {
+    "w": "forward",
+    "s": "backward",
+    "d": "right",
+    "a": "left",
+    "q": "stop",
+    "r": "open",
+    "t": "close",
+    "u": "arm forward",
+    "j": "arm backward",
+    "h": "arm left",
+    "k": "arm right",
+    "y": "arm down",
+    "i": "arm up",
+    "v": "go home",
+    "b": "save home",
+}
+# 按住按键时重复发送的最高频率 (Hz)
+REPEAT_RATE = float(os.environ.get("KEY_REPEAT_RATE", 4))
+# dora-keyboard 只发送按下事件, 超过这么久 (秒) 没有收到同一按键即视为松开;
+# 需要大于系统键盘自动重复的初始延迟
+RELEASE_TIMEOUT = float(os.environ.get("KEY_RELEASE_TIMEOUT", 0.7))
+
+
+def load_key_map() -> dict[str, dict]:
+    """
+    KEY_MAP 可以是JSON字符串或JSON文件路径, 未设置时使用 DEFAULT_KEY_MAP
+    """
+    config = os.environ.get("KEY_MAP", "")
+    if not config:
+        key_map = DEFAULT_KEY_MAP
+    elif os.path.isfile(config):
+        with open(config, encoding="utf-8") as f:
+            key_map = json.load(f)
+    else:
+        key_map = json.loads(config)
+
+    bindings = {}
+    for key, binding in key_map.items():
+        if isinstance(binding, str):
+            binding = {"text": binding}
+        bindings[key] = {"text": binding["text"], "release": binding.get("release", None)}
+    return bindings
+
+
+class KeyDebouncer:
+    """
+    把键盘按下事件整理为指令: 按下时立即发送, 按住期间 (包括系统自动重复与快速连按) 最多按 repeat_rate 重复发送,
+    连按之间的多余事件合并为一次; 松开后发送映射中的 release 文本 (如底盘的 stop).
+    """
+
+    def __init__(self, node: Node, key_map: dict[str, dict], repeat_rate: float = REPEAT_RATE,
+                 release_timeout: float = RELEASE_TIMEOUT):
+        self.node = node
+        self.key_map = key_map
+        self.repeat_interval = 1 / repeat_rate if repeat_rate > 0 else 0.0
+        self.release_timeout = release_timeout
+        # 按住的按键: {"last_press_at", "last_sent_at", "pending"}
+        self.held: dict[str, dict] = {}
+        self._payloads: dict[str, pa.Array] = {}
+
+    def _send(self, text: str) -> None:
+        payload = self._payloads.get(text, None)
+        if payload is None:
+            payload = self._payloads[text] = pa.array([text])
+        self.node.send_output("text", payload)
+
+    def press(self, key: str, now: float) -> None:
+        if key not in self.key_map:
+            return
+        state = self.held.get(key, None)
+        if state is None:
+            self._send(self.key_map[key]["text"])
+            self.held[key] = {"last_press_at": now, "last_sent_at": now, "pending": False}
+            return
+        state["last_press_at"] = now
+        state["pending"] = True
+        self.update(now)
+
+    def update(self, now: float) -> None:
+        for key, state in list(self.held.items()):
+            if state["pending"] and now - state["last_sent_at"] >= self.repeat_interval:
+                self._send(self.key_map[key]["text"])
+                state["last_sent_at"] = now
+                state["pending"] = False
+            if not state["pending"] and now - state["last_press_at"] >= self.release_timeout:
+                del self.held[key]
+                if self.key_map[key]["release"]:
+                    self._send(self.key_map[key]["release"])
+
+    def timeout(self, now: float) -> Optional[float]:
+        # 距下一次需要重复发送或判定松开的时间, 没有按住的按键时为 None
+        due = [
+            state["last_sent_at"] + self.repeat_interval if state["pending"]
+            else state["last_press_at"] + self.release_timeout
+            for state in self.held.values()
+        ]
+        return max(min(due) - now, 0.0) if due else None
+
+
+def main():
+    node = Node()
+    debouncer = KeyDebouncer(node, load_key_map())
+
+    while True:
+        timeout = debouncer.timeout(time.monotonic())
+        event = node.next(timeout=timeout) if timeout is not None else node.next()
+        if event is None:
+            if timeout is None:
+                break
+        elif event["type"] == "STOP":
+            break
+        elif event["type"] == "INPUT" and event["id"] == "keyboard":
+            debouncer.press(event["value"][0].as_py(), time.monotonic())
+        debouncer.update(time.monotonic())
+
 
-node = Node()
-
-
-for event in node:
-    if event["type"] == "INPUT":
-        if event["id"] == "keyboard":
-            char = event["value"][0].as_py()
-            if char == "w":
-                print(" w ", event["value"])
-                node.send_output("text", pa.array(["forward"]))
-            elif char == "s":
-                node.send_output("text", pa.array(["backward"]))
-                # node.send_output("text", pa.array(["stop"]))
-            elif char == "d":
-                node.send_output("text", pa.array(["right"]))
-            elif char == "a":
-                node.send_output("text", pa.array(["left"]))
-            elif char == "q":
-                node.send_output("text", pa.array(["stop"]))
-            elif char == "r":
-                node.send_output("text", pa.array(["open"]))
-            elif char == "t":
-                node.send_output("text", pa.array(["close"]))
-            elif char == "u":
-                node.send_output("text", pa.array(["arm forward"]))
-            elif char == "j":
-                node.send_output("text", pa.array(["arm backward"]))
-            elif char == "h":
-                node.send_output("text", pa.array(["arm left"]))
-            elif char == "k":
-                node.send_output("text", pa.array(["arm right"]))
-            elif char == "y":
-                node.send_output("text", pa.array(["arm down"]))
-            elif char == "i":
-                node.send_output("text", pa.array(["arm up"]))
-            elif char == "v":
-                node.send_output("text", pa.array(["go home"]))
-            elif char == "b":
-                node.send_output("text", pa.array(["save home"]))
+if __name__ == "__main__":
+    main()
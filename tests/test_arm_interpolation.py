@@ -0,0 +1,42 @@
+import numpy as np
+
+from arm_interpolation import TrajectoryStreamer, plan_commands
+
+
+class RecordingNode:
+    def __init__(self):
+        self.sent: list[tuple[str, list]] = []
+
+    def send_output(self, output_id, data, metadata=None):
+        self.sent.append((output_id, data.to_pylist()))
+
+
+def _motion(plan) -> list[tuple]:
+    return [value[0] for output_id, value in plan if output_id == "movec"]
+
+
+def test_different_directions_stay_in_order():
+    assert _motion(plan_commands("arm up then arm forward")) == [
+        (0, 0, 0.04, 0, 0, 0),
+        (0.04, 0, 0, 0, 0, 0),
+    ]
+
+
+def test_same_direction_moves_are_merged():
+    assert _motion(plan_commands("arm forward 2 then arm forward")) == [(0.12, 0, 0, 0, 0, 0)]
+
+
+def test_streamer_finishes_each_segment_before_the_next():
+    node = RecordingNode()
+    streamer = TrajectoryStreamer(node)
+    streamer.start(plan_commands("arm up then arm forward"))
+    while streamer.active:
+        streamer.next_send_at = 0.0
+        streamer.step()
+
+    steps = np.array([values[:6] for output_id, values in node.sent if output_id == "movec"])
+    # 先只有 z 方向, 之后只有 x 方向, 任何一步都不是斜向运动
+    assert not np.any((np.abs(steps[:, 0]) > 1e-12) & (np.abs(steps[:, 2]) > 1e-12))
+    switch = int(np.argmax(np.abs(steps[:, 0]) > 1e-12))
+    assert np.allclose(steps[:switch, 2].sum(), 0.04)
+    assert np.allclose(steps[switch:, 0].sum(), 0.04)
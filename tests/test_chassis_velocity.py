@@ -0,0 +1,42 @@
+import asyncio
+
+from dora_api_server.control import ControlCenter
+from dora_api_server.node_publisher import ArmController, ChassisController, ChassisVelocityDriver
+
+
+class RecordingSender:
+    def __init__(self):
+        self.sent: list[str] = []
+
+    async def send_output(self, output_id, data, metadata=None):
+        self.sent.append(data.to_pylist()[0])
+
+
+async def _drive_then_submit(prompt: str):
+    sender = RecordingSender()
+    chassis = ChassisController(sender, max_rate=0)
+    control = ControlCenter(
+        ArmController(sender), chassis, ChassisVelocityDriver(chassis, rate=50, max_duration=0.2)
+    )
+
+    await control.set_velocity(0.4, 0.0, 0.15)
+    await asyncio.sleep(0.05)
+    command = await control.submit_chassis(prompt)
+    # 超过速度指令的有效时间
+    await asyncio.sleep(0.3)
+    await chassis.queue.stop()
+    return command, sender.sent
+
+
+def test_rejected_prompt_keeps_expiry_stop():
+    command, sent = asyncio.run(_drive_then_submit("bogus"))
+    assert command is None
+    assert "forward" in sent
+    assert sent[-1] == "stop"
+
+
+def test_discrete_prompt_takes_over_velocity():
+    command, sent = asyncio.run(_drive_then_submit("turn_left"))
+    assert command is not None
+    assert sent[-1] == "left"
+    assert "stop" not in sent
@@ -0,0 +1,123 @@
+import asyncio
+
+import pyarrow as pa
+
+from dora_api_server.command_queue import CommandQueue
+
+
+class RecordingSender:
+    def __init__(self, error: Exception = None):
+        self.sent: list[tuple[str, list]] = []
+        self.error = error
+
+    async def send(self, output_id, payload):
+        if self.error is not None:
+            raise self.error
+        self.sent.append((output_id, payload.to_pylist()))
+
+
+def _movec(dx: float, speed: float = 1.0) -> pa.Array:
+    return pa.array([dx, 0.0, 0.0, 0.0, 0.0, 0.0, speed])
+
+
+async def _submit_all(queue: CommandQueue, payloads: list[tuple[str, pa.Array]]):
+    # 全部在发送任务运行前提交, 保证都在排队中
+    commands = [queue.submit(output_id, payload) for output_id, payload in payloads]
+    await asyncio.gather(*(command.wait() for command in commands))
+    await queue.stop()
+    return commands
+
+
+def test_chained_merges_point_at_the_sent_command():
+    async def run():
+        sender = RecordingSender()
+        queue = CommandQueue("arm", sender.send, max_rate=0, additive_outputs=("movec",))
+        commands = await _submit_all(queue, [("movec", _movec(0.01)) for _ in range(4)])
+        return sender, commands
+
+    sender, commands = asyncio.run(run())
+    *merged, last = commands
+    assert sender.sent == [("movec", [0.04, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0])]
+    assert last.status == "sent"
+    assert [command.command_id for command in last.merged] == [command.command_id for command in merged]
+    for command in merged:
+        assert command.status == "merged"
+        assert command.merged_into == last.command_id
+
+
+def test_repeated_discrete_commands_are_merged_but_different_ones_are_not():
+    async def run():
+        sender = RecordingSender()
+        queue = CommandQueue("chassis", sender.send, max_rate=0)
+        await _submit_all(queue, [
+            ("action", pa.array(["forward"])),
+            ("action", pa.array(["forward"])),
+            ("action", pa.array(["stop"])),
+        ])
+        return sender
+
+    assert asyncio.run(run()).sent == [("action", ["forward"]), ("action", ["stop"])]
+
+
+def test_can_merge_keeps_commands_apart():
+    async def run():
+        sender = RecordingSender()
+        queue = CommandQueue(
+            "arm", sender.send, max_rate=0, additive_outputs=("movec",),
+            can_merge=lambda output_id, values: abs(values[0]) <= 0.015,
+        )
+        await _submit_all(queue, [("movec", _movec(0.01)), ("movec", _movec(0.01))])
+        return sender
+
+    assert [values[0] for _, values in asyncio.run(run()).sent] == [0.01, 0.01]
+
+
+def test_opposite_moves_cancel_out():
+    async def run():
+        sender = RecordingSender()
+        queue = CommandQueue("arm", sender.send, max_rate=0, additive_outputs=("movec",))
+        commands = await _submit_all(queue, [
+            ("movec", _movec(0.01)),
+            ("movec", _movec(0.01)),
+            ("movec", _movec(-0.02)),
+        ])
+        return sender, commands
+
+    sender, commands = asyncio.run(run())
+    assert sender.sent == []
+    for command in commands:
+        assert command.status == "merged"
+        assert command.merged_into is None
+        assert command.finished
+
+
+def test_failed_send_fails_the_merged_commands():
+    async def run():
+        queue = CommandQueue("arm", RecordingSender(RuntimeError("node closed")).send, max_rate=0,
+                             additive_outputs=("movec",))
+        commands = [queue.submit("movec", _movec(0.01)) for _ in range(3)]
+        results = await asyncio.gather(*(command.wait() for command in commands))
+        await queue.stop()
+        return commands, results
+
+    commands, results = asyncio.run(run())
+    assert results == [False, False, False]
+    for command in commands:
+        assert command.status == "failed"
+        assert command.error == "node closed"
+
+
+def test_stop_fails_the_pending_commands():
+    async def run():
+        sender = RecordingSender()
+        queue = CommandQueue("chassis", sender.send, max_rate=1.0)
+        first = queue.submit("action", pa.array(["forward"]))
+        await first.wait()
+        second = queue.submit("action", pa.array(["stop"]))
+        await queue.stop(timeout=0.05)
+        return second, await second.wait()
+
+    second, ok = asyncio.run(run())
+    assert not ok
+    assert second.status == "failed"
+    assert second.error == "Command queue stopped"
@@ -0,0 +1,47 @@
+import numpy as np
+import pyarrow as pa
+
+from dora_api_server.node_listener import ImagesManager
+
+WIDTH, HEIGHT = 64, 48
+
+
+def _event(camera_id: str = "image_1") -> dict:
+    pixels = np.random.randint(0, 255, WIDTH * HEIGHT * 3, dtype=np.uint8)
+    return {
+        "type": "INPUT",
+        "id": camera_id,
+        "value": pa.array(pixels),
+        "metadata": {"encoding": "rgb8", "width": WIDTH, "height": HEIGHT},
+    }
+
+
+def _receive(image_bucket: ImagesManager, count: int, start_ts: float) -> None:
+    for index in range(count):
+        image_bucket.on_image(_event(), receive_ts=start_ts + index * 0.25)
+
+
+def test_history_is_not_recorded_until_read():
+    image_bucket = ImagesManager(history_interval=0.2, history_idle_timeout=30.0)
+    _receive(image_bucket, 5, start_ts=0.0)
+
+    assert image_bucket.get_stats("image_1").decoded == 0
+    assert image_bucket.get_history("image_1") is None
+
+
+def test_history_is_recorded_after_read_without_using_encode_cache():
+    image_bucket = ImagesManager(history_interval=0.2, history_idle_timeout=30.0)
+    image_bucket.get_history("image_1")
+    read_at = image_bucket._history_read_at
+    _receive(image_bucket, 5, start_ts=read_at)
+
+    assert len(image_bucket.get_history("image_1")) == 5
+    assert not image_bucket._encode_cache
+
+
+def test_history_stops_after_idle_timeout():
+    image_bucket = ImagesManager(history_interval=0.2, history_idle_timeout=1.0)
+    image_bucket.get_history("image_1")
+    _receive(image_bucket, 3, start_ts=image_bucket._history_read_at + 5.0)
+
+    assert len(image_bucket.histories.get("image_1", [])) == 0
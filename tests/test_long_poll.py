@@ -0,0 +1,88 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pyarrow as pa
+
+from dora_api_server.app import _frame_etag, _poll_frame, _unchanged_response, app
+from dora_api_server.node_listener import ImagesManager
+
+WIDTH, HEIGHT = 64, 48
+
+app.ctx.etag_prefix = "test"
+app.ctx.long_poll_max_timeout = 1.0
+
+
+def _event(camera_id: str = "image_1") -> dict:
+    pixels = np.zeros(WIDTH * HEIGHT * 3, dtype=np.uint8)
+    return {
+        "type": "INPUT",
+        "id": camera_id,
+        "value": pa.array(pixels),
+        "metadata": {"encoding": "rgb8", "width": WIDTH, "height": HEIGHT},
+    }
+
+
+def _request(args: dict = None, headers: dict = None):
+    # 只用到 args 与 headers; sanic 的请求头名称为小写
+    return SimpleNamespace(
+        args=args or {},
+        headers={name.lower(): value for name, value in (headers or {}).items()},
+    )
+
+
+def _poll(image_bucket: ImagesManager, request, on_wait=None):
+    async def run():
+        if on_wait is not None:
+            asyncio.get_running_loop().call_later(0.02, on_wait)
+        frame, timed_out = await _poll_frame(request, image_bucket, "image_1")
+        return frame, _unchanged_response(request, frame, timed_out)
+
+    return asyncio.run(run())
+
+
+def _image_bucket() -> ImagesManager:
+    image_bucket = ImagesManager()
+    image_bucket.on_image(_event())
+    return image_bucket
+
+
+def test_timeout_without_etag_returns_204():
+    image_bucket = _image_bucket()
+    frame = image_bucket.get_frame("image_1")
+    _, response = _poll(image_bucket, _request({"after_seq": str(frame.seq), "timeout": "0.05"}))
+
+    assert response.status == 204
+    assert response.headers["X-Timed-Out"] == "1"
+    assert response.headers["ETag"] == _frame_etag(frame)
+
+
+def test_timeout_with_matching_etag_returns_304():
+    image_bucket = _image_bucket()
+    frame = image_bucket.get_frame("image_1")
+    request = _request({"after_seq": str(frame.seq), "timeout": "0.05"}, {"If-None-Match": _frame_etag(frame)})
+    _, response = _poll(image_bucket, request)
+
+    assert response.status == 304
+    assert "X-Timed-Out" not in response.headers
+
+
+def test_matching_etag_without_long_poll_returns_304():
+    image_bucket = _image_bucket()
+    request = _request(headers={"If-None-Match": _frame_etag(image_bucket.get_frame("image_1"))})
+    _, response = _poll(image_bucket, request)
+
+    assert response.status == 304
+
+
+def test_new_frame_during_long_poll_is_returned():
+    image_bucket = _image_bucket()
+    seq = image_bucket.get_frame("image_1").seq
+    frame, response = _poll(
+        image_bucket,
+        _request({"after_seq": str(seq), "timeout": "1"}),
+        on_wait=lambda: image_bucket.on_image(_event()),
+    )
+
+    assert response is None
+    assert frame.seq > seq